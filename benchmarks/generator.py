@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+
+import os
+import random
+import shutil
+
+class TreeGenerator:
+  """
+  Class generating reproducible synthetic source trees for the benchmarks and simulating generations of changes between the backups. The tree consists of many tiny files, a few huge files, deep nesting, heavily duplicated files and sparse files.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # shapes of the trees, sizes are in bytes
+  PROFILES = {
+    'tiny': {
+      'tinyFiles': 300,
+      'tinySize': 4096,
+      'hugeFiles': 1,
+      'hugeSize': 2*1024*1024,
+      'deepDepth': 10,
+      'deepFiles': 3,
+      'duplicateFiles': 20,
+      'duplicateCopies': 3,
+      'duplicateSize': 16384,
+      'sparseFiles': 1,
+      'sparseSize': 4*1024*1024,
+      'changeRatio': 0.1,
+    },
+    'small': {
+      'tinyFiles': 2000,
+      'tinySize': 4096,
+      'hugeFiles': 2,
+      'hugeSize': 16*1024*1024,
+      'deepDepth': 40,
+      'deepFiles': 5,
+      'duplicateFiles': 100,
+      'duplicateCopies': 5,
+      'duplicateSize': 65536,
+      'sparseFiles': 3,
+      'sparseSize': 64*1024*1024,
+      'changeRatio': 0.05,
+    },
+    'large': {
+      'tinyFiles': 50000,
+      'tinySize': 4096,
+      'hugeFiles': 4,
+      'hugeSize': 512*1024*1024,
+      'deepDepth': 100,
+      'deepFiles': 10,
+      'duplicateFiles': 2000,
+      'duplicateCopies': 10,
+      'duplicateSize': 262144,
+      'sparseFiles': 10,
+      'sparseSize': 1024*1024*1024,
+      'changeRatio': 0.02,
+    },
+  }
+
+
+  def __init__(self, root, profile='small', seed=0):
+    """
+    Initialization of the object.
+
+    Args:
+      root (str): folder to generate the tree into
+      profile (str): name of the shape of the tree
+      seed (int): seed of the random generator
+
+    Returns:
+      None
+    """
+
+    self.root = root
+    self.shape = TreeGenerator.PROFILES[profile]
+    self.random = random.Random(seed)
+
+
+  def generate(self):
+    """
+    Generates the whole tree.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.tiny()
+    self.huge()
+    self.deep()
+    self.duplicate()
+    self.sparse()
+
+
+  def tiny(self):
+    """
+    Generates many tiny files in a few hundred directories.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    for i in range(self.shape['tinyFiles']):
+      path = os.path.join(self.root, 'tiny', 'd{:03d}'.format(i % 200), 'f{:06d}'.format(i))
+      self.__write(path, self.random.randint(0, self.shape['tinySize']))
+
+
+  def huge(self):
+    """
+    Generates a few huge files.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    for i in range(self.shape['hugeFiles']):
+      self.__write(os.path.join(self.root, 'huge', 'f{:02d}'.format(i)), self.shape['hugeSize'])
+
+
+  def deep(self):
+    """
+    Generates deeply nested directories with a few files on every level.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    path = os.path.join(self.root, 'deep')
+    for level in range(self.shape['deepDepth']):
+      path = os.path.join(path, 'l{:03d}'.format(level))
+      for i in range(self.shape['deepFiles']):
+        self.__write(os.path.join(path, 'f{:02d}'.format(i)), self.random.randint(0, self.shape['tinySize']))
+
+
+  def duplicate(self):
+    """
+    Generates files stored several times under different names.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    for i in range(self.shape['duplicateFiles']):
+      data = self.random.randbytes(self.shape['duplicateSize'])
+      for copy in range(self.shape['duplicateCopies']):
+        path = os.path.join(self.root, 'duplicate', 'c{:02d}'.format(copy), 'f{:05d}'.format(i))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+          f.write(data)
+
+
+  def sparse(self):
+    """
+    Generates sparse files with a few data blocks.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    for i in range(self.shape['sparseFiles']):
+      path = os.path.join(self.root, 'sparse', 'f{:02d}'.format(i))
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, 'wb') as f:
+        for block in range(8):
+          f.seek(self.random.randrange(0, self.shape['sparseSize'] - 65536))
+          f.write(self.random.randbytes(65536))
+        f.truncate(self.shape['sparseSize'])
+
+
+  def mutate(self, generation):
+    """
+    Simulates the changes between two backups: modifies, touches, removes, adds and duplicates part of the files.
+
+    Args:
+      generation (int): number of the generation, used in the names of the added files
+
+    Returns:
+      dict: number of the changed files by the kind of the change
+    """
+
+    files = []
+    for root, dirs, names in os.walk(self.root):
+      dirs.sort()
+      for name in sorted(names):
+        files.append(os.path.join(root, name))
+    count = max(int(len(files)*self.shape['changeRatio']), 1)
+    changes = {'modified': 0, 'touched': 0, 'removed': 0, 'added': 0, 'duplicated': 0}
+
+    for path in self.random.sample(files, min(count*3, len(files))):
+      kind = self.random.choice(['modified', 'touched', 'removed'])
+      stat = os.stat(path)
+      if kind == 'modified':
+        with open(path, 'r+b') as f:
+          f.seek(self.random.randrange(0, max(stat.st_size, 1)))
+          f.write(self.random.randbytes(16))
+      elif kind == 'touched':
+        os.utime(path, (stat.st_atime, stat.st_mtime + 3600))
+      else:
+        os.remove(path)
+      changes[kind] += 1
+
+    for i in range(count):
+      self.__write(os.path.join(self.root, 'added', 'g{:03d}'.format(generation), 'f{:05d}'.format(i)), self.random.randint(0, self.shape['tinySize']))
+      changes['added'] += 1
+
+    existing = [path for path in files if os.path.isfile(path)]
+    for i, path in enumerate(self.random.sample(existing, min(count, len(existing)))):
+      target = os.path.join(self.root, 'copied', 'g{:03d}'.format(generation), 'f{:05d}'.format(i))
+      os.makedirs(os.path.dirname(target), exist_ok=True)
+      shutil.copyfile(path, target)
+      changes['duplicated'] += 1
+
+    return changes
+
+
+  def __write(self, path, size):
+    """
+    Writes the file with random content.
+
+    Args:
+      path (str): path to the file
+      size (int): size of the file
+
+    Returns:
+      None
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+      while size > 0:
+        chunk = min(size, 1048576)
+        f.write(self.random.randbytes(chunk))
+        size -= chunk
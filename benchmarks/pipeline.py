@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+"""
+Comparison of the staged pipeline of the backup with the sequential loop.
+
+Generates the source tree, creates several generations of its backups once with the sequential loop and once with the pipeline and checks that both produce the same backups and the same databases. Durations of both are printed.
+
+Usage:
+  python -m benchmarks.pipeline [--profile small] [--generations 3]
+
+by Pavel Trutman, pavel.trutman@fel.cvut.cz
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from .generator import TreeGenerator
+from .run import quiet, countFiles
+from goldFish.backup import Backup
+
+
+def configure(work, src, pipeline):
+  """
+  Creates the folders of the backups and the configuration file.
+
+  Args:
+    work (str): folder for the backups
+    src (str): source folder
+    pipeline (bool): whether to use the pipeline
+
+  Returns:
+    str: path to the configuration file
+  """
+
+  dest = os.path.join(work, 'dest')
+  db = os.path.join(work, 'db')
+  os.mkdir(work)
+  os.mkdir(dest)
+  os.mkdir(db)
+  configFile = os.path.join(work, 'config.yml')
+  with open(configFile, 'w') as f:
+    f.write('folders:\n  dest: {}\n  src:\n  - {}\ndatabase:\n  enable: True\n  path: {}\n  linkMtimeDiffer: False\nperformance:\n  hashWorkers: 4\n  pipeline: {}\n'.format(dest, src, db, pipeline))
+  return configFile
+
+
+def state(work):
+  """
+  Describes the backups and their databases.
+
+  Args:
+    work (str): folder with the backups
+
+  Returns:
+    dict: files of the backups with their size and number of links and rows of the databases
+  """
+
+  dest = os.path.join(work, 'dest')
+  files = {}
+  for root, dirs, names in os.walk(dest):
+    for name in names:
+      path = os.path.join(root, name)
+      stat = os.lstat(path)
+      files[os.path.relpath(path, dest)] = (stat.st_size, stat.st_nlink)
+
+  rows = {}
+  dbPath = os.path.join(work, 'db')
+  for name in sorted(os.listdir(dbPath)):
+    if name.endswith('.sqlite'):
+      connection = sqlite3.connect(os.path.join(dbPath, name))
+      rows[name] = sorted(connection.execute('SELECT folders.name, files.path, files.mtime, hashes.hash, hashes.size, hashes.symlink FROM files JOIN folders ON folders.id = files.folderId JOIN hashes ON hashes.id = files.hashId').fetchall())
+      connection.close()
+  return {'files': files, 'rows': rows}
+
+
+def main(argv=None):
+  """
+  Compares the pipeline with the sequential loop.
+
+  Args:
+    argv (list of str): command line arguments
+
+  Returns:
+    int: exit code, 1 when the backups differ
+  """
+
+  parser = argparse.ArgumentParser(description='Comparison of the staged pipeline of the backup with the sequential loop.')
+  parser.add_argument('--profile', choices=sorted(TreeGenerator.PROFILES.keys()), default='small', help='shape of the source tree')
+  parser.add_argument('--generations', type=int, default=3, help='number of the backups')
+  parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+  parser.add_argument('--workdir', default=None, help='folder for the temporary trees, system temporary folder by default')
+  args = parser.parse_args(argv)
+
+  with tempfile.TemporaryDirectory(prefix='goldFish-pipeline-', dir=args.workdir) as work:
+    # sources of all generations are generated first, so that both runs back up the same files
+    src = os.path.join(work, 'src')
+    generator = TreeGenerator(src, args.profile, args.seed)
+    generator.generate()
+    print('Generated {} files'.format(countFiles(src)))
+    sources = []
+    for generation in range(args.generations):
+      if generation > 0:
+        generator.mutate(generation)
+      sources.append(os.path.join(work, 'generation{}'.format(generation)))
+      shutil.copytree(src, sources[-1], symlinks=True)
+    shutil.rmtree(src)
+
+    states = {}
+    for pipeline in [False, True]:
+      configFile = configure(os.path.join(work, 'pipeline' if pipeline else 'loop'), src, pipeline)
+      durations = []
+      for generation, source in enumerate(sources):
+        os.rename(source, src)
+        try:
+          durations.append(quiet(Backup.main, configFile, False, name='20000101_{:04d}'.format(generation)))
+        finally:
+          os.rename(src, source)
+      states[pipeline] = state(os.path.dirname(configFile))
+      print('{:<10} first {:>8.3f} s, incremental {:>8.3f} s'.format('pipeline:' if pipeline else 'loop:', durations[0], sum(durations[1:])/max(len(durations) - 1, 1)))
+
+  differences = 0
+  loop, pipe = states[False], states[True]
+  for path in sorted(set(loop['files']) | set(pipe['files'])):
+    if loop['files'].get(path) != pipe['files'].get(path):
+      print('File {} differs: {} in the loop, {} in the pipeline'.format(path, loop['files'].get(path), pipe['files'].get(path)))
+      differences += 1
+  for name in sorted(set(loop['rows']) | set(pipe['rows'])):
+    if loop['rows'].get(name) != pipe['rows'].get(name):
+      print('Database {} differs'.format(name))
+      differences += 1
+  if differences > 0:
+    return 1
+  print('Pipeline produced the same backups as the loop.')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
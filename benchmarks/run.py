@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks of GoldFish on synthetic backup trees.
+
+Generates the source tree in a temporary folder, creates several generations of backups of it and measures the backup, the size of the backups, the listing of the backups, the lookups in the database and the deletion of the oldest backup. The whole run is repeated and the median result of each benchmark is kept, the quick benchmarks are repeated also inside each run and their fastest result is taken. The results are compared with the stored baseline, the benchmarks shorter than SHORT seconds with a larger threshold, as they are dominated by the noise of the machine.
+
+Usage:
+  python -m benchmarks.run [--profile small] [--generations 5] [--repeat 3] [--save]
+
+by Pavel Trutman, pavel.trutman@fel.cvut.cz
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import tempfile
+import contextlib
+from .generator import TreeGenerator
+from goldFish.config import Config
+from goldFish.backup import Backup
+from goldFish.size import Size
+from goldFish.backups import getBackups, SUMMARY_FILE
+from goldFish.database import Database
+from goldFish.remover import TreeRemover
+
+
+# default path to the stored baseline
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# number of the measurements of the quick benchmarks inside one run, the fastest one is kept
+QUICK_REPEAT = 5
+
+# duration in seconds of the baseline below which the benchmark is compared with the short threshold
+SHORT = 0.1
+
+
+def quiet(function, *args, **kwargs):
+  """
+  Calls the function with the standard output suppressed and the default answer to all questions.
+
+  Args:
+    function (function): function to call
+    args (list): positional arguments of the function
+    kwargs (dict): keyword arguments of the function
+
+  Returns:
+    float: duration of the call in seconds
+  """
+
+  stdin = sys.stdin
+  sys.stdin = io.StringIO('\n'*1000)
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      start = time.monotonic()
+      function(*args, **kwargs)
+      return time.monotonic() - start
+  finally:
+    sys.stdin = stdin
+
+
+def fastest(count, function, *args, **kwargs):
+  """
+  Calls the function several times by quiet() and keeps the fastest call.
+
+  Args:
+    count (int): number of the calls
+    function (function): function to call
+    args (list): positional arguments of the function
+    kwargs (dict): keyword arguments of the function
+
+  Returns:
+    float: duration of the fastest call in seconds
+  """
+
+  return min(quiet(function, *args, **kwargs) for i in range(count))
+
+
+def lookups(dbPath, count, seed):
+  """
+  Measures the lookups of the files and the hashes in the database.
+
+  Args:
+    dbPath (str): path to the database of the backup
+    count (int): number of the looked up files
+    seed (int): seed of the random generator
+
+  Returns:
+    dict: mean durations of the lookups in seconds
+  """
+
+  db = Database(dbPath, readonly=True)
+  db.db.execute('SELECT files.path, files.folderId, hashes.hash, hashes.size, hashes.symlink, hashes.id FROM files JOIN hashes ON files.hashId = hashes.id')
+  rows = db.db.fetchall()
+  rows = random.Random(seed).sample(rows, min(count, len(rows)))
+
+  results = {}
+  start = time.monotonic()
+  for path, folderId, hash, size, symlink, hashId in rows:
+    db.getFileRow(path, folderId)
+  results['db.getFileRow'] = (time.monotonic() - start)/max(len(rows), 1)
+  start = time.monotonic()
+  for path, folderId, hash, size, symlink, hashId in rows:
+    db.getHashId(hash, size, symlink)
+  results['db.getHashId'] = (time.monotonic() - start)/max(len(rows), 1)
+  start = time.monotonic()
+  for path, folderId, hash, size, symlink, hashId in rows:
+    db.getFilesByHash(hashId)
+  results['db.getFilesByHash'] = (time.monotonic() - start)/max(len(rows), 1)
+  db.close()
+  return results
+
+
+def countFiles(path):
+  """
+  Counts the files in the folder.
+
+  Args:
+    path (str): path to the folder
+
+  Returns:
+    int: number of the files
+  """
+
+  return sum(len(files) for root, dirs, files in os.walk(path))
+
+
+def benchmark(profile, generations, seed, work):
+  """
+  Runs all benchmarks.
+
+  Args:
+    profile (str): name of the shape of the source tree
+    generations (int): number of the backups
+    seed (int): seed of the random generator
+    work (str): folder for the source tree and the backups
+
+  Returns:
+    dict: durations in seconds
+  """
+
+  src = os.path.join(work, 'src')
+  dest = os.path.join(work, 'dest')
+  db = os.path.join(work, 'db')
+  for path in [src, dest, db]:
+    os.mkdir(path)
+  configFile = os.path.join(work, 'config.yml')
+  with open(configFile, 'w') as f:
+    f.write('folders:\n  dest: {}\n  src:\n  - {}\ndatabase:\n  enable: True\n  path: {}\n  linkMtimeDiffer: False\n'.format(dest, src, db))
+
+  results = {}
+  generator = TreeGenerator(src, profile, seed)
+  start = time.monotonic()
+  generator.generate()
+  print('Generated {} files in {:.2f} s'.format(countFiles(src), time.monotonic() - start))
+
+  names = []
+  incremental = []
+  for generation in range(generations):
+    if generation > 0:
+      generator.mutate(generation)
+    name = '20000101_{:04d}'.format(generation)
+    duration = quiet(Backup.main, configFile, False, name=name)
+    names.append(name)
+    if generation == 0:
+      results['backup.first'] = duration
+    else:
+      incremental.append(duration)
+    if countFiles(os.path.join(dest, name, 'src')) != countFiles(src):
+      raise RuntimeError('Backup ' + name + ' does not contain all files of the source.')
+  if len(incremental) > 0:
+    results['backup.incremental'] = sum(incremental)/len(incremental)
+  results['backup.dryRun'] = quiet(Backup.main, configFile, True, name='20000101_9999')
+
+  results['size'] = fastest(QUICK_REPEAT, Size.main, [os.path.join(dest, name) for name in names])
+
+  config = Config(configFile)
+  cold = []
+  for i in range(QUICK_REPEAT):
+    os.remove(os.path.join(db, SUMMARY_FILE))
+    cold.append(quiet(getBackups, config))
+  results['getBackups.cold'] = min(cold)
+  results['getBackups.warm'] = fastest(QUICK_REPEAT, getBackups, config)
+
+  results.update(lookups(os.path.join(db, names[-1] + '.sqlite'), 1000, seed))
+
+  remover = TreeRemover()
+  results['remove'] = quiet(remover.remove, [os.path.join(dest, names[0])])
+  if len(remover.errors) > 0:
+    raise RuntimeError('Backup ' + names[0] + ' was not removed completely.')
+  return results
+
+
+def compare(results, baseline, threshold, shortThreshold):
+  """
+  Prints the results next to the baseline.
+
+  Args:
+    results (dict): durations in seconds
+    baseline (dict): durations of the baseline in seconds
+    threshold (float): allowed relative slowdown
+    shortThreshold (float): allowed relative slowdown of the benchmarks whose baseline is shorter than SHORT seconds
+
+  Returns:
+    list of str: names of the benchmarks slower than the baseline by more than the threshold
+  """
+
+  regressions = []
+  print('{:<22} {:>14} {:>14} {:>8}'.format('Benchmark', 'Result', 'Baseline', 'Ratio'))
+  for name, duration in results.items():
+    base = baseline.get(name)
+    if base is None or base <= 0:
+      print('{:<22} {:>12.6f} s {:>14} {:>8}'.format(name, duration, '-', '-'))
+      continue
+    ratio = duration/base
+    flag = ''
+    if ratio > 1 + (threshold if base >= SHORT else shortThreshold):
+      regressions.append(name)
+      flag = ' !'
+    print('{:<22} {:>12.6f} s {:>12.6f} s {:>7.2f}x{}'.format(name, duration, base, ratio, flag))
+  return regressions
+
+
+def main(argv=None):
+  """
+  Runs the benchmarks and compares them with the baseline.
+
+  Args:
+    argv (list of str): command line arguments
+
+  Returns:
+    int: exit code, 1 when some benchmark regressed or there is no baseline of the profile
+  """
+
+  parser = argparse.ArgumentParser(description='Benchmarks of GoldFish on synthetic backup trees.')
+  parser.add_argument('--profile', choices=sorted(TreeGenerator.PROFILES.keys()), default='small', help='shape of the source tree')
+  parser.add_argument('--generations', type=int, default=5, help='number of the backups')
+  parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+  parser.add_argument('--repeat', type=int, default=3, help='number of the runs, the median result of each benchmark is kept')
+  parser.add_argument('--baseline', default=BASELINE, help='path to the stored baseline')
+  parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative slowdown against the baseline')
+  parser.add_argument('--short-threshold', type=float, default=1.0, help='allowed relative slowdown of the benchmarks shorter than {:g} s'.format(SHORT))
+  parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+  parser.add_argument('--workdir', default=None, help='folder for the temporary trees, system temporary folder by default')
+  args = parser.parse_args(argv)
+
+  runs = {}
+  for run in range(args.repeat):
+    with tempfile.TemporaryDirectory(prefix='goldFish-benchmark-', dir=args.workdir) as work:
+      for name, duration in benchmark(args.profile, args.generations, args.seed, work).items():
+        runs.setdefault(name, []).append(duration)
+  results = {name: statistics.median(durations) for name, durations in runs.items()}
+
+  baselines = {}
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+      baselines = json.load(f)
+  baseline = baselines.get(args.profile)
+  regressions = compare(results, baseline if baseline is not None else {}, args.threshold, args.short_threshold)
+
+  if args.save:
+    baselines[args.profile] = results
+    with open(args.baseline, 'w') as f:
+      json.dump(baselines, f, indent=2)
+      f.write('\n')
+    print('Baseline stored into ' + args.baseline)
+    return 0
+
+  if baseline is None:
+    print('No baseline of the profile ' + args.profile + ' in ' + args.baseline + ', store it by --save first.')
+    return 1
+  if len(regressions) > 0:
+    print('Slower than the baseline: ' + ', '.join(regressions))
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
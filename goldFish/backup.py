@@ -7,236 +7,795 @@ import math
 import sys
 import re
 import hashlib
+import json
+import errno
+import threading
+import concurrent.futures
 from .io import *
 from .config import Config
 from .database import Database
+from .hasher import Hasher
+from .pathindex import PathIndex
+from .hashcache import HashCache
+from .copier import Copier
+from .progress import Progress
+from .backups import updateSummary, hasCatalog, openCatalog, catalogPath
+from .metrics import Metrics
+from .manifest import Manifest, ManifestWriter
+from .pipeline import Stage, CopyPool, DatabaseWriter, PendingSizes
+from .resolver import LinkResolver
 
 class Backup:
 
-  def main(configFile, dryRun):
+  def main(configFile, dryRun, prescan=False, jsonEvents=None, metricsFile=None, prometheusFile=None, name=None, resume=False):
     """
     Creates new backup.
 
     Args:
       configFile (str): path to the configuration file
       dryRun (bool): whether in testing mode
+      prescan (bool): whether to count the size of the source folders first to estimate the remaining time
+      jsonEvents (str): path to the file for the JSON events about the processed files or None
+      metricsFile (str): path to the JSON report of the metrics or None
+      prometheusFile (str): path to the file for the textfile collector of Prometheus or None
+      name (str): name of the new backup, None names it by the current time
+      resume (bool): whether to continue the interrupted backup instead of creating new one
     """
 
     config = Config(configFile)
     config.dryRun = dryRun
+    metrics = Metrics()
 
     prevBackups = os.listdir(config.backupDirTo)
     prevBackups.sort(reverse=True)
+
+    # find the interrupted backup
+    if resume:
+      if not config.dbEnable or config.dryRun:
+        print('Only backups using the database can be resumed and not in the dry run.')
+        return
+      name = Backup.interrupted(config, prevBackups)
+      if name is None:
+        print('No interrupted backup found.')
+        return
+      prevBackups = [prevBackup for prevBackup in prevBackups if prevBackup < name]
+
     if config.history > -1:
       prevBackups = prevBackups[:config.history]
     
-    today = time.strftime('%Y%m%d_%H%M')
+    today = time.strftime('%Y%m%d_%H%M') if name is None else name
     dirToday = os.path.join(config.backupDirTo, today)
-    if not config.dryRun:
+    if not config.dryRun and not resume:
       os.mkdir(dirToday)
     print(prevBackups)
 
     # create new database and load the older
+    db = None
+    dbs = []
+    catalog = None
+    foldersDone = []
     if config.dbEnable:
       if not config.dryRun:
-        db = Database(os.path.join(config.dbPath, today + '.sqlite'))
+        db = openCatalog(config, today, readonly=False, batchRows=config.dbBatchRows, batchSeconds=config.dbBatchSeconds, metrics=metrics)
       else:
-        db = Database(Database.MEMORY)
+        db = Database(Database.MEMORY, batchRows=config.dbBatchRows, batchSeconds=config.dbBatchSeconds, metrics=metrics, compact=config.dbCompact)
+      if resume and db.getHashAlgorithm() != config.hashAlgorithm:
+        print('Interrupted backup ' + today + ' uses hash algorithm ' + db.getHashAlgorithm() + ', it can not be resumed.')
+        return
+      db.setSetting('hashAlgorithm', config.hashAlgorithm)
+      db.setSetting('state', 'inProgress')
+      db.commit()
+      foldersDone = json.loads(db.getSetting('foldersDone', '[]'))
       dbs = [db]
-      for prevBackup in prevBackups:
-        dbs.append(Database(os.path.join(config.dbPath, prevBackup + '.sqlite'), readonly=True))
+      start = time.monotonic()
+      memorySize = 0
+      if config.dbSingle and len(prevBackups) > 0:
+        # the previous backups share one connection to the catalog
+        catalog = Database(catalogPath(config, prevBackups[0]), readonly=True, single=True, metrics=metrics, mmapSize=config.catalogMmapSize, cacheSize=config.catalogCacheSize)
+      for i, prevBackup in enumerate(prevBackups):
+        if catalog is not None:
+          prevDb = catalog.restricted(prevBackup)
+        else:
+          prevDb = openCatalog(config, prevBackup, metrics=metrics, mmapSize=config.catalogMmapSize, cacheSize=config.catalogCacheSize)
+          if config.catalogsInMemory == -1 or i < config.catalogsInMemory:
+            # load the most recent databases into memory
+            memDb = prevDb.toMemory()
+            prevDb.close()
+            prevDb = memDb
+            memorySize += prevDb.getSize()
+        dbs.append(prevDb)
+      loadTime = time.monotonic() - start
+      metrics.time('loadCatalogs', loadTime)
 
     printHeadline()
 
     if config.dbEnable:
       print('Using database.')
+      inMemory = len(prevBackups) if config.catalogsInMemory == -1 else min(config.catalogsInMemory, len(prevBackups))
+      if inMemory > 0 and not config.dbSingle:
+        print('Loaded {} databases of the previous backups into memory in {:.2f} s, {}.'.format(inMemory, loadTime, readableSize(memorySize).strip()))
+      outdated = [prevDb for prevDb in dbs[1:] if prevDb.outdated()]
+      if len(outdated) > 0:
+        print('{} databases of the previous backups are outdated, run \'goldFish db-upgrade\' to upgrade them.'.format(len(outdated)))
+      with metrics.timer('hashCache'):
+        hashCache = HashCache(dbs[1:], config.hashCacheMemory, config.hashAlgorithm, config.prefilterSize, catalog)
+      if not hashCache.loaded():
+        print('Hashes of the previous backups do not fit into memory, using only the filter.')
+
+    else:
+      hashCache = None
 
-    print('Creating new backup: ' + today)
+    if resume:
+      print('Resuming backup: ' + today)
+    else:
+      print('Creating new backup: ' + today)
+
+    resolver = LinkResolver(config, today)
+    hasher = Hasher(config.hashWorkers, config.followSymlinks, config.hashAlgorithm, config.prefilterSize, metrics)
+    progress = Progress(interval=config.progressInterval, events=open(jsonEvents, 'w') if jsonEvents is not None else None)
+    try:
+      progress.event('backup', name=today, dryRun=config.dryRun)
+      if prescan:
+        print('Counting size of the folders ...', end='', flush=True)
+        with metrics.timer('prescan'):
+          progress.setTotal(Backup.prescan(config))
+        print(' ' + readableSize(progress.bytesTotal).strip())
     
-    for dirFrom in config.backupDirFrom:
-      backupDir = os.path.basename(dirFrom)
-      dirTo = os.path.join(dirToday, backupDir)
-      if not config.dryRun:
-        os.mkdir(dirTo)
-      if config.dbEnable:
+      # backup the folders, the folders on different devices concurrently
+      dirsFrom = []
+      for dirFrom in config.backupDirFrom:
+        if resume and os.path.basename(dirFrom) in foldersDone:
+          progress.message()
+          progress.message(os.path.basename(dirFrom))
+          progress.message('  Backuped before the interruption.')
+        else:
+          dirsFrom.append(dirFrom)
+      groups = Backup.groups(dirsFrom) if config.folderWorkers > 1 else [dirsFrom]
+      if len(groups) > 1:
+        # the folders backuped concurrently see the files of the same size queued by each other, and in the pipeline also the rows written by each other
+        pending = PendingSizes() if config.dbEnable else None
+        folderDb = DatabaseWriter(db, config.pipelineQueue, metrics) if config.pipeline and config.dbEnable else db
+        args = (config, today, prevBackups, folderDb, dbs, hashCache, resolver, hasher, progress, metrics, resume, foldersDone, threading.Lock(), pending)
+        try:
+          with concurrent.futures.ThreadPoolExecutor(max_workers=config.folderWorkers) as pool:
+            futures = [pool.submit(Backup.folders, group, *args, True) for group in groups]
+            for future in futures:
+              future.result()
+        finally:
+          if isinstance(folderDb, DatabaseWriter):
+            with metrics.timer('dbWait'):
+              folderDb.close()
+      else:
+        args = (config, today, prevBackups, db, dbs, hashCache, resolver, hasher, progress, metrics, resume, foldersDone, threading.Lock(), None)
+        Backup.folders(dirsFrom, *args, False)
+
+      hasher.close()
+    finally:
+      progress.close()
+
+    print()
+    print('Time spent:')
+    for line in metrics.summary():
+      print('  ' + line)
+    if metricsFile is not None:
+      metrics.writeJson(metricsFile)
+    if prometheusFile is not None:
+      metrics.writePrometheus(prometheusFile)
+
+    if catalog is not None:
+      catalog.close()
+
+    # update the summary of the backups
+    if config.dbEnable and not config.dryRun:
+      db.setSetting('state', 'complete')
+      db.close()
+      updateSummary(config, today)
+
+
+  def folders(dirsFrom, config, today, prevBackups, db, dbs, hashCache, resolver, hasher, progress, metrics, resume, foldersDone, lock, pending, buffered):
+    """
+    Backups the source folders one after another.
+
+    Args:
+      dirsFrom (list of str): paths to the source folders
+      config (Config): configuration object
+      today (str): name of the new backup
+      prevBackups (list of str): names of the previous backups, the newest first
+      db (Database): database of the new backup, its writer shared by the folders backuped concurrently, or None
+      dbs (list of Database): database of the new backup followed by the databases of the previous backups
+      hashCache (HashCache): hashes of the previous backups or None
+      resolver (LinkResolver): resolver of the targets of the hash-links
+      hasher (Hasher): hasher of the source files
+      progress (Progress): progress line
+      metrics (Metrics): metrics of the backup
+      resume (bool): whether the interrupted backup is continued
+      foldersDone (list of str): names of the folders already finished
+      lock (threading.Lock): lock of the list of the finished folders
+      pending (PendingSizes): sizes of the files queued by the folders backuped concurrently or None
+      buffered (bool): whether to print the messages of the folder at once when it is finished
+
+    Returns:
+      None
+    """
+
+    try:
+      for dirFrom in dirsFrom:
+        Backup.folder(dirFrom, config, today, prevBackups, db, dbs, hashCache, resolver, hasher, progress, metrics, resume, foldersDone, lock, pending, buffered)
+    except BaseException:
+      # other folders do not wait for the files of the failed folder
+      if pending is not None:
+        pending.abort()
+      raise
+
+
+  def folder(dirFrom, config, today, prevBackups, db, dbs, hashCache, resolver, hasher, progress, metrics, resume, foldersDone, lock, pending, buffered):
+    """
+    Backups one source folder.
+
+    Args:
+      dirFrom (str): path to the source folder
+      config (Config): configuration object
+      today (str): name of the new backup
+      prevBackups (list of str): names of the previous backups, the newest first
+      db (Database): database of the new backup, its writer shared by the folders backuped concurrently, or None
+      dbs (list of Database): database of the new backup followed by the databases of the previous backups
+      hashCache (HashCache): hashes of the previous backups or None
+      resolver (LinkResolver): resolver of the targets of the hash-links
+      hasher (Hasher): hasher of the source files
+      progress (Progress): progress line
+      metrics (Metrics): metrics of the backup
+      resume (bool): whether the interrupted backup is continued
+      foldersDone (list of str): names of the folders already finished
+      lock (threading.Lock): lock of the list of the finished folders
+      pending (PendingSizes): sizes of the files queued by the folders backuped concurrently or None
+      buffered (bool): whether to print the messages of the folder at once when it is finished
+
+    Returns:
+      None
+    """
+
+    messages = []
+    message = messages.append if buffered else progress.message
+    dirToday = os.path.join(config.backupDirTo, today)
+    copier = Copier(config.followSymlinks, config.hashAlgorithm, metrics)
+
+    backupDir = os.path.basename(dirFrom)
+    dirTo = os.path.join(dirToday, backupDir)
+    if not config.dryRun and not (resume and os.path.isdir(dirTo)):
+      os.mkdir(dirTo)
+    if config.dbEnable:
+      folderId = db.getFolder(backupDir) if resume else None
+      if folderId is None:
         folderId = db.newFolder(backupDir)
+    progress.event('folder', folder=backupDir, source=dirFrom)
+  
+    # find prev backup
+    dirPrev = None
+    datePrev = None
+    backupDbFrom = None
+    folderIdPrev = None
+    for backupIdPrev, prev in enumerate(prevBackups):
+      dirPrevTmp = os.path.join(config.backupDirTo, prev, backupDir)
+      if os.path.isdir(dirPrevTmp):
+        dirPrev = dirPrevTmp
+        datePrev = prev
+        if config.dbEnable:
+          backupDbFrom = dbs[backupIdPrev + 1]
+          folderIdPrev = backupDbFrom.getFolder(backupDir)
+        break
     
-      # find prev backup
-      dirPrev = None
-      datePrev = None
-      backupDbFrom = None
-      folderIdPrev = None
-      for backupIdPrev, prev in enumerate(prevBackups):
-        dirPrevTmp = os.path.join(config.backupDirTo, prev, backupDir)
-        if os.path.isdir(dirPrevTmp):
-          dirPrev = dirPrevTmp
-          datePrev = prev
-          if config.dbEnable:
-            backupDbFrom = dbs[backupIdPrev + 1]
-            folderIdPrev = backupDbFrom.getFolder(backupDir)
-          break
-      
-      print()
-      print(backupDir)
-      print('  From: ' + dirFrom)
-      print('  To:   ' + dirTo)
-      if datePrev is None:
-        print('  No previous backup found.')
+    message('')
+    message(backupDir)
+    message('  From: ' + dirFrom)
+    message('  To:   ' + dirTo)
+    if datePrev is None:
+      message('  No previous backup found.')
+    else:
+      message('  Previous backup found from: ' + datePrev)
+
+    # load files of the previous backup
+    indexPrev = None
+    if config.dbEnable and backupDbFrom is not None:
+      if backupDbFrom.getHashAlgorithm() != config.hashAlgorithm:
+        message('  Previous backup uses hash algorithm ' + backupDbFrom.getHashAlgorithm() + ', all files will be hashed.')
+        folderIdPrev = None
+      with metrics.timer('loadIndex'):
+        indexPrev = PathIndex(backupDbFrom, folderIdPrev, config.pathIndexMemory)
+      if folderIdPrev is not None and not indexPrev.loaded():
+        message('  Previous backup is too large to be indexed in memory.')
+
+    # load state of the source files at the time of the previous backup and start the new manifest
+    manifestPrev = None
+    manifestWriter = None
+    if config.manifest:
+      if datePrev is not None:
+        with metrics.timer('loadManifest'):
+          manifestPrev = Manifest(Backup.manifestFile(config, datePrev, backupDir), datePrev, backupDir, os.path.abspath(dirFrom), config.pathIndexMemory)
+        if manifestPrev.error is not None:
+          message('  Manifest of the previous backup is not used: ' + manifestPrev.error)
+      if not config.dryRun:
+        manifestWriter = ManifestWriter(Backup.manifestFile(config, today, backupDir), today, backupDir, os.path.abspath(dirFrom))
+
+    # load files backuped before the interruption
+    indexDone = None
+    if resume:
+      db.commit()
+      indexDone = PathIndex(db, folderId, config.pathIndexMemory)
+    
+    sizeCopied = 0
+    sizeLinked = 0
+    sizeHashLinked = 0
+    sizeResumed = 0
+    numFiles = 0
+
+    def finish(item, result):
+      """
+      Stores the file into the database and reports it, once its data are in the backup.
+
+      Args:
+        item (dict): decisions about the file
+        result (object): result of the copy of the file or None
+
+      Returns:
+        None
+      """
+
+      nonlocal sizeCopied, sizeLinked, sizeHashLinked, sizeResumed, numFiles
+      path = item['path']
+      statFrom = item['stat']
+      action = item['action']
+      numFiles += 1
+      progress.done(statFrom.st_size)
+      metrics.add('files.' + action)
+      metrics.add('bytes.' + action, statFrom.st_size)
+
+      if action == 'resumed':
+        # backuped before the interruption
+        sizeResumed += statFrom.st_size
+        progress.event('file', folder=backupDir, path=path, size=statFrom.st_size, action='resumed')
+        return
+
+      if action == 'linked':
+        # link from previous backup
+        sizeLinked += statFrom.st_size
+        if config.dbEnable:
+          hashId = db.insertHash(*item['hash'])
+          db.insertFile(path, round(statFrom.st_mtime), folderId, hashId)
+        progress.event('file', folder=backupDir, path=path, size=statFrom.st_size, action='linked', target=os.path.relpath(item['target'], config.backupDirTo))
+        return
+
+      sFile = item['target']
+      method = item['method']
+      if item['copy'] == 'copy':
+        method = result
+      elif item['copy'] is not None:
+        copyHash, copySymlink, method = result
+        if item['copy'] == 'hash':
+          # surely new file, its hash is the hash of the copy
+          item['hash'] = (copyHash, statFrom.st_size, copySymlink, None)
+        elif copyHash != item['hash'][0] or copySymlink != item['hash'][2]:
+          message('    ' + path)
+          message('      changed while being backuped, storing hash of the copy')
+          item['hash'] = (copyHash, statFrom.st_size, copySymlink, None)
+          item['hashId'] = db.getHashId(copyHash, statFrom.st_size, copySymlink)
+
+      if action == 'hashLinked':
+        sizeHashLinked += statFrom.st_size
       else:
-        print('  Previous backup found from: ' + datePrev)
-      
-      sizeCopied = 0
-      sizeLinked = 0
-      sizeHashLinked = 0
-      numFiles = 0
-     
-      for root, dirs, files in os.walk(dirFrom):
-        relPath = os.path.relpath(root, dirFrom)
-        if relPath == '.':
-          relPath = ''
+        sizeCopied += statFrom.st_size
+
+      # store the hash once it is final and record the file once its data are in the backup
+      if config.dbEnable:
+        hashId = item['hashId']
+        if hashId is None:
+          fileHash, fileSize, fileSymlink, fileSample = item['hash']
+          if fileSample is None and config.prefilterSize > 0 and fileSize >= config.prefilterSize and not fileSymlink:
+            fileSample = sampleFile(item['sample'], fileSize, config.hashAlgorithm)
+          hashId = db.insertHash(fileHash, fileSize, fileSymlink, fileSample)
+        db.insertFile(path, round(statFrom.st_mtime), folderId, hashId)
+      message('    ' + path)
+      if action == 'hashLinked':
+        if item['mtimeDiffer']:
+          message('      hash-linked with different mtime with ' + os.path.join(sFile[0], sFile[1], sFile[3]))
+        else:
+          message('      hash-linked with ' + os.path.join(sFile[0], sFile[1], sFile[3]))
+      elif item['mtimeDiffer']:
+        message('      may be hash-linked with different mtime with ' + os.path.join(sFile[0], sFile[1], sFile[3]))
+      progress.event('file', folder=backupDir, path=path, size=statFrom.st_size, action='hash-linked' if action == 'hashLinked' else 'copied', target=os.path.join(sFile[0], sFile[1], sFile[3]) if sFile is not None else None, mtimeDiffer=item['mtimeDiffer'], method=method)
+
+    ownWriter = False
+    # in the pipeline, the source files are walked, compared and linked from the previous backup by their own threads, the files are copied in the pool of the copy workers and the rows are written into the database by its own thread
+    if config.pipeline:
+      levels = Stage(Backup.walk(config, dirFrom, dirTo, metrics, indexDone), config.pipelineQueue)
+      files = Stage(Backup.scan(config, levels, dirTo, dirPrev, indexPrev, hasher, hashCache, metrics, indexDone, manifestPrev), config.pipelineQueue)
+      copies = CopyPool(config.copyWorkers, config.pipelineQueue, finish, metrics, pending)
+      if config.dbEnable and not isinstance(db, DatabaseWriter):
+        db = DatabaseWriter(db, config.pipelineQueue, metrics)
+        ownWriter = True
+    else:
+      levels = Backup.walk(config, dirFrom, dirTo, metrics, indexDone)
+      files = hasher.window(Backup.scan(config, levels, dirTo, dirPrev, indexPrev, hasher, hashCache, metrics, indexDone, manifestPrev))
+      copies = CopyPool(0, config.pipelineQueue, finish, metrics, pending)
+
+    for relPath, file, statFrom, filePrev, rowPrev, hashJob, resumed in files:
+      fileFrom = os.path.join(dirFrom, relPath, file)
+      fileTo = os.path.join(dirTo, relPath, file)
+      progress.file('  ' + os.path.join(relPath, file))
+      if not (manifestWriter is None):
+        manifestWriter.add(os.path.join(relPath, file), statFrom)
+      item = {'path': os.path.join(relPath, file), 'stat': statFrom, 'target': None, 'hash': None, 'hashId': None, 'sample': fileFrom, 'copy': None, 'method': None, 'mtimeDiffer': False}
+      if resumed:
+        item['action'] = 'resumed'
+        copies.put(item, statFrom.st_size)
+        continue
+
+      if not (filePrev is None):
+        # linked from previous backup while scanning
+        item['action'] = 'linked'
+        item['target'] = filePrev
+        if config.dbEnable:
+          if rowPrev == None:
+            # compute hash
+            progress.flag('H')
+            with metrics.timer('hashWait'):
+              fileHash, fileSymlink, fileSample = hashJob.result()
+            item['hash'] = (fileHash, statFrom.st_size, fileSymlink, fileSample)
+          else:
+            # get hash row from prev db
+            item['hash'] = tuple(rowPrev[1:])
+        copies.put(item, statFrom.st_size)
+        continue
+
+      item['action'] = 'copied'
+      copy = None
+      if config.dbEnable:
+        fileSize = statFrom.st_size
+        # the files of this backup with the same size have to be finished before they are searched for
+        copies.wait(fileSize)
+        speculative = False
+        if hashJob is None:
+          # copy the file and hash the copy, the copy is replaced by a hardlink when the same file is found
+          progress.flag('C')
+          fileHash, fileSymlink, item['method'] = copier.copyHash(fileFrom, fileTo)
+          speculative = True
+          fileSample = None
+        else:
+          # compute hash
+          progress.flag('H')
+          with metrics.timer('hashWait'):
+            fileHash, fileSymlink, fileSample = hashJob.result()
+          if fileHash is None:
+            # size or sample differs from all previous backups, the file may still equal to a file of this backup
+            samples = db.getSamplesBySize(fileSize)
+            if len(samples) > 0 and fileSample is None and config.prefilterSize > 0 and fileSize >= config.prefilterSize:
+              fileSample = sampleFile(fileFrom, fileSize, config.hashAlgorithm)
+            if config.dryRun or fileSample in samples or None in samples:
+              with metrics.timer('hash'):
+                fileHash, fileSymlink = hashFile(fileFrom, config.followSymlinks, config.hashAlgorithm)
+            else:
+              # surely new file, copy it and hash the copy
+              progress.flag('C')
+              copy = 'hash'
+              item['sample'] = fileTo
+
+        if copy is None:
+          item['hash'] = (fileHash, fileSize, fileSymlink, fileSample)
+
+          # search for the hash ids
+          hashId = db.getHashId(fileHash, fileSize, fileSymlink)
+          item['hashId'] = hashId
+          if hashId is not None:
+            hashIds = [(today, db, hashId)]
+          else:
+            hashIds = []
+          with metrics.timer('lookup'):
+            hashIdsPrev = hashCache.lookup(fileHash, fileSize, fileSymlink)
+          for backupIdPrev, backupHashIdPrev in hashIdsPrev:
+            hashIds.append((prevBackups[backupIdPrev], dbs[backupIdPrev + 1], backupHashIdPrev))
+          if len(hashIds) > 0:
+
+            # find file with same hash
+            with metrics.timer('resolve'):
+              sFile = resolver.resolve((fileHash, fileSize, fileSymlink), hashIds, round(statFrom.st_mtime))
+            while sFile is not None:
+              item['target'] = sFile
+              item['mtimeDiffer'] = round(statFrom.st_mtime) != sFile[4]
+              if item['mtimeDiffer'] and not config.dbLinkMDiffer:
+                break
+              if not config.dryRun:
+                try:
+                  with metrics.timer('link'):
+                    if speculative:
+                      os.remove(fileTo)
+                      speculative = False
+                    os.link(resolver.path(sFile), fileTo, follow_symlinks=config.followSymlinks)
+                except OSError as e:
+                  if e.errno != errno.EMLINK:
+                    raise
+                  # inode of the target reached the limit of the hardlinks, try other target
+                  resolver.full(sFile)
+                  item['target'] = None
+                  item['mtimeDiffer'] = False
+                  with metrics.timer('resolve'):
+                    sFile = resolver.resolve((fileHash, fileSize, fileSymlink), hashIds, round(statFrom.st_mtime))
+                  continue
+                if item['mtimeDiffer'] and round(statFrom.st_mtime) > sFile[4]:
+                  shutil.copystat(fileFrom, fileTo, follow_symlinks=config.followSymlinks)
+              item['action'] = 'hashLinked'
+              item['method'] = None
+              break
+
+          if item['action'] == 'copied' and not speculative and not config.dryRun:
+            # copy the file, with verifyCopy check that the copy has the hash computed before
+            progress.flag('C')
+            copy = 'verify' if config.verifyCopy else 'copy'
+          item['sample'] = fileTo if speculative or copy is not None else fileFrom
+          if item['action'] == 'copied' and not item['mtimeDiffer']:
+            item['target'] = None
+
+      elif not config.dryRun:
+        progress.flag('C')
+        copy = 'copy'
+
+      item['copy'] = copy
+      if copy == 'copy':
+        copies.put(item, statFrom.st_size, copier.copy, fileFrom, fileTo)
+      elif copy is not None:
+        copies.put(item, statFrom.st_size, copier.copyHash, fileFrom, fileTo)
+      else:
+        copies.put(item, statFrom.st_size)
+
+    copies.close()
+
+    if ownWriter:
+      with metrics.timer('dbWait'):
+        db = db.close()
+    elif isinstance(db, DatabaseWriter):
+      db.sync()
+    with metrics.timer('sync'):
+      os.sync()
+    if config.dbEnable:
+      with lock:
+        foldersDone.append(backupDir)
+        db.setSetting('foldersDone', json.dumps(foldersDone))
+        db.commit()
+    if not (manifestWriter is None):
+      manifestWriter.close()
+
+    message('  Copied:        ' + readableSize(sizeCopied))
+    message('  Linked:        ' + readableSize(sizeLinked))
+    message('  Hash-linked:   ' + readableSize(sizeHashLinked))
+    if resume:
+      message('  Resumed:       ' + readableSize(sizeResumed))
+    message('  Files written: ' + str(numFiles))
+    if len(copier.counts) > 0:
+      message('  Copy methods:  ' + ', '.join('{} {}'.format(method, count) for method, count in copier.counts.most_common()))
+    progress.event('folderDone', folder=backupDir, copied=sizeCopied, linked=sizeLinked, hashLinked=sizeHashLinked, files=numFiles, methods=dict(copier.counts))
+    if buffered:
+      progress.messages(messages)
+
+
+  def groups(dirsFrom):
+    """
+    Groups the source folders by the devices they are stored on. The folders of one group are backuped one after another, so that one disk is not read by several threads at once.
+
+    Args:
+      dirsFrom (list of str): paths to the source folders
+
+    Returns:
+      list of list of str: groups of the source folders
+    """
+
+    groups = {}
+    for dirFrom in dirsFrom:
+      groups.setdefault(os.stat(dirFrom).st_dev, []).append(dirFrom)
+    return list(groups.values())
+
+
+  def manifestFile(config, backup, folder):
+    """
+    Returns path to the manifest of the folder in the backup.
+
+    Args:
+      config (Config): configuration object
+      backup (str): name of the backup
+      folder (str): name of the folder
+
+    Returns:
+      str: path to the manifest file
+    """
+
+    return os.path.join(config.manifestPath, backup, folder + '.manifest')
+
+
+  def interrupted(config, backups):
+    """
+    Finds the interrupted backup, which can be only the newest backup with the database.
+
+    Args:
+      config (Config): configuration object
+      backups (list of str): names of the backups, the newest first
+
+    Returns:
+      str: name of the interrupted backup or None
+    """
+
+    for backup in backups:
+      if hasCatalog(config, backup):
+        db = openCatalog(config, backup)
+        state = db.getSetting('state', 'complete')
+        db.close()
+        if state == 'inProgress':
+          return backup
+        return None
+    return None
+
+
+  def resumeFile(config, fileTo, relFile, statFrom, indexDone):
+    """
+    Checks whether the file was completely backuped before the interruption, which holds when it is stored in the database and the file in the backup has the size and the mtime of the source file, as the mtime is set only after the data are copied. Otherwise the partially backuped file is removed from the backup and from the database, so that it is backuped again.
+
+    Args:
+      config (Config): configuration object
+      fileTo (str): path to the file in the backup
+      relFile (str): path to the file relative to the folder
+      statFrom (os.stat_result): stat of the source file
+      indexDone (PathIndex): index of the files backuped before the interruption
+
+    Returns:
+      bool: whether the file was completely backuped
+    """
+
+    rowDone = indexDone.get(relFile)
+    try:
+      statTo = os.stat(fileTo, follow_symlinks=config.followSymlinks)
+    except FileNotFoundError:
+      statTo = None
+    if rowDone is not None and statTo is not None:
+      if statTo.st_size == statFrom.st_size and round(statTo.st_mtime) == round(statFrom.st_mtime) and rowDone[0] == round(statFrom.st_mtime) and rowDone[2] == statFrom.st_size:
+        return True
+
+    if os.path.lexists(fileTo):
+      os.remove(fileTo)
+    if rowDone is not None:
+      indexDone.db.removeFile(relFile, indexDone.folderId)
+    return False
+
+
+  def prescan(config):
+    """
+    Counts the size of all source folders.
+
+    Args:
+      config (Config): configuration object
+
+    Returns:
+      int: size of the files in bytes
+    """
+
+    size = 0
+    for dirFrom in config.backupDirFrom:
+      for relPath, dirs, files in scanTree(dirFrom):
+        for entry in files:
+          try:
+            size += entry.stat(follow_symlinks=config.followSymlinks).st_size
+          except OSError:
+            pass
+    return size
+
+
+  def walk(config, dirFrom, dirTo, metrics, indexDone=None):
+    """
+    Walks through the source folder and creates the directories in the backup.
+
+    Args:
+      config (Config): configuration object
+      dirFrom (str): source folder
+      dirTo (str): folder in the new backup
+      metrics (Metrics): metrics measuring the time of the phases
+      indexDone (PathIndex): index of the files backuped before the interruption or None
+
+    Returns:
+      generator: tuples (relPath, files), relPath is the path of the directory relative to the source folder and files is the list of os.DirEntry of its files
+    """
+
+    tree = scanTree(dirFrom)
+    while True:
+      with metrics.timer('walk'):
+        level = next(tree, None)
+        if level is None:
+          break
+        relPath, dirs, files = level
         curDirTo = os.path.join(dirTo, relPath)
         for dir in dirs:
           if not config.dryRun:
-            os.mkdir(os.path.join(curDirTo, dir))
-        for file in files:
-          fileFrom = os.path.join(root, file)
-          fileTo = os.path.join(curDirTo, file)
-          printToTerminalSize('  ' + os.path.join(relPath, file))
-          sys.stdout.flush()
-          sys.stdout.write('\r')
-          sys.stdout.flush()
-          copied = False
-          statFrom = os.stat(fileFrom, follow_symlinks=config.followSymlinks)
-          if not (dirPrev is None):
+            if not (indexDone is not None and os.path.isdir(os.path.join(curDirTo, dir.name))):
+              os.mkdir(os.path.join(curDirTo, dir.name))
+      yield relPath, files
+
+
+  def scan(config, levels, dirTo, dirPrev, indexPrev, hasher, hashCache, metrics, indexDone=None, manifestPrev=None):
+    """
+    Finds out which files of the walked directories can be linked from the previous backup and links them. Hashing of the files is scheduled when the hash will be needed.
+
+    Args:
+      config (Config): configuration object
+      levels (iterable): walked directories in form (relPath, files) as generated by walk()
+      dirTo (str): folder in the new backup
+      dirPrev (str): folder in the previous backup or None
+      indexPrev (PathIndex): index of the files in the previous backup or None
+      hasher (Hasher): hasher computing the hashes of the files
+      hashCache (HashCache): cache of the hashes of the previous backups or None
+      metrics (Metrics): metrics measuring the time of the phases
+      indexDone (PathIndex): index of the files backuped before the interruption or None
+      manifestPrev (Manifest): state of the source files at the time of the previous backup or None
+
+    Returns:
+      generator: tuples (relPath, file, statFrom, filePrev, rowPrev, hashJob, resumed), filePrev is set when the file is linked from the previous backup, rowPrev is the row (mtime, hash, size, symlink, sample) of the file in the previous database, hashJob is set when the hash is needed before the file is copied, resumed is set when the file was backuped before the interruption
+    """
+
+    for relPath, files in levels:
+      curDirTo = os.path.join(dirTo, relPath)
+
+      # the directory in the previous backup is listed once when needed
+      entriesPrev = None
+
+      for entry in files:
+        file = entry.name
+        fileFrom = entry.path
+        with metrics.timer('stat'):
+          statFrom = entry.stat(follow_symlinks=config.followSymlinks)
+        if not (indexDone is None):
+          if Backup.resumeFile(config, os.path.join(curDirTo, file), os.path.join(relPath, file), statFrom, indexDone):
+            yield relPath, file, statFrom, None, None, None, True
+            continue
+        filePrev = None
+        rowPrev = None
+        if not (dirPrev is None):
+          if not (manifestPrev is None) and manifestPrev.unchanged(os.path.join(relPath, file), statFrom):
+            # unchanged since the previous backup, no need to stat its copy
             filePrev = os.path.join(dirPrev, relPath, file)
-            if os.path.isfile(filePrev) or os.path.islink(filePrev):
-              statPrev = os.stat(filePrev, follow_symlinks=config.followSymlinks)
-              if (statFrom.st_size == statPrev.st_size) and (round(statFrom.st_mtime) == round(statPrev.st_mtime)):
-
-                # link from previous backup
-                if not config.dryRun:
-                  os.link(filePrev, fileTo, follow_symlinks=config.followSymlinks)
-                copied = True
-                sizeLinked += statFrom.st_size
-                numFiles += 1
-
-                if config.dbEnable:
-                  # update db
-                  fileIdPrev, hashIdPrev = backupDbFrom.getFile(os.path.join(relPath, file), folderIdPrev)
-                  if fileIdPrev == None:
-
-                    # compute hash
-                    sys.stdout.write('H')
-                    sys.stdout.flush()
-                    sys.stdout.write('\r')
-                    sys.stdout.flush()
-                    fileHash, fileSymlink = hashFile(fileFrom, config.followSymlinks)
-                    fileSize = statFrom.st_size
-                    hashId = db.getHashId(fileHash, fileSize, fileSymlink)
-                    if hashId == None:
-                      hashId = db.insertHash(fileHash, fileSize, fileSymlink)
-                    db.insertFile(os.path.join(relPath, file), round(statFrom.st_mtime), folderId, hashId)
-                    
-                  else:
-
-                    # get hash row from prev db
-                    hashRowPrev = backupDbFrom.getHashRow(hashIdPrev)
-                    hashIdPrev = db.insertHash(*hashRowPrev)
-
-                    # insert new file into the db using prev file
-                    db.insertFile(os.path.join(relPath, file), round(statFrom.st_mtime), folderId, hashIdPrev)
-                
-          if not copied:
-
-            linked = False
-            mtimeDiffer = False
-            if config.dbEnable:
-              # compute hash
-              sys.stdout.write('H')
-              sys.stdout.flush()
-              sys.stdout.write('\r')
-              sys.stdout.flush()
-              fileHash, fileSymlink = hashFile(fileFrom, config.followSymlinks)
-              fileSize = statFrom.st_size
-
-              # search for the hash ids
-              hashId = db.getHashId(fileHash, fileSize, fileSymlink)
-              if hashId is not None:
-                hashIds = [(today, db, hashId)]
-              else:
-                hashIds = []
-                hashId = db.insertHash(fileHash, fileSize, fileSymlink)
-              for backupIdPrev, prevBackup in enumerate(prevBackups):
-                backupHashIdPrev = dbs[backupIdPrev + 1].getHashId(fileHash, fileSize, fileSymlink)
-                if backupHashIdPrev is not None:
-                  hashIds.append((prevBackup, dbs[backupIdPrev + 1], backupHashIdPrev))
-              if len(hashIds) > 0:
-
-                # find file with same hash
-                sameFiles = []
-                for prevBackup, backupDbPrev, backupHashIdPrev in hashIds:
-                  sameFiles.extend([(prevBackup, ) + f for f in backupDbPrev.getFilesByHash(backupHashIdPrev)])
-
-                # not mdiffer
-                for sFile in sameFiles:
-                  if round(statFrom.st_mtime) == sFile[4]:
-                    sFilePath = os.path.join(config.backupDirTo, sFile[0], sFile[1], sFile[3])
-                    if os.path.isfile(sFilePath) or (config.dryRun and sFile[0] == today):
-                      if not config.dryRun:
-                        os.link(sFilePath, fileTo, follow_symlinks=config.followSymlinks)
-                      linked = True
-                      sizeHashLinked += statFrom.st_size
-                      numFiles += 1
-                      break
-                if not linked:
-                  # may mdiffer
-                  for sFile in sameFiles:
-                    sFilePath = os.path.join(config.backupDirTo, sFile[0], sFile[1], sFile[3])
-                    if os.path.isfile(sFilePath) or (config.dryRun and sFile[0] == today):
-                      mtimeDiffer = True
-                      if config.dbLinkMDiffer:
-                        if not config.dryRun:
-                          os.link(sFilePath, fileTo, follow_symlinks=config.followSymlinks)
-                          if round(statFrom.st_mtime) > sFile[4]:
-                            shutil.copystat(fileFrom, fileTo, follow_symlinks=config.followSymlinks)
-                        linked = True
-                        sizeHashLinked += statFrom.st_size
-                        numFiles += 1
-                      break
-                  
-              db.insertFile(os.path.join(relPath, file), round(statFrom.st_mtime), folderId, hashId)
-            
-
-            if not linked:
-              sys.stdout.write('C')
-              sys.stdout.flush()
-              sys.stdout.write('\r')
-              sys.stdout.flush()
-              if not config.dryRun:
-                shutil.copy2(fileFrom, fileTo, follow_symlinks=config.followSymlinks)
-              sizeCopied += statFrom.st_size
-              numFiles += 1
-            printToTerminalSize(' ')
-            sys.stdout.write('\r')
-            sys.stdout.flush()
-            print('    ' + os.path.join(relPath, file))
-            if linked:
-              if mtimeDiffer:
-                print('      hash-linked with different mtime with ' + os.path.join(sFile[0], sFile[1], sFile[3]))
-              else:
-                print('      hash-linked with ' + os.path.join(sFile[0], sFile[1], sFile[3]))
-            else:
-              if mtimeDiffer:
-                print('      may be hash-linked with different mtime with ' + os.path.join(sFile[0], sFile[1], sFile[3]))
-              
           else:
-            printToTerminalSize(' ')
-            sys.stdout.write('\r')
-            sys.stdout.flush()
+            if entriesPrev is None:
+              with metrics.timer('listPrev'):
+                entriesPrev = scanDir(os.path.join(dirPrev, relPath))
+            entryPrev = entriesPrev.get(file)
+            if not (entryPrev is None):
+              if entryPrev.is_file() or entryPrev.is_symlink():
+                with metrics.timer('statPrev'):
+                  statPrev = entryPrev.stat(follow_symlinks=config.followSymlinks)
+                if (statFrom.st_size == statPrev.st_size) and (round(statFrom.st_mtime) == round(statPrev.st_mtime)):
+                  filePrev = entryPrev.path
+          if not (filePrev is None) and config.dbEnable:
+            with metrics.timer('index'):
+              rowPrev = indexPrev.get(os.path.join(relPath, file))
 
-      os.sync()
+        # link from previous backup
+        if not (filePrev is None) and not config.dryRun:
+          try:
+            with metrics.timer('link'):
+              os.link(filePrev, os.path.join(curDirTo, file), follow_symlinks=config.followSymlinks)
+          except FileNotFoundError:
+            # copy in the previous backup disappeared since the manifest was written
+            filePrev = None
+            rowPrev = None
+          except OSError as e:
+            if e.errno != errno.EMLINK:
+              raise
+            # inode of the copy in the previous backup reached the limit of the hardlinks
+            filePrev = None
+            rowPrev = None
+
+        # schedule hashing, unless the file will be hashed while being copied
+        hashJob = None
+        if config.dbEnable and (filePrev is None or rowPrev is None):
+          if not (filePrev is None):
+            hashJob = hasher.submit(fileFrom, statFrom.st_size)
+          elif not (config.speculativeCopy and not config.dryRun):
+            # skip hashing of the file if no file has the same size or its sample differs from the samples of the files with the same size
+            samples = None
+            if config.prefilterSize > 0 and (config.followSymlinks or not entry.is_symlink()):
+              samples = hashCache.getSamples(statFrom.st_size)
+            hashJob = hasher.submit(fileFrom, statFrom.st_size, samples)
 
-      print('  Copied:        ' + readableSize(sizeCopied))
-      print('  Linked:        ' + readableSize(sizeLinked))
-      print('  Hash-linked:   ' + readableSize(sizeHashLinked))
-      print('  Files written: ' + str(numFiles))
+        yield relPath, file, statFrom, filePrev, rowPrev, hashJob, False
@@ -1,12 +1,110 @@
 #!/usr/bin/python3
 
-import pathlib
+import os
+import json
 import datetime
 from .database import Database
 
+# name of the summary file in the database folder
+SUMMARY_FILE = 'summary.json'
+
+# version of the format of the summary file
+SUMMARY_VERSION = 1
+
+# name of the catalog of all backups in the database folder
+CATALOG_FILE = 'catalog.sqlite'
+
+
+def catalogPath(config, backup):
+  """
+  Returns path to the database storing the backup, which is either the database of the backup or the catalog of all backups.
+
+  Args:
+    config (Config): configuration object
+    backup (str): name of the backup
+
+  Returns:
+    str: path to the database
+  """
+
+  if config.dbSingle:
+    return os.path.join(config.dbPath, CATALOG_FILE)
+  return os.path.join(config.dbPath, backup + '.sqlite')
+
+
+def hasCatalog(config, backup):
+  """
+  Checks whether the backup is stored in the database.
+
+  Args:
+    config (Config): configuration object
+    backup (str): name of the backup
+
+  Returns:
+    bool: True if the backup is stored in the database
+  """
+
+  path = catalogPath(config, backup)
+  if not os.path.isfile(path):
+    return False
+  if not config.dbSingle:
+    return True
+  db = Database(path, readonly=True)
+  stored = db.getBackup(backup) is not None
+  db.close()
+  return stored
+
+
+def openCatalog(config, backup, readonly=True, **kwargs):
+  """
+  Opens the database of the backup, or the catalog of all backups restricted to the backup.
+
+  Args:
+    config (Config): configuration object
+    backup (str): name of the backup
+    readonly (bool): open database in readonly mode
+    kwargs (dict): other arguments of the database
+
+  Returns:
+    Database: database of the backup
+  """
+
+  if config.dbSingle:
+    return Database(catalogPath(config, backup), readonly=readonly, single=True, backup=backup, compact=config.dbCompact, **kwargs)
+  return Database(catalogPath(config, backup), readonly=readonly, compact=config.dbCompact, **kwargs)
+
+
+def removeCatalog(config, backup):
+  """
+  Removes the database of the backup, or the backup from the catalog of all backups.
+
+  Args:
+    config (Config): configuration object
+    backup (str): name of the backup
+
+  Returns:
+    None
+  """
+
+  path = catalogPath(config, backup)
+  if config.dbSingle:
+    if os.path.isfile(path):
+      db = Database(path, single=True)
+      backupId = db.getBackup(backup)
+      if backupId is not None:
+        db.removeBackup(backupId)
+      db.close()
+    return
+  for file in [path, path + '-wal', path + '-shm']:
+    try:
+      os.remove(file)
+    except FileNotFoundError:
+      pass
+
+
 def getBackups(config):
   """
-  Returns list of the backups on the media and in the database.
+  Returns list of the backups on the media and in the database. When the database is enabled, the summary of the backups stored in the database folder is used and only the backups whose folder or database changed since are read again.
 
   Args:
     config (Config): configuration object
@@ -15,34 +113,191 @@ def getBackups(config):
     dict: list of backups
   """
 
-  dirTo = pathlib.Path(config.backupDirTo)
-  backups = list(dirTo.iterdir())
-  backups.sort(reverse=True)
-  
-  backupsDict = {}
+  if not config.dbEnable:
+    backupsDict = {}
+    for backup in listBackups(config):
+      backupsDict[backup] = scanBackup(config, backup)['folders']
+    return backupsDict
+
+  summary = loadSummary(config)
+  changed = False
 
-  # get backups from HDD
+  # list the backups only when some was added or removed
+  mtime = os.stat(config.backupDirTo).st_mtime_ns
+  if summary['mtime'] != mtime:
+    backups = listBackups(config)
+    summary['mtime'] = mtime
+    changed = True
+  else:
+    backups = list(summary['backups'].keys())
+
+  entries = {}
   for backup in backups:
-    if backup.is_dir():
-      backupItems = backup.iterdir()
-      backupsDict[backup.name] = {}
-      for item in backupItems:
-        backupsDict[backup.name][item.name] = {'HDD': True, 'DB': False}
-
-  # get backups form DB
-  dbPath = pathlib.Path(config.dbPath)
-  if config.dbEnable:
-    for backup in backups:
-      dbPathBackup = dbPath / (backup.name + '.sqlite')
-      if dbPathBackup.is_file():
-        db = Database(dbPathBackup, readonly=True)
-        backupItems = db.getFolders()
-        if backup.name not in backupsDict:
-          backupsDict[backup] = {}
-        for _, item in backupItems:
-          if item not in backupsDict[backup.name]:
-            backupsDict[backup.name][item] = {'HDD': False, 'DB': True}
-          else:
-            backupsDict[backup.name][item]['DB'] = True
+    entry = summary['backups'].get(backup)
+    if entry is None or entry['mtime'] != backupMtime(config, backup) or entry['dbMtime'] != catalogMtime(config, backup):
+      entry = scanBackup(config, backup)
+      changed = True
+    entries[backup] = entry
+  if changed or len(entries) != len(summary['backups']):
+    summary['backups'] = entries
+    saveSummary(config, summary)
 
+  backupsDict = {}
+  for backup, entry in entries.items():
+    backupsDict[backup] = entry['folders']
   return backupsDict
+
+
+def listBackups(config):
+  """
+  Lists the backups on the media.
+
+  Args:
+    config (Config): configuration object
+
+  Returns:
+    list of str: names of the backups
+  """
+
+  backups = [entry.name for entry in os.scandir(config.backupDirTo) if entry.is_dir()]
+  backups.sort(reverse=True)
+  return backups
+
+
+def backupMtime(config, backup):
+  """
+  Returns mtime of the folder of the backup, which changes when some folder is added into the backup or removed from it.
+
+  Args:
+    config (Config): configuration object
+    backup (str): name of the backup
+
+  Returns:
+    int: mtime in nanoseconds or None if the backup does not exist
+  """
+
+  try:
+    return os.stat(os.path.join(config.backupDirTo, backup)).st_mtime_ns
+  except FileNotFoundError:
+    return None
+
+
+def catalogMtime(config, backup):
+  """
+  Returns mtime of the database of the backup, or of the catalog of all backups, including its write-ahead log, empty log created by opening the database is ignored.
+
+  Args:
+    config (Config): configuration object
+    backup (str): name of the backup
+
+  Returns:
+    int: mtime in nanoseconds or None if the database does not exist
+  """
+
+  mtime = None
+  path = catalogPath(config, backup)
+  for file in [path, path + '-wal']:
+    try:
+      stat = os.stat(file)
+    except FileNotFoundError:
+      continue
+    if file == path or stat.st_size > 0:
+      mtime = max(mtime or 0, stat.st_mtime_ns)
+  return mtime
+
+
+def scanBackup(config, backup):
+  """
+  Reads the folders of the backup from the media and from the database.
+
+  Args:
+    config (Config): configuration object
+    backup (str): name of the backup
+
+  Returns:
+    dict: summary of the backup
+  """
+
+  entry = {'mtime': backupMtime(config, backup), 'dbMtime': None, 'folders': {}}
+  folders = entry['folders']
+
+  # get folders from HDD
+  for item in os.scandir(os.path.join(config.backupDirTo, backup)):
+    folders[item.name] = {'HDD': True, 'DB': False, 'files': None, 'size': None}
+
+  # get folders form DB
+  if config.dbEnable:
+    entry['dbMtime'] = catalogMtime(config, backup)
+    if hasCatalog(config, backup):
+      db = openCatalog(config, backup)
+      for item, files, size in db.getFolderStats():
+        if item not in folders:
+          folders[item] = {'HDD': False, 'DB': True, 'files': files, 'size': size}
+        else:
+          folders[item].update({'DB': True, 'files': files, 'size': size})
+      db.close()
+      # closing may checkpoint the write-ahead log
+      entry['dbMtime'] = catalogMtime(config, backup)
+
+  return entry
+
+
+def loadSummary(config):
+  """
+  Loads the summary of the backups from the database folder.
+
+  Args:
+    config (Config): configuration object
+
+  Returns:
+    dict: summary of the backups, empty if it does not exist or it is not readable
+  """
+
+  try:
+    with open(os.path.join(config.dbPath, SUMMARY_FILE)) as f:
+      summary = json.load(f)
+    if summary.get('version') == SUMMARY_VERSION:
+      return summary
+  except (OSError, ValueError):
+    pass
+  return {'version': SUMMARY_VERSION, 'mtime': None, 'backups': {}}
+
+
+def saveSummary(config, summary):
+  """
+  Atomically writes the summary of the backups into the database folder.
+
+  Args:
+    config (Config): configuration object
+    summary (dict): summary of the backups
+
+  Returns:
+    None
+  """
+
+  path = os.path.join(config.dbPath, SUMMARY_FILE)
+  with open(path + '.tmp', 'w') as f:
+    json.dump(summary, f)
+  os.replace(path + '.tmp', path)
+
+
+def updateSummary(config, backup):
+  """
+  Reads the backup again and stores it into the summary of the backups. Other backups are kept untouched.
+
+  Args:
+    config (Config): configuration object
+    backup (str): name of the backup
+
+  Returns:
+    None
+  """
+
+  if not config.dbEnable:
+    return
+  summary = loadSummary(config)
+  if os.path.isdir(os.path.join(config.backupDirTo, backup)):
+    summary['backups'][backup] = scanBackup(config, backup)
+  else:
+    summary['backups'].pop(backup, None)
+  saveSummary(config, summary)
@@ -20,12 +20,17 @@ def cli():
 
 @cli.command(short_help='Create new backup.', help='Creates new backup as defined in the CONFIG file.')
 @click.option('--dry-run', is_flag=True)
+@click.option('--resume', is_flag=True, help='Continue the interrupted backup instead of creating new one.')
+@click.option('--prescan', is_flag=True, help='Count the size of the folders first to estimate the remaining time.')
+@click.option('--json-events', type=click.Path(dir_okay=False, writable=True), help='Write decisions about the files as JSON lines into the file.')
+@click.option('--metrics', type=click.Path(dir_okay=False, writable=True), help='Write time spent in the phases and database latencies as JSON into the file.')
+@click.option('--prometheus', type=click.Path(dir_okay=False, writable=True), help='Write the metrics into the file for the textfile collector of Prometheus.')
 @common_params
-def backup(config, dry_run):
+def backup(config, dry_run, resume, prescan, json_events, metrics, prometheus):
 
   from .backup import Backup
 
-  Backup.main(config, dry_run)
+  Backup.main(config, dry_run, prescan, json_events, metrics, prometheus, resume=resume)
 
 
 @cli.command(short_help='List all backups.', help='Lists all backups on the drive and in the database.')
@@ -37,23 +42,55 @@ def list(config):
   List.main(config)
 
 
-@cli.command(short_help='Prune needless backups.', help='Prune backups that are needless.')
+@cli.command(short_help='Prune needless backups.', help='Prune backups that are needless. Backups expired by the retention policy in the CONFIG file are listed, and deleted with --apply.')
+@click.option('--apply', is_flag=True, help='Delete the backups expired by the retention policy.')
+@click.option('--workers', '-w', default=8, type=click.IntRange(min=1), help='Number of threads scanning and deleting the backups.')
 @common_params
-def prune(config):
+def prune(config, apply, workers):
 
   from .prune import Prune
 
-  Prune.main(config)
+  Prune.main(config, apply, workers)
 
 
-@cli.command(short_help='Get size of folder in the backup.', help='Get size of folder in the backup.')
-@click.argument('path', type=click.Path(exists=True, readable=True))
+@cli.command('db-upgrade', short_help='Upgrade databases of the backups.', help='Upgrades databases of all backups defined in the CONFIG file to the current version.')
+@common_params
+def dbUpgrade(config):
+
+  from .upgrade import Upgrade
+
+  Upgrade.main(config)
+
+
+@cli.command('db-import', short_help='Import databases into the catalog.', help='Imports databases of all backups defined in the CONFIG file into the catalog of all backups.')
+@common_params
+def dbImport(config):
+
+  from .importer import Importer
+
+  Importer.main(config)
+
+
+@cli.command('db-maintain', short_help='Maintain databases of the backups.', help='Removes unreferenced hashes from databases of all backups defined in the CONFIG file, updates their statistics, truncates their write-ahead logs and vacuums them.')
+@click.option('--workers', '-w', default=4, type=click.IntRange(min=1), help='Number of databases maintained at once.')
+@click.option('--vacuum-threshold', default=10, type=click.IntRange(min=0, max=100), help='Vacuum the databases with at least this percentage of free pages.')
+@common_params
+def dbMaintain(config, workers, vacuum_threshold):
+
+  from .maintain import Maintain
+
+  Maintain.main(config, workers, vacuum_threshold)
+
+
+@cli.command(short_help='Get size of folders in the backup.', help='Get size of folders in the backup, hardlinked files are counted once.')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, readable=True))
+@click.option('--workers', '-w', default=8, type=click.IntRange(min=1), help='Number of threads listing the folders.')
 @click.help_option('--help', '-h')
-def size(path):
+def size(paths, workers):
 
   from .size import Size
 
-  Size.main(path)
+  Size.main(paths, workers)
 
 
 if __name__ == '__main__':
@@ -4,8 +4,9 @@ import os
 import yaml
 import copy
 import pathlib
-import collections
+import collections.abc
 from os.path import normpath
+from .io import newHash
 
 class Config:
   """
@@ -25,8 +26,40 @@ class Config:
     },
     'followSymlinks': False,
     'history': -1,
+    'retention': {
+      'last': 0,
+      'days': 0,
+      'daily': 0,
+      'weekly': 0,
+      'monthly': 0,
+    },
     'database': {
       'enable': False,
+      'manifest': True,
+      'manifestPath': '',
+      'single': False,
+      'compact': False,
+    },
+    'hash': {
+      'algorithm': 'sha256',
+    },
+    'performance': {
+      'hashWorkers': 1,
+      'folderWorkers': 1,
+      'pipeline': False,
+      'pipelineQueue': 1000,
+      'copyWorkers': 4,
+      'catalogsInMemory': 0,
+      'catalogMmapSize': 0,
+      'catalogCacheSize': 0,
+      'dbBatchRows': 1000,
+      'dbBatchSeconds': 5,
+      'pathIndexMemory': 256,
+      'hashCacheMemory': 1024,
+      'speculativeCopy': False,
+      'verifyCopy': False,
+      'progressInterval': 100,
+      'prefilterSize': 1,
     },
   }
 
@@ -115,6 +148,33 @@ class Config:
       raise ConfigError('history', config['history'])
     self.history = config['history']
 
+    # check retention
+    if not isinstance(config['retention']['last'], int):
+      raise ConfigError('retention:last', config['retention']['last'])
+    if not config['retention']['last'] >= 0:
+      raise ConfigError('retention:last', config['retention']['last'])
+    self.retainLast = config['retention']['last']
+    if not isinstance(config['retention']['days'], int):
+      raise ConfigError('retention:days', config['retention']['days'])
+    if not config['retention']['days'] >= 0:
+      raise ConfigError('retention:days', config['retention']['days'])
+    self.retainDays = config['retention']['days']
+    if not isinstance(config['retention']['daily'], int):
+      raise ConfigError('retention:daily', config['retention']['daily'])
+    if not config['retention']['daily'] >= 0:
+      raise ConfigError('retention:daily', config['retention']['daily'])
+    self.retainDaily = config['retention']['daily']
+    if not isinstance(config['retention']['weekly'], int):
+      raise ConfigError('retention:weekly', config['retention']['weekly'])
+    if not config['retention']['weekly'] >= 0:
+      raise ConfigError('retention:weekly', config['retention']['weekly'])
+    self.retainWeekly = config['retention']['weekly']
+    if not isinstance(config['retention']['monthly'], int):
+      raise ConfigError('retention:monthly', config['retention']['monthly'])
+    if not config['retention']['monthly'] >= 0:
+      raise ConfigError('retention:monthly', config['retention']['monthly'])
+    self.retainMonthly = config['retention']['monthly']
+
     # check database
     self.dbEnable = config['database']['enable']
     if config['database']['enable']:
@@ -124,6 +184,108 @@ class Config:
       if config['database']['linkMtimeDiffer'] not in [True, False]:
         raise ConfigError('database:linkMtimeDiffer', config['database']['linkMtimeDiffer'])
       self.dbLinkMDiffer = config['database']['linkMtimeDiffer']
+      if config['database']['manifest'] not in [True, False]:
+        raise ConfigError('database:manifest', config['database']['manifest'])
+      self.manifest = config['database']['manifest']
+      if not isinstance(config['database']['manifestPath'], str):
+        raise ConfigError('database:manifestPath', config['database']['manifestPath'])
+      if config['database']['manifestPath'] == '':
+        self.manifestPath = os.path.join(self.dbPath, 'manifests')
+      else:
+        self.manifestPath = normpath(str(pathlib.Path.cwd().joinpath(pathlib.Path(path).resolve().parent, config['database']['manifestPath'])))
+      if config['database']['single'] not in [True, False]:
+        raise ConfigError('database:single', config['database']['single'])
+      self.dbSingle = config['database']['single']
+      if config['database']['compact'] not in [True, False]:
+        raise ConfigError('database:compact', config['database']['compact'])
+      self.dbCompact = config['database']['compact']
+    else:
+      self.manifest = False
+      self.dbSingle = False
+      self.dbCompact = False
+
+    # check hash
+    try:
+      newHash(config['hash']['algorithm'])
+    except (ValueError, ImportError, TypeError):
+      raise ConfigError('hash:algorithm', config['hash']['algorithm'])
+    self.hashAlgorithm = config['hash']['algorithm']
+
+    # check performance
+    if not isinstance(config['performance']['hashWorkers'], int):
+      raise ConfigError('performance:hashWorkers', config['performance']['hashWorkers'])
+    if not config['performance']['hashWorkers'] >= 1:
+      raise ConfigError('performance:hashWorkers', config['performance']['hashWorkers'])
+    self.hashWorkers = config['performance']['hashWorkers']
+    if not isinstance(config['performance']['folderWorkers'], int):
+      raise ConfigError('performance:folderWorkers', config['performance']['folderWorkers'])
+    if not config['performance']['folderWorkers'] >= 1:
+      raise ConfigError('performance:folderWorkers', config['performance']['folderWorkers'])
+    self.folderWorkers = config['performance']['folderWorkers']
+    if config['performance']['pipeline'] not in [True, False]:
+      raise ConfigError('performance:pipeline', config['performance']['pipeline'])
+    self.pipeline = config['performance']['pipeline']
+    if not isinstance(config['performance']['pipelineQueue'], int):
+      raise ConfigError('performance:pipelineQueue', config['performance']['pipelineQueue'])
+    if not config['performance']['pipelineQueue'] >= 1:
+      raise ConfigError('performance:pipelineQueue', config['performance']['pipelineQueue'])
+    self.pipelineQueue = config['performance']['pipelineQueue']
+    if not isinstance(config['performance']['copyWorkers'], int):
+      raise ConfigError('performance:copyWorkers', config['performance']['copyWorkers'])
+    if not config['performance']['copyWorkers'] >= 1:
+      raise ConfigError('performance:copyWorkers', config['performance']['copyWorkers'])
+    self.copyWorkers = config['performance']['copyWorkers']
+    if not isinstance(config['performance']['catalogsInMemory'], int):
+      raise ConfigError('performance:catalogsInMemory', config['performance']['catalogsInMemory'])
+    if not config['performance']['catalogsInMemory'] >= -1:
+      raise ConfigError('performance:catalogsInMemory', config['performance']['catalogsInMemory'])
+    self.catalogsInMemory = config['performance']['catalogsInMemory']
+    if not isinstance(config['performance']['catalogMmapSize'], int):
+      raise ConfigError('performance:catalogMmapSize', config['performance']['catalogMmapSize'])
+    if not config['performance']['catalogMmapSize'] >= 0:
+      raise ConfigError('performance:catalogMmapSize', config['performance']['catalogMmapSize'])
+    self.catalogMmapSize = config['performance']['catalogMmapSize']*1024*1024
+    if not isinstance(config['performance']['catalogCacheSize'], int):
+      raise ConfigError('performance:catalogCacheSize', config['performance']['catalogCacheSize'])
+    if not config['performance']['catalogCacheSize'] >= 0:
+      raise ConfigError('performance:catalogCacheSize', config['performance']['catalogCacheSize'])
+    self.catalogCacheSize = config['performance']['catalogCacheSize']*1024*1024
+    if not isinstance(config['performance']['dbBatchRows'], int):
+      raise ConfigError('performance:dbBatchRows', config['performance']['dbBatchRows'])
+    if not config['performance']['dbBatchRows'] >= 1:
+      raise ConfigError('performance:dbBatchRows', config['performance']['dbBatchRows'])
+    self.dbBatchRows = config['performance']['dbBatchRows']
+    if not isinstance(config['performance']['dbBatchSeconds'], (int, float)):
+      raise ConfigError('performance:dbBatchSeconds', config['performance']['dbBatchSeconds'])
+    if not config['performance']['dbBatchSeconds'] >= 0:
+      raise ConfigError('performance:dbBatchSeconds', config['performance']['dbBatchSeconds'])
+    self.dbBatchSeconds = config['performance']['dbBatchSeconds']
+    if not isinstance(config['performance']['pathIndexMemory'], int):
+      raise ConfigError('performance:pathIndexMemory', config['performance']['pathIndexMemory'])
+    if not config['performance']['pathIndexMemory'] >= 0:
+      raise ConfigError('performance:pathIndexMemory', config['performance']['pathIndexMemory'])
+    self.pathIndexMemory = config['performance']['pathIndexMemory']*1024*1024
+    if not isinstance(config['performance']['hashCacheMemory'], int):
+      raise ConfigError('performance:hashCacheMemory', config['performance']['hashCacheMemory'])
+    if not config['performance']['hashCacheMemory'] >= 0:
+      raise ConfigError('performance:hashCacheMemory', config['performance']['hashCacheMemory'])
+    self.hashCacheMemory = config['performance']['hashCacheMemory']*1024*1024
+    if config['performance']['speculativeCopy'] not in [True, False]:
+      raise ConfigError('performance:speculativeCopy', config['performance']['speculativeCopy'])
+    self.speculativeCopy = config['performance']['speculativeCopy']
+    if config['performance']['verifyCopy'] not in [True, False]:
+      raise ConfigError('performance:verifyCopy', config['performance']['verifyCopy'])
+    self.verifyCopy = config['performance']['verifyCopy']
+    if not isinstance(config['performance']['progressInterval'], int):
+      raise ConfigError('performance:progressInterval', config['performance']['progressInterval'])
+    if not config['performance']['progressInterval'] >= 0:
+      raise ConfigError('performance:progressInterval', config['performance']['progressInterval'])
+    self.progressInterval = config['performance']['progressInterval']/1000
+    if not isinstance(config['performance']['prefilterSize'], int):
+      raise ConfigError('performance:prefilterSize', config['performance']['prefilterSize'])
+    if not config['performance']['prefilterSize'] >= 0:
+      raise ConfigError('performance:prefilterSize', config['performance']['prefilterSize'])
+    self.prefilterSize = config['performance']['prefilterSize']*1024*1024
 
     # if everything pass, then save config
     self.config = config
@@ -187,7 +349,7 @@ def deepUpdate(d, u):
   """
 
   for k, v in u.items():
-    if isinstance(v, collections.Mapping):
+    if isinstance(v, collections.abc.Mapping):
       r = deepUpdate(d.get(k, {}), v)
       d[k] = r
     else:
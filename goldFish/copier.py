@@ -0,0 +1,366 @@
+#!/usr/bin/python3
+
+import os
+import time
+import errno
+import shutil
+import threading
+import collections
+from .io import newHash
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+class Copier:
+  """
+  Class copying the files into the backup. Tries to clone the file on copy-on-write filesystems first, then to copy it inside the kernel and falls back to copying through buffers. Holes of sparse files are kept. The copies can be hashed, the data copied through the buffers or by sendfile are hashed while they are copied, only the copies cloned or copied inside the kernel are read back. Several files can be copied in different threads at once.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # ioctl request cloning the file, from linux/fs.h
+  FICLONE = 0x40049409
+
+  # size of the buffer for copying through user space
+  BUFFER_SIZE = 1048576
+
+  # copy methods from the fastest one
+  METHODS = ['reflink', 'copy_file_range', 'sendfile', 'buffered']
+
+  # errors meaning that the copy method is not supported
+  UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+
+  def __init__(self, followSymlinks, algorithm='sha256', metrics=None):
+    """
+    Initialization of the object.
+
+    Args:
+      followSymlinks (bool): follow symlinks
+      algorithm (str): name of the hash algorithm used when hashing the copies
+      metrics (Metrics): metrics measuring the time of copying or None
+
+    Returns:
+      None
+    """
+
+    self.followSymlinks = followSymlinks
+    self.algorithm = algorithm
+    self.unsupported = set()
+    self.counts = collections.Counter()
+    self.lock = threading.Lock()
+    self.metrics = metrics
+
+
+  def copy(self, src, dst):
+    """
+    Copies the file with its metadata like shutil.copy2 using the fastest available method.
+
+    Args:
+      src (str): path to the source file
+      dst (str): path to the destination file
+
+    Returns:
+      str: method used to copy the file
+    """
+
+    method, fileHash, symlink = self.__copy(src, dst, False)
+    return method
+
+
+  def copyHash(self, src, dst):
+    """
+    Copies the file like copy() and computes the hash of the copy in the same pass, so that the hash describes the data written into the backup. Only the copies cloned or copied inside the kernel are read back to be hashed.
+
+    Args:
+      src (str): path to the source file
+      dst (str): path to the destination file
+
+    Returns:
+      str: hash of the copied file
+      bool: symlink of the file
+      str: method used to copy the file
+    """
+
+    method, fileHash, symlink = self.__copy(src, dst, True)
+    return fileHash, symlink, method
+
+
+  def __copy(self, src, dst, hashed):
+    """
+    Copies the file with its metadata using the fastest available method and optionally hashes the copied data.
+
+    Args:
+      src (str): path to the source file
+      dst (str): path to the destination file
+      hashed (bool): whether to hash the copied data
+
+    Returns:
+      str: method used to copy the file
+      str: hash of the copied file or None if not hashed
+      bool: symlink of the file
+    """
+
+    start = time.monotonic()
+    fileHash = None
+    symlink = not self.followSymlinks and os.path.islink(src)
+    if symlink:
+      target = os.readlink(src)
+      os.symlink(target, dst)
+      method = 'symlink'
+      if hashed:
+        fileHash = newHash(self.algorithm)
+        fileHash.update(target.encode())
+    else:
+      with open(src, 'rb') as fsrc, open(dst, 'w+b') as fdst:
+        statSrc = os.fstat(fsrc.fileno())
+        statDst = os.fstat(fdst.fileno())
+        devices = (statSrc.st_dev, statDst.st_dev)
+        for method in Copier.METHODS:
+          if (method, devices) in self.unsupported:
+            continue
+          # the hash is started again when the method falls back
+          fileHash = newHash(self.algorithm) if hashed else None
+          try:
+            if method == 'reflink':
+              self.__reflink(fsrc.fileno(), fdst.fileno())
+            else:
+              end = 0
+              for offset, length in Copier.segments(fsrc.fileno(), statSrc):
+                if fileHash is not None and method in ['sendfile', 'buffered']:
+                  Copier.__hashZeros(fileHash, offset - end)
+                  hashSegment = fileHash
+                else:
+                  hashSegment = None
+                if method == 'copy_file_range':
+                  copied = self.__copyFileRange(fsrc.fileno(), fdst.fileno(), offset, length)
+                elif method == 'sendfile':
+                  copied = self.__sendfile(fsrc.fileno(), fdst.fileno(), offset, length, hashSegment)
+                else:
+                  copied = self.__buffered(fsrc.fileno(), fdst.fileno(), offset, length, hashSegment)
+                end = offset + copied
+              if fileHash is not None and method in ['sendfile', 'buffered']:
+                # trailing hole
+                Copier.__hashZeros(fileHash, statSrc.st_size - end)
+              Copier.__truncate(fsrc.fileno(), fdst.fileno())
+            if fileHash is not None and method in ['reflink', 'copy_file_range']:
+              # the data did not pass through the user space, read the copy back
+              hashStart = time.monotonic()
+              Copier.__hashBack(fileHash, fdst.fileno())
+              if self.metrics is not None:
+                self.metrics.time('hashCopy', time.monotonic() - hashStart)
+            break
+          except OSError as e:
+            if method == 'buffered' or e.errno not in Copier.UNSUPPORTED:
+              raise
+            self.unsupported.add((method, devices))
+            os.ftruncate(fdst.fileno(), 0)
+            os.lseek(fdst.fileno(), 0, os.SEEK_SET)
+    shutil.copystat(src, dst, follow_symlinks=self.followSymlinks)
+
+    with self.lock:
+      self.counts[method] += 1
+    if self.metrics is not None:
+      self.metrics.time('copy', time.monotonic() - start)
+      self.metrics.add('copyMethod.' + method)
+    return method, fileHash.hexdigest() if fileHash is not None else None, symlink
+
+
+  def segments(fd, stat):
+    """
+    Finds the segments of the file containing data.
+
+    Args:
+      fd (int): file descriptor of the file
+      stat (os.stat_result): stat of the file
+
+    Returns:
+      generator: segments in form (offset, length), length None means up to the end of the file
+    """
+
+    # not sparse
+    if stat.st_blocks*512 >= stat.st_size or not hasattr(os, 'SEEK_DATA'):
+      yield 0, None
+      return
+
+    offset = 0
+    while offset < stat.st_size:
+      try:
+        data = os.lseek(fd, offset, os.SEEK_DATA)
+      except OSError as e:
+        if e.errno == errno.ENXIO:
+          # only hole till the end of the file
+          return
+        if e.errno == errno.EINVAL and offset == 0:
+          # seeking holes not supported
+          yield 0, None
+          return
+        raise
+      hole = os.lseek(fd, data, os.SEEK_HOLE)
+      yield data, hole - data
+      offset = hole
+
+
+  def __truncate(fdSrc, fdDst):
+    """
+    Sets the size of the destination file to the size of the source file, so that the trailing hole is kept.
+
+    Args:
+      fdSrc (int): file descriptor of the source file
+      fdDst (int): file descriptor of the destination file
+
+    Returns:
+      None
+    """
+
+    size = os.fstat(fdSrc).st_size
+    if os.fstat(fdDst).st_size < size:
+      os.ftruncate(fdDst, size)
+
+
+  def __hashZeros(fileHash, length):
+    """
+    Updates the hash with the data of the hole.
+
+    Args:
+      fileHash (object): hash to update
+      length (int): length of the hole
+
+    Returns:
+      None
+    """
+
+    zeros = bytes(min(length, Copier.BUFFER_SIZE)) if length > 0 else b''
+    while length > 0:
+      fileHash.update(zeros[:length])
+      length -= len(zeros)
+
+
+  def __hashBack(fileHash, fd):
+    """
+    Updates the hash with the data read back from the copied file.
+
+    Args:
+      fileHash (object): hash to update
+      fd (int): file descriptor of the copied file
+
+    Returns:
+      None
+    """
+
+    offset = 0
+    while True:
+      data = os.pread(fd, Copier.BUFFER_SIZE, offset)
+      if not data:
+        break
+      fileHash.update(data)
+      offset += len(data)
+
+
+  def __reflink(self, fdSrc, fdDst):
+    """
+    Clones the whole file on copy-on-write filesystem.
+
+    Args:
+      fdSrc (int): file descriptor of the source file
+      fdDst (int): file descriptor of the destination file
+
+    Returns:
+      None
+    """
+
+    if fcntl is None:
+      raise OSError(errno.ENOSYS, 'Reflinks are not supported.')
+    fcntl.ioctl(fdDst, Copier.FICLONE, fdSrc)
+
+
+  def __copyFileRange(self, fdSrc, fdDst, offset, length):
+    """
+    Copies the segment of the file inside the kernel by copy_file_range.
+
+    Args:
+      fdSrc (int): file descriptor of the source file
+      fdDst (int): file descriptor of the destination file
+      offset (int): offset of the segment
+      length (int): length of the segment, None up to the end of the file
+
+    Returns:
+      int: number of copied bytes
+    """
+
+    if not hasattr(os, 'copy_file_range'):
+      raise OSError(errno.ENOSYS, 'copy_file_range is not supported.')
+    start = offset
+    while length is None or length > 0:
+      copied = os.copy_file_range(fdSrc, fdDst, Copier.BUFFER_SIZE*64 if length is None else min(length, Copier.BUFFER_SIZE*64), offset, offset)
+      if copied == 0:
+        break
+      offset += copied
+      if length is not None:
+        length -= copied
+    return offset - start
+
+
+  def __sendfile(self, fdSrc, fdDst, offset, length, fileHash=None):
+    """
+    Copies the segment of the file inside the kernel by sendfile. When hashed, each chunk is hashed right after it is sent, while it is still in the page cache, so the source is not read from the disk again.
+
+    Args:
+      fdSrc (int): file descriptor of the source file
+      fdDst (int): file descriptor of the destination file
+      offset (int): offset of the segment
+      length (int): length of the segment, None up to the end of the file
+      fileHash (object): hash updated with the copied data or None
+
+    Returns:
+      int: number of copied bytes
+    """
+
+    if not hasattr(os, 'sendfile'):
+      raise OSError(errno.ENOSYS, 'sendfile is not supported.')
+    chunk = Copier.BUFFER_SIZE*64 if fileHash is None else Copier.BUFFER_SIZE
+    start = offset
+    os.lseek(fdDst, offset, os.SEEK_SET)
+    while length is None or length > 0:
+      copied = os.sendfile(fdDst, fdSrc, offset, chunk if length is None else min(length, chunk))
+      if copied == 0:
+        break
+      if fileHash is not None:
+        fileHash.update(os.pread(fdSrc, copied, offset))
+      offset += copied
+      if length is not None:
+        length -= copied
+    return offset - start
+
+
+  def __buffered(self, fdSrc, fdDst, offset, length, fileHash=None):
+    """
+    Copies the segment of the file through the buffer, the hash is updated from the same buffer.
+
+    Args:
+      fdSrc (int): file descriptor of the source file
+      fdDst (int): file descriptor of the destination file
+      offset (int): offset of the segment
+      length (int): length of the segment, None up to the end of the file
+      fileHash (object): hash updated with the copied data or None
+
+    Returns:
+      int: number of copied bytes
+    """
+
+    copied = 0
+    os.lseek(fdDst, offset, os.SEEK_SET)
+    while length is None or copied < length:
+      data = os.pread(fdSrc, Copier.BUFFER_SIZE if length is None else min(length - copied, Copier.BUFFER_SIZE), offset + copied)
+      if not data:
+        break
+      if fileHash is not None:
+        fileHash.update(data)
+      view = memoryview(data)
+      while view:
+        view = view[os.write(fdDst, view):]
+      copied += len(data)
+    return copied
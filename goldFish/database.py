@@ -1,8 +1,33 @@
 #!/usr/bin/python3
 
+import os
+import time
 import sqlite3
 import pathlib
+import threading
+import functools
 from .io import *
+from .metrics import measured
+
+
+def locked(method):
+  """
+  Decorator serializing the calls of the method of the database, so that one database can be shared by several threads.
+
+  Args:
+    method (function): method to serialize
+
+  Returns:
+    function: serialized method
+  """
+
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    with self.lock:
+      return method(self, *args, **kwargs)
+
+  return wrapper
+
 
 class Database:
   """
@@ -14,8 +39,30 @@ class Database:
   # path for storage in memory
   MEMORY = ':memory:'
 
-
-  def __init__(self, path, readonly=False, init=True):
+  # migrations of the schema, the migration on index i upgrades the database from version i to version i + 1
+  MIGRATIONS = [
+    [
+      'CREATE INDEX IF NOT EXISTS files_index__hashId ON files(hashId)',
+      'CREATE INDEX IF NOT EXISTS files_index__folderId_path ON files(folderId, path)',
+    ],
+    [
+      'CREATE TABLE IF NOT EXISTS settings(name TEXT PRIMARY KEY, value TEXT)',
+      'INSERT OR IGNORE INTO settings(name, value) VALUES(\'hashAlgorithm\', \'sha256\')',
+    ],
+    [
+      'ALTER TABLE hashes ADD COLUMN sample TEXT',
+      'CREATE INDEX IF NOT EXISTS hashes_index__size ON hashes(size)',
+    ],
+  ]
+
+  # current version of the schema
+  VERSION = len(MIGRATIONS)
+
+  # path of the file relative to the folder in the compact schema
+  COMPACT_PATH = 'CASE WHEN dirs.path = \'\' THEN files.name ELSE dirs.path || \'/\' || files.name END'
+
+
+  def __init__(self, path, readonly=False, init=True, batchRows=1, batchSeconds=0, metrics=None, mmapSize=0, cacheSize=0, single=False, backup=None, compact=False):
     """
     Connects to the database.
 
@@ -23,13 +70,39 @@ class Database:
       path (str): path to the sqlite database file
       readonly (bool): open database in readonly mode
       init (bool): whether to initialize the database with empty tables
+      batchRows (int): commit after this number of inserted rows, 1 commits every row
+      batchSeconds (float): commit when this number of seconds elapsed since the last commit, 0 disables
+      metrics (Metrics): metrics measuring the latency of the queries or None
+      mmapSize (int): size of the database file mapped into memory in bytes, 0 disables the mapping
+      cacheSize (int): size of the page cache in bytes, 0 keeps the default size
+      single (bool): whether the database is the catalog of all backups
+      backup (str): name of the backup the catalog of all backups is restricted to or None
+      compact (bool): whether the new database is created with the compact schema, the schema of the existing database is detected
 
     Returns:
       None
     """
 
+    self.metrics = metrics
+    self.single = single
+    self.backup = backup
+    self.backupId = None
+    self.folders = 'folders'
+    self.settings = 'settings'
+    self.shared = False
+    self.compact = compact
+    self.dirIds = {}
+    self.nextFileId = 1
+    self.mmapSize = mmapSize
+    self.cacheSize = cacheSize
+    self.lock = threading.RLock()
     self.readonly = readonly
     self.path = pathlib.Path(path)
+    self.batchRows = batchRows
+    self.batchSeconds = batchSeconds
+    self.pendingFiles = []
+    self.pendingRows = 0
+    self.lastCommit = time.monotonic()
 
     create = False
     if not self.readonly:
@@ -50,6 +123,9 @@ class Database:
     if create and init:
       self.create()
 
+    if self.backup is not None:
+      self.__restrict()
+
 
   def __del__(self):
     """
@@ -61,9 +137,28 @@ class Database:
       None
     """
 
-    if hasattr(self, 'connection'):
-      self.connection.commit()
-      self.connection.close()
+    self.close()
+
+
+  def close(self):
+    """
+    Commits the changes and closes the database file.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      if hasattr(self, 'connection'):
+        if self.shared:
+          # the connection is committed and closed by the database it is shared from
+          self.flush()
+        else:
+          self.commit()
+          self.connection.close()
+        del self.connection
 
 
   def open(self):
@@ -77,13 +172,120 @@ class Database:
     """
 
     if self.readonly:
-      self.connection = sqlite3.connect('file:' + str(self.path) + '?mode=ro', uri=True)
+      self.connection = sqlite3.connect('file:' + str(self.path) + '?mode=ro', uri=True, check_same_thread=False)
     else:
-      self.connection = sqlite3.connect(str(self.path))
+      self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
     self.db = self.connection.cursor()
     self.db.execute('PRAGMA foreign_keys = ON')
     self.db.execute('PRAGMA journal_mode = WAL')
     self.db.execute('PRAGMA synchronous = NORMAL')
+    if self.mmapSize > 0:
+      self.db.execute('PRAGMA mmap_size = {:d}'.format(self.mmapSize))
+    if self.cacheSize > 0:
+      self.db.execute('PRAGMA cache_size = {:d}'.format(-(self.cacheSize // 1024)))
+
+    self.db.execute('PRAGMA user_version')
+    self.version = self.db.fetchone()[0]
+    self.versionOpened = self.version
+    self.db.execute('SELECT name FROM sqlite_master WHERE type = \'table\' AND name = \'backups\'')
+    if self.db.fetchone() is not None:
+      self.single = True
+    self.db.execute('SELECT name FROM sqlite_master WHERE type = \'table\' AND name IN (\'files\', \'dirs\')')
+    tables = set(row[0] for row in self.db.fetchall())
+    if 'files' in tables:
+      self.compact = 'dirs' in tables
+      if self.compact:
+        self.db.execute('SELECT MAX(id) FROM files')
+        self.nextFileId = (self.db.fetchone()[0] or 0) + 1
+    if not self.readonly:
+      if self.version > Database.VERSION:
+        raise DatabaseError('Database at ' + str(self.path) + ' has version ' + str(self.version) + ' which is newer than supported version ' + str(Database.VERSION) + '.')
+      self.migrate()
+
+
+  def migrate(self):
+    """
+    Upgrades the schema of the database to the current version.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.db.execute('SELECT name FROM sqlite_master WHERE type = \'table\' AND name = \'files\'')
+    if self.db.fetchone() is None:
+      return
+
+    while self.version < Database.VERSION:
+      for query in Database.MIGRATIONS[self.version]:
+        self.db.execute(query)
+      self.version += 1
+      self.db.execute('PRAGMA user_version = {:d}'.format(self.version))
+      self.connection.commit()
+
+
+  def outdated(self):
+    """
+    Whether the schema of the database is older than the current version.
+
+    Args:
+
+    Returns:
+      bool: True if the database needs to be upgraded
+    """
+
+    return self.version < Database.VERSION
+
+
+  @locked
+  @measured
+  def commit(self):
+    """
+    Writes all pending rows and commits the transaction.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.flush()
+    self.connection.commit()
+    self.pendingRows = 0
+    self.lastCommit = time.monotonic()
+
+
+  @locked
+  def flush(self):
+    """
+    Inserts the files waiting for the next batch, without commiting them.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    if len(self.pendingFiles) > 0:
+      self.db.executemany(self.__insertFile(), self.pendingFiles)
+      self.pendingFiles = []
+
+
+  def __written(self, rows=1):
+    """
+    Counts the inserted rows and commits the transaction when the batch is full or too old.
+
+    Args:
+      rows (int): number of inserted rows
+
+    Returns:
+      None
+    """
+
+    self.pendingRows += rows
+    if self.pendingRows >= self.batchRows or (self.batchSeconds > 0 and time.monotonic() - self.lastCommit >= self.batchSeconds):
+      self.commit()
 
 
   def create(self):
@@ -96,39 +298,466 @@ class Database:
       None
     """
 
+    if self.single:
+      self.__createCatalog()
+      return
+
     self.db.execute('CREATE TABLE folders(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, CONSTRAINT folders_unique__name UNIQUE(name))')
+    if self.compact:
+      self.db.execute('CREATE TABLE settings(name TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID')
+      self.db.execute('INSERT INTO settings(name, value) VALUES(\'hashAlgorithm\', \'sha256\')')
+      self.__createCompact()
+      self.version = Database.VERSION
+      self.db.execute('PRAGMA user_version = {:d}'.format(self.version))
+      self.connection.commit()
+      return
     self.db.execute('CREATE TABLE hashes(id INTEGER PRIMARY KEY AUTOINCREMENT, hash TEXT, size INTEGER, symlink BOOLEAN CHECK(symlink IN (0, 1)), CONSTRAINT hashes_unique__hash_size UNIQUE(hash, size))')
     self.db.execute('CREATE TABLE files(id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT, mtime INT, folderId INTEGER REFERENCES folders(id) ON DELETE CASCADE ON UPDATE CASCADE, hashId INTEGER REFERENCES hashes(id) ON DELETE CASCADE ON UPDATE CASCADE, CONSTRAINT files_unique__path_folderId UNIQUE(path, folderId))')
     self.connection.commit()
+    self.migrate()
 
 
-  def __moveToMemory(self):
+  def __createCatalog(self):
     """
-    Copy the infile stored database into memory and returns it.
+    Initialize new catalog of all backups, with the hashes shared by all backups and the folders and the settings stored for each backup.
 
     Args:
 
     Returns:
-      Database: in memory database
+      None
     """
 
-    # open new database stored in memory
-    memDb = Database(Database.MEMORY, init=False)
+    self.db.execute('CREATE TABLE backups(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, CONSTRAINT backups_unique__name UNIQUE(name))')
+    self.db.execute('CREATE TABLE folders(id INTEGER PRIMARY KEY AUTOINCREMENT, backupId INTEGER REFERENCES backups(id) ON DELETE CASCADE ON UPDATE CASCADE, name TEXT, CONSTRAINT folders_unique__backupId_name UNIQUE(backupId, name))')
+    self.db.execute('CREATE TABLE settings(backupId INTEGER REFERENCES backups(id) ON DELETE CASCADE ON UPDATE CASCADE, name TEXT, value TEXT, PRIMARY KEY(backupId, name)) WITHOUT ROWID')
+    if self.compact:
+      self.__createCompact()
+    else:
+      self.db.execute('CREATE TABLE hashes(id INTEGER PRIMARY KEY AUTOINCREMENT, hash TEXT, size INTEGER, symlink BOOLEAN CHECK(symlink IN (0, 1)), sample TEXT, CONSTRAINT hashes_unique__hash_size UNIQUE(hash, size))')
+      self.db.execute('CREATE TABLE files(id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT, mtime INT, folderId INTEGER REFERENCES folders(id) ON DELETE CASCADE ON UPDATE CASCADE, hashId INTEGER REFERENCES hashes(id) ON DELETE CASCADE ON UPDATE CASCADE, CONSTRAINT files_unique__path_folderId UNIQUE(path, folderId))')
+      self.db.execute('CREATE INDEX files_index__hashId ON files(hashId)')
+      self.db.execute('CREATE INDEX files_index__folderId_path ON files(folderId, path)')
+      self.db.execute('CREATE INDEX hashes_index__size ON hashes(size)')
+    self.version = Database.VERSION
+    self.db.execute('PRAGMA user_version = {:d}'.format(self.version))
+    self.connection.commit()
 
-    # dump infile database
-    query = "".join(line for line in self.connection.iterdump())
 
-    # fill into memory
-    memDb.db.execute('PRAGMA foreign_keys = OFF')
-    memDb.connection.executescript(query)
-    memDb.db.execute('PRAGMA foreign_keys = ON')
+  def __createCompact(self):
+    """
+    Creates the tables of the files and the hashes in the compact schema. The hashes are stored as binary digests and the files are stored by the id of their directory and their name, clustered by the folder and the path.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.db.execute('CREATE TABLE dirs(id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT, CONSTRAINT dirs_unique__path UNIQUE(path))')
+    self.db.execute('CREATE TABLE hashes(id INTEGER PRIMARY KEY AUTOINCREMENT, hash BLOB, size INTEGER, symlink BOOLEAN CHECK(symlink IN (0, 1)), sample BLOB, CONSTRAINT hashes_unique__hash_size UNIQUE(hash, size))')
+    self.db.execute('CREATE TABLE files(folderId INTEGER REFERENCES folders(id) ON DELETE CASCADE ON UPDATE CASCADE, dirId INTEGER REFERENCES dirs(id), name TEXT, id INTEGER, mtime INT, hashId INTEGER REFERENCES hashes(id) ON DELETE CASCADE ON UPDATE CASCADE, PRIMARY KEY(folderId, dirId, name)) WITHOUT ROWID')
+    self.db.execute('CREATE INDEX files_index__hashId_id ON files(hashId, id)')
+    self.db.execute('CREATE INDEX hashes_index__size ON hashes(size)')
+
+
+  def __hashColumn(self, column, compact=None):
+    """
+    Returns expression selecting the hashes as hexadecimal strings.
+
+    Args:
+      column (str): column of the hashes
+      compact (bool): whether the column is in the compact schema, None for the schema of this database
+
+    Returns:
+      str: expression selecting the hashes
+    """
+
+    if compact is None:
+      compact = self.compact
+    if compact:
+      return 'CASE WHEN {0} IS NULL THEN NULL ELSE lower(hex({0})) END'.format(column)
+    return column
+
+
+  def __hashValue(self, hash):
+    """
+    Converts the hash into the form stored in the database.
+
+    Args:
+      hash (str): hexadecimal hash or None
+
+    Returns:
+      object: stored hash
+    """
+
+    if self.compact and hash is not None:
+      return bytes.fromhex(hash)
+    return hash
+
+
+  def __pathColumn(self):
+    """
+    Returns expression selecting the paths of the files, the directories are joined in the compact schema.
+
+    Args:
+
+    Returns:
+      str: expression selecting the paths
+      str: tables the files are selected from
+      str: condition joining the directories
+    """
+
+    if self.compact:
+      return Database.COMPACT_PATH, 'files, dirs', ' AND files.dirId = dirs.id'
+    return 'files.path', 'files', ''
+
+
+  def __dirId(self, path, create):
+    """
+    Selects id of the directory in the compact schema.
+
+    Args:
+      path (str): path to the directory relative to the folder
+      create (bool): whether to insert the directory which is not stored yet
+
+    Returns:
+      int: id of the directory or None
+    """
+
+    dirId = self.dirIds.get(path)
+    if dirId is None:
+      self.db.execute('SELECT id FROM dirs WHERE path = ? LIMIT 1', (path, ))
+      res = self.db.fetchone()
+      if res is not None:
+        dirId = res[0]
+      elif create:
+        self.db.execute('INSERT INTO dirs(path) VALUES(?)', (path, ))
+        dirId = self.db.lastrowid
+      else:
+        return None
+      self.dirIds[path] = dirId
+    return dirId
+
+
+  def __fileCondition(self, path, folderId):
+    """
+    Returns condition selecting the file.
+
+    Args:
+      path (str): path to the file
+      folderId (int): id of the folder
+
+    Returns:
+      str: condition selecting the file or None if the file can not be stored
+      tuple: parameters of the condition
+    """
+
+    if not self.compact:
+      return 'files.path = ? AND files.folderId = ?', (path, folderId)
+    dirPath, name = os.path.split(path)
+    dirId = self.__dirId(dirPath, False)
+    if dirId is None:
+      return None, None
+    return 'files.folderId = ? AND files.dirId = ? AND files.name = ?', (folderId, dirId, name)
+
+
+  def __fileRow(self, path, mtime, folderId, hashId):
+    """
+    Converts the file into the row inserted by the query of __insertFile().
+
+    Args:
+      path (str): path to the file
+      mtime (int): mtime of the file
+      folderId (int): id of the folder
+      hashId (int): id of the hash
+
+    Returns:
+      tuple: row of the file
+    """
+
+    if not self.compact:
+      return (path, mtime, folderId, hashId)
+    dirPath, name = os.path.split(path)
+    fileId = self.nextFileId
+    self.nextFileId += 1
+    return (fileId, folderId, self.__dirId(dirPath, True), name, mtime, hashId)
+
+
+  def __insertFile(self):
+    """
+    Returns query inserting the row of the file.
+
+    Args:
+
+    Returns:
+      str: query
+    """
+
+    if self.compact:
+      return 'INSERT INTO files(id, folderId, dirId, name, mtime, hashId) VALUES (?, ?, ?, ?, ?, ?)'
+    return 'INSERT INTO files(path, mtime, folderId, hashId)  VALUES (?, ?, ?, ?)'
+
+
+  def __restrict(self):
+    """
+    Restricts the catalog of all backups to the backup, so that it is used as the database of the backup. The folders and the settings of other backups are hidden by the queries selecting only the rows of the backup, the hashes stay shared. The backup is created if it is not stored yet.
+
+    Args:
+
+    Returns:
+      None
+
+    Throws:
+      DatabaseError: when the database is not the catalog of all backups or the backup is not stored in the readonly catalog
+    """
+
+    if not self.single:
+      raise DatabaseError('Database at ' + str(self.path) + ' is not the catalog of all backups.')
+    self.backupId = self.getBackup(self.backup)
+    if self.backupId is None:
+      if self.readonly:
+        raise DatabaseError('Backup ' + self.backup + ' is not stored in the catalog at ' + str(self.path) + '.')
+      self.backupId = self.newBackup(self.backup)
+    self.folders = '(SELECT id, name FROM main.folders WHERE backupId = {:d})'.format(self.backupId)
+    self.settings = '(SELECT name, value FROM main.settings WHERE backupId = {:d})'.format(self.backupId)
+
+
+  def restricted(self, backup):
+    """
+    Restricts the catalog of all backups to the backup over the connection of this database, so that the databases of many backups share one connection.
+
+    Args:
+      backup (str): name of the backup
+
+    Returns:
+      Database: database of the backup sharing the connection
+
+    Throws:
+      DatabaseError: when the database is not the catalog of all backups or the backup is not stored in the readonly catalog
+    """
+
+    db = Database.__new__(Database)
+    db.__dict__.update(self.__dict__)
+    db.shared = True
+    db.db = self.connection.cursor()
+    db.dirIds = {}
+    db.pendingFiles = []
+    db.pendingRows = 0
+    db.backup = backup
+    with self.lock:
+      db.__restrict()
+    return db
+
+
+  @locked
+  @measured
+  def getSetting(self, name, default=None):
+    """
+    Selects value of the setting of the database.
+
+    Args:
+      name (str): name of the setting
+      default (str): value returned when the setting is not stored
+
+    Returns:
+      str: value of the setting
+    """
+
+    if self.version < 2:
+      return default
+
+    self.db.execute('SELECT value FROM ' + self.settings + ' AS settings WHERE name = ? LIMIT 1', (name, ))
+    res = self.db.fetchone()
+    if res == None:
+      return default
+    else:
+      return res[0]
+
+
+  @locked
+  @measured
+  def setSetting(self, name, value):
+    """
+    Stores value of the setting of the database.
+
+    Args:
+      name (str): name of the setting
+      value (str): value of the setting
+
+    Returns:
+      None
+    """
+
+    if self.backupId is None:
+      self.db.execute('INSERT OR REPLACE INTO settings(name, value) VALUES(?, ?)', (name, value))
+    else:
+      self.db.execute('INSERT OR REPLACE INTO main.settings(backupId, name, value) VALUES(?, ?, ?)', (self.backupId, name, value))
+    self.__written()
+
+
+  def __sampleColumn(self):
+    """
+    Returns the column of the sample hashes, which are stored since version 3 of the schema.
+
+    Args:
+
+    Returns:
+      str: column of the sample hashes or NULL
+    """
 
+    if self.version < 3:
+      return 'NULL'
+    else:
+      return self.__hashColumn('hashes.sample')
+
+
+  def getHashAlgorithm(self):
+    """
+    Selects the algorithm of the hashes stored in the database.
+
+    Args:
+
+    Returns:
+      str: name of the hash algorithm
+    """
+
+    return self.getSetting('hashAlgorithm', 'sha256')
+
+
+  def toMemory(self):
+    """
+    Copies the database into memory using the online backup of SQLite, which copies the pages of the database file without parsing them.
+
+    Args:
+
+    Returns:
+      Database: database stored in memory
+    """
+
+    memDb = Database(Database.MEMORY, init=False, metrics=self.metrics)
+    with self.lock:
+      self.flush()
+      self.connection.backup(memDb.connection)
+    memDb.version = self.version
+    memDb.versionOpened = self.versionOpened
+    memDb.readonly = self.readonly
+    memDb.single = self.single
+    memDb.compact = self.compact
+    memDb.nextFileId = self.nextFileId
+    memDb.backup = self.backup
+    if memDb.backup is not None:
+      memDb.__restrict()
     return memDb
 
 
-  def __newBackup(self, name):
+  @locked
+  def getSize(self):
     """
-    Inserts new backup into the database.
+    Returns size of the database.
+
+    Args:
+
+    Returns:
+      int: size of the database in bytes
+    """
+
+    self.db.execute('PRAGMA page_count')
+    pageCount = self.db.fetchone()[0]
+    self.db.execute('PRAGMA page_size')
+    return pageCount*self.db.fetchone()[0]
+
+
+  @locked
+  @measured
+  def removeOrphans(self):
+    """
+    Removes the hashes and the directories which are not referenced by any file.
+
+    Args:
+
+    Returns:
+      int: number of the removed hashes
+    """
+
+    self.commit()
+    self.db.execute('DELETE FROM main.hashes WHERE id NOT IN (SELECT hashId FROM main.files WHERE hashId IS NOT NULL)')
+    hashes = self.db.rowcount
+    if self.compact:
+      self.db.execute('DELETE FROM main.dirs WHERE id NOT IN (SELECT dirId FROM main.files WHERE dirId IS NOT NULL)')
+      self.dirIds = {}
+    self.connection.commit()
+    return hashes
+
+
+  @locked
+  def optimize(self):
+    """
+    Gathers the statistics of the tables and the indexes for the query planner.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.commit()
+    self.db.execute('ANALYZE')
+    self.db.execute('PRAGMA optimize')
+    self.connection.commit()
+
+
+  @locked
+  def getFreePages(self):
+    """
+    Returns number of the free pages of the database.
+
+    Args:
+
+    Returns:
+      int: number of the free pages
+      int: number of all pages
+    """
+
+    self.db.execute('PRAGMA freelist_count')
+    freePages = self.db.fetchone()[0]
+    self.db.execute('PRAGMA page_count')
+    return freePages, self.db.fetchone()[0]
+
+
+  @locked
+  def vacuum(self):
+    """
+    Rebuilds the database file without the free pages.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.commit()
+    self.db.execute('VACUUM')
+
+
+  @locked
+  def checkpoint(self):
+    """
+    Writes the write-ahead log into the database file and truncates it.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.commit()
+    self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+  @locked
+  def newBackup(self, name):
+    """
+    Inserts new backup into the catalog of all backups.
 
     Args:
       name (str): name of the backup
@@ -138,11 +767,13 @@ class Database:
     """
 
     self.db.execute('INSERT INTO backups(name) VALUES(?)', (name, ))
+    backupId = self.db.lastrowid
     self.connection.commit()
-    return self.db.lastrowid
+    return backupId
 
 
-  def __getBackup(self, name):
+  @locked
+  def getBackup(self, name):
     """
     Selects backup id based on backup name.
 
@@ -155,29 +786,109 @@ class Database:
 
     self.db.execute('SELECT id FROM backups WHERE name = ? LIMIT 1', (name, ))
     res = self.db.fetchone()
-    #self.connection.commit()
     if res == None:
       return None
     else:
       return res[0]
 
 
-  def __getBackups(self):
+  @locked
+  def removeBackup(self, backupId):
+    """
+    Removes the backup with its folders, files and settings from the catalog of all backups. The hashes are kept.
+
+    Args:
+      backupId (int): id of the backup
+
+    Returns:
+      None
+    """
+
+    self.commit()
+    self.db.execute('DELETE FROM main.backups WHERE id = ?', (backupId, ))
+    self.connection.commit()
+
+
+  @locked
+  def getBackups(self):
     """
     Selects all stored backups.
     
     Args:
 
     Returns:
-      list of tuples: list of all backups in the DB in form (id, name)
+      list of tuples: list of all backups in the catalog in form (id, name)
     """
     
     self.db.execute('SELECT id, name FROM backups')
     res = self.db.fetchall()
-    #self.connection.commit()
     return res
 
 
+  @locked
+  def importBackup(self, path, name):
+    """
+    Imports the database of one backup into the catalog of all backups. Hashes already stored in the catalog are shared.
+
+    Args:
+      path (str): path to the database of the backup
+      name (str): name of the backup
+
+    Returns:
+      int: number of the imported files
+
+    Throws:
+      DatabaseError: when the database of the backup is not upgraded to the current version
+    """
+
+    self.commit()
+    self.db.execute('ATTACH DATABASE ? AS source', (str(path), ))
+    try:
+      self.db.execute('PRAGMA source.user_version')
+      version = self.db.fetchone()[0]
+      if version != Database.VERSION:
+        raise DatabaseError('Database at ' + str(path) + ' has version ' + str(version) + ', run \'goldFish db-upgrade\' first.')
+      self.db.execute('INSERT INTO main.backups(name) VALUES(?)', (name, ))
+      backupId = self.db.lastrowid
+      self.db.execute('INSERT INTO main.folders(backupId, name) SELECT ?, name FROM source.folders ORDER BY id', (backupId, ))
+
+      # hashes and paths are converted when the backup and the catalog use different schemas
+      self.db.execute('SELECT name FROM source.sqlite_master WHERE type = \'table\' AND name = \'dirs\'')
+      sourceCompact = self.db.fetchone() is not None
+      if sourceCompact:
+        sourcePath = Database.COMPACT_PATH
+        sourceFiles = 'source.files AS files JOIN source.dirs AS dirs ON dirs.id = files.dirId'
+      else:
+        sourcePath = 'files.path'
+        sourceFiles = 'source.files AS files'
+      convert = lambda column: self.__hashColumn(column, sourceCompact)
+      if self.compact and not sourceCompact:
+        convert = lambda column: 'goldFishUnhex(' + column + ')'
+      elif self.compact:
+        convert = lambda column: column
+      self.connection.create_function('goldFishUnhex', 1, lambda hash: None if hash is None else bytes.fromhex(hash), deterministic=True)
+      self.connection.create_function('goldFishDir', 1, lambda path: os.path.split(path)[0], deterministic=True)
+      self.connection.create_function('goldFishName', 1, lambda path: os.path.split(path)[1], deterministic=True)
+
+      self.db.execute('INSERT OR IGNORE INTO main.hashes(hash, size, symlink, sample) SELECT ' + convert('hashes.hash') + ', hashes.size, hashes.symlink, ' + convert('hashes.sample') + ' FROM source.hashes AS hashes ORDER BY hashes.id')
+      joins = ' JOIN source.folders AS folders ON folders.id = files.folderId JOIN main.folders AS targetFolders ON targetFolders.backupId = ? AND targetFolders.name = folders.name JOIN source.hashes AS hashes ON hashes.id = files.hashId JOIN main.hashes AS targetHashes ON targetHashes.hash = ' + convert('hashes.hash') + ' AND targetHashes.size = hashes.size'
+      if self.compact:
+        self.db.execute('INSERT OR IGNORE INTO main.dirs(path) SELECT DISTINCT goldFishDir(' + sourcePath + ') FROM ' + sourceFiles)
+        self.db.execute('INSERT INTO main.files(id, folderId, dirId, name, mtime, hashId) SELECT ? + ROW_NUMBER() OVER (ORDER BY files.id) - 1, targetFolders.id, targetDirs.id, goldFishName(' + sourcePath + '), files.mtime, targetHashes.id FROM ' + sourceFiles + joins + ' JOIN main.dirs AS targetDirs ON targetDirs.path = goldFishDir(' + sourcePath + ')', (self.nextFileId, backupId))
+        self.nextFileId += self.db.rowcount
+      else:
+        self.db.execute('INSERT INTO main.files(path, mtime, folderId, hashId) SELECT ' + sourcePath + ', files.mtime, targetFolders.id, targetHashes.id FROM ' + sourceFiles + joins + ' ORDER BY files.id', (backupId, ))
+      files = self.db.rowcount
+      self.db.execute('INSERT INTO main.settings(backupId, name, value) SELECT ?, name, value FROM source.settings', (backupId, ))
+      self.connection.commit()
+    finally:
+      self.connection.rollback()
+      self.db.execute('DETACH DATABASE source')
+    return files
+
+
+  @locked
+  @measured
   def newFolder(self, name):
     """
     Inserts new backup folder into the database.
@@ -189,11 +900,17 @@ class Database:
       int: id of the inserted folder
     """
 
-    self.db.execute('INSERT INTO folders(name) VALUES(?)', (name, ))
-    self.connection.commit()
-    return self.db.lastrowid
+    if self.backupId is None:
+      self.db.execute('INSERT INTO folders(name) VALUES(?)', (name, ))
+    else:
+      self.db.execute('INSERT INTO main.folders(backupId, name) VALUES(?, ?)', (self.backupId, name))
+    folderId = self.db.lastrowid
+    self.__written()
+    return folderId
 
 
+  @locked
+  @measured
   def getFolder(self, name):
     """
     Selects folder id based on folder name.
@@ -205,7 +922,7 @@ class Database:
       int: id of the folder
     """
 
-    self.db.execute('SELECT id FROM folders WHERE name = ? LIMIT 1', (name, ))
+    self.db.execute('SELECT id FROM ' + self.folders + ' AS folders WHERE name = ? LIMIT 1', (name, ))
     res = self.db.fetchone()
     if res == None:
       return None
@@ -213,6 +930,8 @@ class Database:
       return res[0]
 
 
+  @locked
+  @measured
   def getFolders(self):
     """
     Selects all folders in the backup.
@@ -223,11 +942,30 @@ class Database:
       list of tuples: list of all folders in the backup in form (id, name)
     """
     
-    self.db.execute('SELECT id, name FROM folders')
+    self.db.execute('SELECT id, name FROM ' + self.folders + ' AS folders')
     res = self.db.fetchall()
     return res
 
 
+  @locked
+  @measured
+  def getFolderStats(self):
+    """
+    Counts the files and their size in all folders in the backup.
+
+    Args:
+
+    Returns:
+      list of tuples: list of all folders in the backup in form (name, number of files, size of files)
+    """
+
+    self.flush()
+    self.db.execute('SELECT folders.name, COUNT(files.id), COALESCE(SUM(hashes.size), 0) FROM ' + self.folders + ' AS folders LEFT JOIN files ON files.folderId = folders.id LEFT JOIN hashes ON hashes.id = files.hashId GROUP BY folders.id')
+    return self.db.fetchall()
+
+
+  @locked
+  @measured
   def removeFolder(self, folderId):
     """
     Removes backup folder from the database.
@@ -239,10 +977,12 @@ class Database:
       None
     """
 
-    self.db.execute('DELETE FROM folders WHERE id = ?', (folderId, ))
+    self.db.execute('DELETE FROM main.folders WHERE id = ?', (folderId, ))
     self.connection.commit()
 
 
+  @locked
+  @measured
   def getFile(self, path, folderId):
     """
     Selects file id based on the path of the file and folder id.
@@ -258,7 +998,11 @@ class Database:
     if folderId == None:
       return None, None
 
-    self.db.execute('SELECT id, hashId FROM files WHERE path = ? AND folderId = ? LIMIT 1', (path, folderId))
+    self.flush()
+    condition, params = self.__fileCondition(path, folderId)
+    if condition is None:
+      return None, None
+    self.db.execute('SELECT files.id, files.hashId FROM files WHERE ' + condition + ' LIMIT 1', params)
     res = self.db.fetchone()
     if res == None:
       return None, None
@@ -266,6 +1010,59 @@ class Database:
       return res
 
 
+  @locked
+  @measured
+  def getFileRow(self, path, folderId):
+    """
+    Selects the file together with its hash based on the path of the file and folder id.
+
+    Args:
+      path (str): path to the file
+      folderId (int): id of the folder
+
+    Returns:
+      tuple: (mtime, hash, size, symlink, sample) of the file or None if the file is not in the database
+    """
+
+    if folderId == None:
+      return None
+
+    self.flush()
+    condition, params = self.__fileCondition(path, folderId)
+    if condition is None:
+      return None
+    self.db.execute('SELECT files.mtime, ' + self.__hashColumn('hashes.hash') + ', hashes.size, hashes.symlink, ' + self.__sampleColumn() + ' FROM files, hashes WHERE ' + condition + ' AND files.hashId = hashes.id LIMIT 1', params)
+    return self.db.fetchone()
+
+
+  def iterFiles(self, folderId, chunkSize=10000):
+    """
+    Streams all files of the folder together with their hashes.
+
+    Args:
+      folderId (int): id of the folder
+      chunkSize (int): number of rows fetched at once
+
+    Returns:
+      generator: files in form (path, mtime, hash, size, symlink, sample)
+    """
+
+    with self.lock:
+      self.flush()
+      cursor = self.connection.cursor()
+      pathColumn, tables, join = self.__pathColumn()
+      cursor.execute('SELECT ' + pathColumn + ', files.mtime, ' + self.__hashColumn('hashes.hash') + ', hashes.size, hashes.symlink, ' + self.__sampleColumn() + ' FROM ' + tables + ', hashes WHERE files.folderId = ? AND files.hashId = hashes.id' + join, (folderId, ))
+    while True:
+      with self.lock:
+        rows = cursor.fetchmany(chunkSize)
+      if not rows:
+        break
+      yield from rows
+    cursor.close()
+
+
+  @locked
+  @measured
   def insertFile(self, path, mtime, folderId, hashId):
     """
     Inserts new file into the databse.
@@ -277,14 +1074,45 @@ class Database:
       hashId (int): id of the hash
 
     Returns:
-      int: id of the inserted file
+      int: id of the inserted file, None when the file waits for the next batch
     """
 
-    self.db.execute('INSERT INTO files(path, mtime, folderId, hashId)  VALUES (?, ?, ?, ?)', (path, mtime, folderId, hashId))
-    self.connection.commit()
-    return self.db.lastrowid
+    row = self.__fileRow(path, mtime, folderId, hashId)
+    if self.batchRows > 1:
+      self.pendingFiles.append(row)
+      self.__written()
+      return None
+
+    self.db.execute(self.__insertFile(), row)
+    fileId = row[0] if self.compact else self.db.lastrowid
+    self.__written()
+    return fileId
+
+
+  @locked
+  @measured
+  def removeFile(self, path, folderId):
+    """
+    Removes file from the database.
+
+    Args:
+      path (str): path to the file
+      folderId (int): id of the folder
+
+    Returns:
+      None
+    """
 
+    self.flush()
+    condition, params = self.__fileCondition(path, folderId)
+    if condition is None:
+      return
+    self.db.execute('DELETE FROM files WHERE ' + condition, params)
+    self.__written()
 
+
+  @locked
+  @measured
   def getHashId(self, hash, size, symlink):
     """
     Select hash id based on the hash and file size.
@@ -298,7 +1126,7 @@ class Database:
       int: id of the hash
     """
 
-    self.db.execute('SELECT id FROM hashes WHERE hash = ? AND size = ? AND symlink = ? LIMIT 1', (hash, size, symlink))
+    self.db.execute('SELECT id FROM hashes WHERE hash = ? AND size = ? AND symlink = ? LIMIT 1', (self.__hashValue(hash), size, symlink))
     res = self.db.fetchone()
     if res == None:
       return None
@@ -306,6 +1134,8 @@ class Database:
       return res[0]
 
 
+  @locked
+  @measured
   def getHashRow(self, hashId):
     """
     Select whoke hash row.
@@ -319,7 +1149,7 @@ class Database:
       symlink (bool): hash of symlink
     """
 
-    self.db.execute('SELECT hash, size, symlink FROM hashes WHERE id = ? LIMIT 1', (hashId, ))
+    self.db.execute('SELECT ' + self.__hashColumn('hashes.hash') + ', hashes.size, hashes.symlink FROM hashes WHERE hashes.id = ? LIMIT 1', (hashId, ))
     res = self.db.fetchone()
     if res == None:
       return None, None, None
@@ -327,7 +1157,9 @@ class Database:
       return res
 
 
-  def insertHash(self, hash, size, symlink):
+  @locked
+  @measured
+  def insertHash(self, hash, size, symlink, sample=None):
     """
     Inserts new hash into the databse.
 
@@ -335,33 +1167,181 @@ class Database:
       hash (str): hash of the file
       size (int): size of the file
       symlink (bool): hash of symlink
+      sample (str): hash of the sample of the file or None
 
     Returns:
       int: id of the inserted hash
     """
 
-    self.db.execute('SELECT id FROM hashes WHERE hash = ? AND size = ? AND symlink = ? LIMIT 1', (hash, size, symlink))
+    hash = self.__hashValue(hash)
+    self.db.execute('SELECT id, ' + self.__sampleColumn() + ' FROM hashes WHERE hash = ? AND size = ? AND symlink = ? LIMIT 1', (hash, size, symlink))
     res = self.db.fetchone()
     if res == None:
-      self.db.execute('INSERT INTO hashes(hash, size, symlink)  VALUES (?, ?, ?)', (hash, size, symlink))
-      self.connection.commit()
-      return self.db.lastrowid
+      if self.version < 3:
+        self.db.execute('INSERT INTO hashes(hash, size, symlink)  VALUES (?, ?, ?)', (hash, size, symlink))
+      else:
+        self.db.execute('INSERT INTO hashes(hash, size, symlink, sample)  VALUES (?, ?, ?, ?)', (hash, size, symlink, self.__hashValue(sample)))
+      hashId = self.db.lastrowid
+      self.__written()
+      return hashId
     else:
+      if sample is not None and res[1] is None and self.version >= 3:
+        self.db.execute('UPDATE hashes SET sample = ? WHERE id = ?', (self.__hashValue(sample), res[0]))
+        self.__written()
       return res[0]
 
 
-  def getFilesByHash(self, hashId):
+  @locked
+  @measured
+  def countHashes(self, backupIds=None):
+    """
+    Counts the hashes in the database.
+
+    Args:
+      backupIds (list of int): ids of the backups of the catalog of all backups whose hashes are counted, None for the backup the database is restricted to
+
+    Returns:
+      int: number of hashes
+    """
+
+    condition, params = self.__hashesOfBackup(backupIds)
+    self.db.execute('SELECT COUNT(*) FROM hashes' + condition, params)
+    return self.db.fetchone()[0]
+
+
+  def __hashesOfBackup(self, backupIds=None):
+    """
+    Returns condition selecting the hashes of the files of the given backups of the catalog of all backups, or of the backup the catalog is restricted to.
+
+    Args:
+      backupIds (list of int): ids of the backups, None for the backup the database is restricted to
+
+    Returns:
+      str: WHERE clause or empty string if the database is not restricted
+      tuple: parameters of the clause
+    """
+
+    if backupIds is not None:
+      return ' WHERE hashes.id IN (SELECT files.hashId FROM files, main.folders AS folders WHERE files.folderId = folders.id AND folders.backupId IN (' + ', '.join('?'*len(backupIds)) + '))', tuple(backupIds)
+    if self.backupId is None:
+      return '', ()
+    return ' WHERE hashes.id IN (SELECT files.hashId FROM files, ' + self.folders + ' AS folders WHERE files.folderId = folders.id)', ()
+
+
+  def iterHashes(self, chunkSize=10000):
+    """
+    Streams all hashes in the database.
+
+    Args:
+      chunkSize (int): number of rows fetched at once
+
+    Returns:
+      generator: hashes in form (id, hash, size, symlink, sample)
+    """
+
+    with self.lock:
+      cursor = self.connection.cursor()
+      condition, params = self.__hashesOfBackup()
+      cursor.execute('SELECT hashes.id, ' + self.__hashColumn('hashes.hash') + ', hashes.size, hashes.symlink, ' + self.__sampleColumn() + ' FROM hashes' + condition, params)
+    while True:
+      with self.lock:
+        rows = cursor.fetchmany(chunkSize)
+      if not rows:
+        break
+      yield from rows
+    cursor.close()
+
+
+  def iterBackupHashes(self, backupIds, chunkSize=10000):
+    """
+    Streams the hashes of the files of the given backups of the catalog of all backups by one query.
+
+    Args:
+      backupIds (list of int): ids of the backups
+      chunkSize (int): number of rows fetched at once
+
+    Returns:
+      generator: hashes in form (backup id, id, hash, size, symlink, sample), each hash once for each backup containing it
+    """
+
+    with self.lock:
+      cursor = self.connection.cursor()
+      cursor.execute('SELECT backupHashes.backupId, hashes.id, ' + self.__hashColumn('hashes.hash') + ', hashes.size, hashes.symlink, ' + self.__sampleColumn() + ' FROM (SELECT DISTINCT folders.backupId, files.hashId FROM files, main.folders AS folders WHERE files.folderId = folders.id AND folders.backupId IN (' + ', '.join('?'*len(backupIds)) + ')) AS backupHashes, hashes WHERE hashes.id = backupHashes.hashId', tuple(backupIds))
+    while True:
+      with self.lock:
+        rows = cursor.fetchmany(chunkSize)
+      if not rows:
+        break
+      yield from rows
+    cursor.close()
+
+
+  @locked
+  @measured
+  def getHashBackups(self, hashId, backupIds):
+    """
+    Selects the backups of the catalog of all backups containing some file with the hash.
+
+    Args:
+      hashId (int): id of the hash
+      backupIds (list of int): ids of the searched backups
+
+    Returns:
+      set of int: ids of the backups containing the hash
+    """
+
+    self.db.execute('SELECT DISTINCT folders.backupId FROM files, main.folders AS folders WHERE files.hashId = ? AND files.folderId = folders.id AND folders.backupId IN (' + ', '.join('?'*len(backupIds)) + ')', (hashId, ) + tuple(backupIds))
+    return set(row[0] for row in self.db.fetchall())
+
+
+  @locked
+  @measured
+  def getSamplesBySize(self, size):
+    """
+    Selects hashes of the samples of the files with the given size.
+
+    Args:
+      size (int): size of the file
+
+    Returns:
+      set: hashes of the samples, None stands for the files without the sample hash, empty when no file has the size
+    """
+
+    if self.version < 3:
+      return {None}
+
+    self.db.execute('SELECT DISTINCT ' + self.__sampleColumn() + ' FROM hashes WHERE hashes.size = ? AND hashes.symlink = 0', (size, ))
+    return set(row[0] for row in self.db.fetchall())
+
+
+  @locked
+  @measured
+  def getFilesByHash(self, hashId, mtime=None, limit=None, offset=0):
     """
-    Obtains list of files with the same hash.
+    Obtains list of files with the same hash, the newest first.
 
     Args:
       hashId (int): id of the hash
+      mtime (int): only files with this mtime, None for any mtime
+      limit (int): maximal number of the files, None for all files
+      offset (int): number of the skipped files
 
     Returns:
       list: list of files with the same hash
     """
 
-    self.db.execute('SELECT folders.name, files.id, files.path, files.mtime FROM files, folders WHERE files.hashId = ? AND files.folderId = folders.id ORDER BY files.id DESC', (hashId, ))
+    self.flush()
+    pathColumn, tables, join = self.__pathColumn()
+    query = 'SELECT folders.name, files.id, ' + pathColumn + ', files.mtime FROM ' + tables + ', ' + self.folders + ' AS folders WHERE files.hashId = ? AND files.folderId = folders.id' + join
+    params = [hashId]
+    if mtime is not None:
+      query += ' AND files.mtime = ?'
+      params.append(mtime)
+    query += ' ORDER BY files.id DESC'
+    if limit is not None:
+      query += ' LIMIT ? OFFSET ?'
+      params.extend([limit, offset])
+    self.db.execute(query, params)
     res = self.db.fetchall()
     return res
 
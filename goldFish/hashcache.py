@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+
+import array
+import hashlib
+
+class HashCache:
+  """
+  Cache of the hashes stored in the databases of the previous backups. Maps the hash, size and symlink of the file to the backups containing it. When the map does not fit into the given memory, only a Bloom filter answering that the hash is in none of the backups is kept and the databases are queried otherwise. Databases with hashes computed by other algorithm are skipped. The databases restricted from the catalog of all backups are queried together by one query of the catalog. The sizes of the files are kept together with the hashes of the samples of the files not smaller than the given size.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # approximate memory taken by one hash beside the backups, in bytes
+  ENTRY_OVERHEAD = 250
+
+  # approximate memory taken by one backup of the hash, in bytes
+  BACKUP_OVERHEAD = 16
+
+  # approximate memory taken by one sample hash, in bytes
+  SAMPLE_OVERHEAD = 200
+
+  # bits of the Bloom filter per one hash
+  BLOOM_BITS = 10
+
+  # number of bits set for one hash
+  BLOOM_HASHES = 7
+
+
+  def __init__(self, dbs, memoryLimit, algorithm='sha256', sampleSize=0, catalog=None):
+    """
+    Loads hashes from the databases.
+
+    Args:
+      dbs (list of Database): databases of the previous backups
+      memoryLimit (int): maximal memory taken by the map in bytes, 0 keeps only the Bloom filter
+      algorithm (str): name of the hash algorithm of the looked up hashes
+      sampleSize (int): minimal size of the files whose samples are kept, 0 keeps neither the sizes nor the samples
+      catalog (Database): catalog of all backups the databases are restricted from, None if they are separate databases
+
+    Returns:
+      None
+    """
+
+    self.sampleSize = sampleSize
+    self.catalog = catalog
+
+    self.dbs = [db if db.getHashAlgorithm() == algorithm else None for db in dbs]
+    # id of the backup in the catalog -> index of its database, None for separate databases
+    self.backupIds = None
+    if catalog is not None:
+      self.backupIds = {db.backupId: backupId for backupId, db in enumerate(self.dbs) if db is not None}
+      count = catalog.countHashes(list(self.backupIds)) if len(self.backupIds) > 0 else 0
+    else:
+      count = sum(db.countHashes() for db in self.dbs if db is not None)
+    self.bloomSize = max(count*HashCache.BLOOM_BITS, 64)
+    self.bloom = bytearray((self.bloomSize + 7) // 8)
+
+    self.map = {} if memoryLimit > 0 else None
+    self.samples = {} if memoryLimit > 0 else None
+    self.memory = 0
+    self.memoryLimit = memoryLimit
+    if self.backupIds is not None:
+      if len(self.backupIds) > 0:
+        for backupId, hashId, hash, size, symlink, sample in catalog.iterBackupHashes(list(self.backupIds)):
+          self.__add(self.backupIds[backupId], hashId, hash, size, symlink, sample)
+    else:
+      for backupId, db in enumerate(self.dbs):
+        if db is None:
+          continue
+        for hashId, hash, size, symlink, sample in db.iterHashes():
+          self.__add(backupId, hashId, hash, size, symlink, sample)
+
+
+  def __add(self, backupId, hashId, hash, size, symlink, sample):
+    """
+    Adds the hash of the backup into the Bloom filter and into the map while it fits into the memory.
+
+    Args:
+      backupId (int): index of the database
+      hashId (int): id of the hash in the database
+      hash (str): hash of the file
+      size (int): size of the file
+      symlink (bool): hash of symlink
+      sample (str): hash of the sample of the file or None
+
+    Returns:
+      None
+    """
+
+    self.__addBloom(hash, size, symlink)
+    if self.map is None:
+      return
+    if self.sampleSize > 0 and not symlink:
+      samples = self.samples.setdefault(size, set())
+      if size < self.sampleSize:
+        sample = None
+      if sample not in samples:
+        samples.add(sample)
+        self.memory += HashCache.SAMPLE_OVERHEAD
+    key = HashCache.key(hash, size, symlink)
+    backups = self.map.get(key)
+    if backups is None:
+      backups = array.array('q')
+      self.map[key] = backups
+      self.memory += HashCache.ENTRY_OVERHEAD
+    backups.append(backupId)
+    backups.append(hashId)
+    self.memory += HashCache.BACKUP_OVERHEAD
+    if self.memory > self.memoryLimit:
+      self.map = None
+      self.samples = None
+
+
+  def key(hash, size, symlink):
+    """
+    Creates compact key of the hash.
+
+    Args:
+      hash (str): hash of the file
+      size (int): size of the file
+      symlink (bool): hash of symlink
+
+    Returns:
+      tuple: key of the hash
+    """
+
+    try:
+      hash = bytes.fromhex(hash)
+    except (TypeError, ValueError):
+      pass
+    return hash, size, bool(symlink)
+
+
+  def __bloomBits(self, hash, size, symlink):
+    """
+    Computes positions of the bits of the hash in the Bloom filter.
+
+    Args:
+      hash (str): hash of the file
+      size (int): size of the file
+      symlink (bool): hash of symlink
+
+    Returns:
+      generator: positions of the bits
+    """
+
+    digest = hashlib.blake2b('{}:{}:{}'.format(hash, size, int(symlink)).encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little')
+    for i in range(HashCache.BLOOM_HASHES):
+      yield (h1 + i*h2) % self.bloomSize
+
+
+  def __addBloom(self, hash, size, symlink):
+    """
+    Adds the hash into the Bloom filter.
+
+    Args:
+      hash (str): hash of the file
+      size (int): size of the file
+      symlink (bool): hash of symlink
+
+    Returns:
+      None
+    """
+
+    for bit in self.__bloomBits(hash, size, symlink):
+      self.bloom[bit >> 3] |= 1 << (bit & 7)
+
+
+  def mayContain(self, hash, size, symlink):
+    """
+    Checks the Bloom filter whether the hash may be stored in some of the databases.
+
+    Args:
+      hash (str): hash of the file
+      size (int): size of the file
+      symlink (bool): hash of symlink
+
+    Returns:
+      bool: False if the hash is surely in none of the databases
+    """
+
+    for bit in self.__bloomBits(hash, size, symlink):
+      if not self.bloom[bit >> 3] & (1 << (bit & 7)):
+        return False
+    return True
+
+
+  def loaded(self):
+    """
+    Whether the map of the hashes is in memory.
+
+    Args:
+
+    Returns:
+      bool: True if the map is in memory
+    """
+
+    return self.map is not None
+
+
+  def getSamples(self, size):
+    """
+    Finds hashes of the samples of the files with the given size in the previous backups.
+
+    Args:
+      size (int): size of the file
+
+    Returns:
+      set: hashes of the samples, None stands for the files without the sample hash, empty when no file has the size
+    """
+
+    if self.samples is not None:
+      return self.samples.get(size, set())
+
+    if self.backupIds is not None:
+      # the hashes are shared by all backups of the catalog
+      return self.catalog.getSamplesBySize(size) if len(self.backupIds) > 0 else set()
+
+    samples = set()
+    for db in self.dbs:
+      if db is not None:
+        samples |= db.getSamplesBySize(size)
+    return samples
+
+
+  def lookup(self, hash, size, symlink):
+    """
+    Finds the previous backups containing the hash.
+
+    Args:
+      hash (str): hash of the file
+      size (int): size of the file
+      symlink (bool): hash of symlink
+
+    Returns:
+      list of tuples: backups in form (index of the database, id of the hash in the database), in the order of the databases
+    """
+
+    if self.map is not None:
+      backups = self.map.get(HashCache.key(hash, size, symlink))
+      if backups is None:
+        return []
+      if self.backupIds is not None:
+        # the catalog returns the backups in any order
+        return sorted(zip(backups[0::2], backups[1::2]))
+      return list(zip(backups[0::2], backups[1::2]))
+
+    if not self.mayContain(hash, size, symlink):
+      return []
+    if self.backupIds is not None:
+      hashId = self.catalog.getHashId(hash, size, symlink)
+      if hashId is None:
+        return []
+      return sorted((self.backupIds[backupId], hashId) for backupId in self.catalog.getHashBackups(hashId, list(self.backupIds)))
+    hashIds = []
+    for backupId, db in enumerate(self.dbs):
+      if db is None:
+        continue
+      hashId = db.getHashId(hash, size, symlink)
+      if hashId is not None:
+        hashIds.append((backupId, hashId))
+    return hashIds
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+
+import os
+import time
+import collections
+import concurrent.futures
+from .io import hashFile, sampleFile
+
+class Hasher:
+  """
+  Class computing hashes of the files, either inline or in a pool of worker threads.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self, workers, followSymlinks, algorithm='sha256', sampleSize=0, metrics=None):
+    """
+    Initialization of the object.
+
+    Args:
+      workers (int): number of worker threads, 1 computes the hashes inline
+      followSymlinks (bool): follow symlinks
+      algorithm (str): name of the hash algorithm
+      sampleSize (int): minimal size of the files whose samples are hashed, 0 hashes no samples
+      metrics (Metrics): metrics measuring the time of hashing or None
+
+    Returns:
+      None
+    """
+
+    self.workers = workers
+    self.followSymlinks = followSymlinks
+    self.algorithm = algorithm
+    self.sampleSize = sampleSize
+    self.metrics = metrics
+    if self.workers > 1:
+      self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+    else:
+      self.pool = None
+
+
+  def submit(self, path, size, samples=None):
+    """
+    Schedules hashing of the file.
+
+    Args:
+      path (str): path to the file
+      size (int): size of the file
+      samples (set): hashes of the samples of the files the file may be equal to, None when not known
+
+    Returns:
+      object: job with method result() returning the same values as hash()
+    """
+
+    if self.pool is None:
+      return HashJob(self, path, size, samples)
+    else:
+      return self.pool.submit(self.hash, path, size, samples)
+
+
+  def hash(self, path, size, samples=None):
+    """
+    Computes the hash of the file and of its sample. When there are no samples, no file has the same size and the file is surely new without reading it. When the sample of the file is not among the given samples, the file is surely new and its full hash is not computed.
+
+    Args:
+      path (str): path to the file
+      size (int): size of the file
+      samples (set): hashes of the samples of the files the file may be equal to, None when not known
+
+    Returns:
+      str: hash of the file or None if it was not computed
+      bool: symlink of the file
+      str: hash of the sample or None if the file is smaller than the sample size
+    """
+
+    start = time.monotonic()
+    if samples is not None and len(samples) == 0:
+      if self.metrics is not None:
+        self.metrics.add('hashesSkipped')
+      return None, False, None
+
+    sample = None
+    if self.sampleSize > 0 and size >= self.sampleSize and (self.followSymlinks or not os.path.islink(path)):
+      sample = sampleFile(path, size, self.algorithm)
+      if samples is not None and sample not in samples and None not in samples:
+        if self.metrics is not None:
+          self.metrics.time('sample', time.monotonic() - start)
+          self.metrics.add('hashesSkipped')
+        return None, False, sample
+
+    fileHash, symlink = hashFile(path, self.followSymlinks, self.algorithm)
+    if self.metrics is not None:
+      self.metrics.time('hash', time.monotonic() - start)
+      self.metrics.add('bytesHashed', size)
+    return fileHash, symlink, sample
+
+
+  def window(self, items):
+    """
+    Iterates over the items, while keeping a few next items already generated so that their hashes are computed by the workers in advance.
+
+    Args:
+      items (iterable): items scheduling the hashing when generated
+
+    Returns:
+      generator: the same items in the same order
+    """
+
+    if self.pool is None:
+      yield from items
+    else:
+      size = 4*self.workers
+      queue = collections.deque()
+      for item in items:
+        queue.append(item)
+        if len(queue) > size:
+          yield queue.popleft()
+      while queue:
+        yield queue.popleft()
+
+
+  def close(self):
+    """
+    Stops the worker threads.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    if self.pool is not None:
+      self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class HashJob:
+  """
+  Hashing job computed inline when its result is requested.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self, hasher, path, size, samples):
+    """
+    Initialization of the object.
+
+    Args:
+      hasher (Hasher): hasher computing the hash
+      path (str): path to the file
+      size (int): size of the file
+      samples (set): hashes of the samples of the files the file may be equal to, None when not known
+
+    Returns:
+      None
+    """
+
+    self.hasher = hasher
+    self.path = path
+    self.size = size
+    self.samples = samples
+
+
+  def result(self):
+    """
+    Computes the hash of the file.
+
+    Args:
+
+    Returns:
+      tuple: the same values as Hasher.hash()
+    """
+
+    return self.hasher.hash(self.path, self.size, self.samples)
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+import os
+import sqlite3
+import pathlib
+from .io import *
+from .config import Config
+from .database import Database, DatabaseError
+from .backups import CATALOG_FILE, updateSummary
+
+class Importer:
+
+  def main(configFile):
+    """
+    Imports databases of all backups into the catalog of all backups. Outdated databases are upgraded first, and the databases which can not be imported are reported and skipped.
+
+    Args:
+      configFile (str): path to the configuration file
+
+    Returns:
+      None
+    """
+
+    config = Config(configFile)
+
+    printHeadline()
+
+    if not config.dbEnable or not config.dbSingle:
+      print('Catalog of all backups is not enabled.')
+      return
+
+    catalog = Database(os.path.join(config.dbPath, CATALOG_FILE), single=True, compact=config.dbCompact)
+    imported = [name for backupId, name in catalog.getBackups()]
+    dbFiles = [dbFile for dbFile in pathlib.Path(config.dbPath).glob('*.sqlite') if dbFile.name != CATALOG_FILE]
+    dbFiles.sort()
+    count = 0
+    failed = 0
+    for dbFile in dbFiles:
+      print('  ' + dbFile.name + ' ...', end='', flush=True)
+      if dbFile.stem in imported:
+        print(' already imported')
+        continue
+      try:
+        # upgrade the database like the backup does before reading it
+        db = Database(dbFile, init=False)
+        if db.versionOpened != db.version:
+          print(' upgraded from version {} to {},'.format(db.versionOpened, db.version), end='', flush=True)
+        db.close()
+        files = catalog.importBackup(dbFile, dbFile.stem)
+      except (DatabaseError, sqlite3.Error) as e:
+        print(' failed: ' + str(e))
+        failed += 1
+        continue
+      print(' {} files imported'.format(files))
+      count += 1
+    catalog.close()
+
+    for dbFile in dbFiles:
+      updateSummary(config, dbFile.stem)
+
+    print('Imported {} of {} databases. The databases of the backups are kept and no longer used.'.format(count, len(dbFiles)))
+    if failed > 0:
+      print('{} databases could not be imported, run the import again once they are fixed.'.format(failed))
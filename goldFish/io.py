@@ -1,10 +1,8 @@
 #!/usr/bin/python3
 
 import os
-import re
 import sys
 import math
-import shutil
 import hashlib
 import pathlib
 import terminaltables
@@ -29,22 +27,22 @@ def readableSize(bytes):
     return '   0.00 B'
 
 
-def printToTerminalSize(text):
+def shortenText(text, width):
   """
-    Writes the given text to the standard terminal output. When the text is longer than the terminal size, the text is shorten to its size.
+  Shortens the text to the given width by replacing its middle part with dots.
 
   Args:
-    text (str): text to print
+    text (str): text to shorten
+    width (int): maximal length of the text
 
   Returns:
-    None
+    str: shortened text
   """
 
-  width = shutil.get_terminal_size().columns
+  if len(text) <= width:
+    return text
   half = int((width - 3)/2)
-  if len(text) > width:
-    text = re.sub(r'^(.{' + str(half) + '}).*(.{' + str(half) + '})$', '\g<1>...\g<2>', text)
-  sys.stdout.write('{:{}.{}}'.format(text, 2*half + 3, 2*half + 3))
+  return text[:half] + '...' + text[len(text) - half:]
 
 
 def printHeadline():
@@ -98,20 +96,54 @@ def queryYesNo(question, default=None):
       return valid[choice]
 
 
-def hashFile(path, followSymlinks):
+# supported hash algorithms
+HASH_ALGORITHMS = ['sha256', 'blake2b', 'blake3', 'xxh3']
+
+
+def newHash(algorithm):
+  """
+  Creates new hash object of the given algorithm.
+
+  Args:
+    algorithm (str): name of the hash algorithm
+
+  Returns:
+    object: hash object with methods update() and hexdigest()
+
+  Throws:
+    ValueError: when the algorithm is not known
+    ImportError: when the module providing the algorithm is not installed
+  """
+
+  if algorithm == 'sha256':
+    return hashlib.sha256()
+  elif algorithm == 'blake2b':
+    return hashlib.blake2b(digest_size=32)
+  elif algorithm == 'blake3':
+    import blake3
+    return blake3.blake3()
+  elif algorithm == 'xxh3':
+    import xxhash
+    return xxhash.xxh3_128()
+  else:
+    raise ValueError('Unknown hash algorithm: {}'.format(algorithm))
+
+
+def hashFile(path, followSymlinks, algorithm='sha256'):
   """
-  Compute the SHA256 hash of the file.
+  Compute the hash of the file.
 
   Args:
     path (str): path to the file
     followSymlinks (bool): follow symlinks
+    algorithm (str): name of the hash algorithm
 
   Returns:
     str: hash of the file
     bool: symlink of the file
   """
 
-  fileHash = hashlib.sha256()
+  fileHash = newHash(algorithm)
 
   if not followSymlinks and pathlib.Path(path).is_symlink():
     symlink = True
@@ -129,6 +161,87 @@ def hashFile(path, followSymlinks):
   return fileHash.hexdigest(), symlink
 
 
+def scanTree(top):
+  """
+  Walks through the directory tree top-down like os.walk, but yields the entries returned by os.scandir so that their cached stat results can be reused. Symlinks to directories are listed among the directories, but not followed.
+
+  Args:
+    top (str): root of the tree
+
+  Returns:
+    generator: tuples (relPath, dirs, files), relPath is the path of the directory relative to the root ('' for the root), dirs and files are lists of os.DirEntry
+  """
+
+  stack = ['']
+  while stack:
+    relPath = stack.pop()
+    dirs = []
+    files = []
+    try:
+      with os.scandir(os.path.join(top, relPath)) as it:
+        for entry in it:
+          try:
+            isDir = entry.is_dir()
+          except OSError:
+            isDir = False
+          if isDir:
+            dirs.append(entry)
+          else:
+            files.append(entry)
+    except OSError:
+      continue
+
+    yield relPath, dirs, files
+
+    for entry in reversed(dirs):
+      if not entry.is_symlink():
+        stack.append(os.path.join(relPath, entry.name))
+
+
+def scanDir(path):
+  """
+  Lists the directory once and returns its entries by names.
+
+  Args:
+    path (str): path to the directory
+
+  Returns:
+    dict: os.DirEntry by the name of the entry, empty if the directory does not exist
+  """
+
+  try:
+    with os.scandir(path) as it:
+      return {entry.name: entry for entry in it}
+  except OSError:
+    return {}
+
+
+# size of the head and of the tail of the file hashed as its sample
+SAMPLE_SIZE = 65536
+
+
+def sampleFile(path, size, algorithm='sha256'):
+  """
+  Compute the hash of the sample of the file, consisting of its head, its tail and its size.
+
+  Args:
+    path (str): path to the file
+    size (int): size of the file
+    algorithm (str): name of the hash algorithm
+
+  Returns:
+    str: hash of the sample
+  """
+
+  sampleHash = newHash(algorithm)
+  with open(path, 'rb') as f:
+    sampleHash.update(os.pread(f.fileno(), SAMPLE_SIZE, 0))
+    sampleHash.update(os.pread(f.fileno(), SAMPLE_SIZE, max(size - SAMPLE_SIZE, 0)))
+  sampleHash.update(str(size).encode())
+
+  return sampleHash.hexdigest()
+
+
 def printBackups(backupsDict):
   """
   Prints table of the backups on the media and in the database.
@@ -141,7 +254,7 @@ def printBackups(backupsDict):
   """
 
   # create table
-  tableData = [['Datetime', 'Folder', 'HDD', 'DB']]
+  tableData = [['Datetime', 'Folder', 'HDD', 'DB', 'Files', 'Size']]
   backups = list(backupsDict.keys())
   backups.sort(reverse=True)
   for backup in backups:
@@ -150,18 +263,24 @@ def printBackups(backupsDict):
     if len(items) > 0:
       for item, i in zip(items, range(len(items))):
         if i == 0:
-          tableData.append([backup, item, '', ''])
+          tableData.append([backup, item, '', '', '', ''])
         else:
-          tableData.append(['', item, '', ''])
+          tableData.append(['', item, '', '', '', ''])
         if backupsDict[backup][item]['HDD']:
           tableData[-1][2] = 'X'
         if backupsDict[backup][item]['DB']:
           tableData[-1][3] = 'X'
+        if backupsDict[backup][item].get('files') is not None:
+          tableData[-1][4] = str(backupsDict[backup][item]['files'])
+        if backupsDict[backup][item].get('size') is not None:
+          tableData[-1][5] = readableSize(backupsDict[backup][item]['size']).strip()
     else:
-      tableData.append([backup, '', '', ''])
+      tableData.append([backup, '', '', '', '', ''])
       
 
   table = terminaltables.SingleTable(tableData)
   table.justify_columns[2] = 'center'
   table.justify_columns[3] = 'center'
+  table.justify_columns[4] = 'right'
+  table.justify_columns[5] = 'right'
   print(table.table)
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+import os
+import sqlite3
+import pathlib
+import concurrent.futures
+from .io import *
+from .config import Config
+from .database import Database, DatabaseError
+
+class Maintain:
+
+  def main(configFile, workers=4, vacuumThreshold=10):
+    """
+    Maintains databases of all backups. The hashes not referenced by any file are removed, the statistics for the query planner are gathered, the write-ahead logs are truncated and the databases with many free pages are vacuumed.
+
+    Args:
+      configFile (str): path to the configuration file
+      workers (int): number of databases maintained at once
+      vacuumThreshold (int): percentage of the free pages of the database from which it is vacuumed
+
+    Returns:
+      None
+    """
+
+    config = Config(configFile)
+
+    printHeadline()
+
+    if not config.dbEnable:
+      print('Database is not enabled.')
+      return
+
+    dbFiles = list(pathlib.Path(config.dbPath).glob('*.sqlite'))
+    dbFiles.sort()
+    reclaimed = 0
+    maintained = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+      for dbFile, result in zip(dbFiles, pool.map(lambda dbFile: Maintain.database(dbFile, vacuumThreshold), dbFiles)):
+        if isinstance(result, str):
+          print('  ' + dbFile.name + ' failed: ' + result)
+          continue
+        hashes, vacuumed, sizeBefore, sizeAfter = result
+        print('  {} {} hashes removed{}, {} -> {}, reclaimed {}'.format(dbFile.name, hashes, ', vacuumed' if vacuumed else '', readableSize(sizeBefore).strip(), readableSize(sizeAfter).strip(), readableSize(max(sizeBefore - sizeAfter, 0)).strip()))
+        reclaimed += max(sizeBefore - sizeAfter, 0)
+        maintained += 1
+
+    print('Maintained {} of {} databases, reclaimed {}.'.format(maintained, len(dbFiles), readableSize(reclaimed).strip()))
+
+
+  def database(dbFile, vacuumThreshold):
+    """
+    Maintains one database.
+
+    Args:
+      dbFile (pathlib.Path): path to the database
+      vacuumThreshold (int): percentage of the free pages of the database from which it is vacuumed
+
+    Returns:
+      tuple: (removed hashes, whether vacuumed, size before, size after) with the sizes of the database with its write-ahead log in bytes, or str: error when the database can not be maintained
+    """
+
+    sizeBefore = Maintain.size(dbFile)
+    try:
+      db = Database(dbFile)
+      hashes = db.removeOrphans()
+      freePages, pages = db.getFreePages()
+      vacuumed = pages > 0 and freePages*100 >= vacuumThreshold*pages
+      if vacuumed:
+        db.vacuum()
+      db.optimize()
+      db.checkpoint()
+      db.close()
+    except (DatabaseError, sqlite3.Error) as e:
+      return str(e)
+    return hashes, vacuumed, sizeBefore, Maintain.size(dbFile)
+
+
+  def size(dbFile):
+    """
+    Returns size of the database file together with its write-ahead log.
+
+    Args:
+      dbFile (pathlib.Path): path to the database
+
+    Returns:
+      int: size in bytes
+    """
+
+    size = 0
+    for path in [str(dbFile), str(dbFile) + '-wal']:
+      try:
+        size += os.stat(path).st_size
+      except FileNotFoundError:
+        pass
+    return size
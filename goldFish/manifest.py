@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import zlib
+import struct
+
+# header of the manifest file
+MAGIC = b'GFMANIF1'
+
+# record of one file: size, st_mtime_ns, st_ino, st_ctime_ns, length of the path
+RECORD = struct.Struct('<qqQqI')
+
+# trailer of the manifest file: number of the records and CRC32 of the records
+TRAILER = struct.Struct('<QI')
+
+
+class Manifest:
+  """
+  Manifest of the state of the source files at the time of the previous backup of the folder. A source file with the same size, mtime, inode and ctime as in the manifest has not changed since the previous backup, so its copy in the previous backup is linked without being statted. Manifest which is missing, corrupt, written for other source folder or too large for the memory is not used.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # approximate memory taken by one entry beside the path, in bytes
+  ENTRY_OVERHEAD = 200
+
+
+  def __init__(self, path, backup, folder, source, memoryLimit):
+    """
+    Loads the manifest.
+
+    Args:
+      path (str): path to the manifest file
+      backup (str): name of the backup the manifest belongs to
+      folder (str): name of the folder the manifest belongs to
+      source (str): source folder of the backup
+      memoryLimit (int): maximal memory taken by the manifest in bytes
+
+    Returns:
+      None
+    """
+
+    self.entries = None
+    self.error = None
+
+    if not os.path.isfile(path):
+      return
+    try:
+      self.entries = Manifest.read(path, {'backup': backup, 'folder': folder, 'source': source}, memoryLimit)
+    except (OSError, ValueError, zlib.error, struct.error) as e:
+      self.error = str(e)
+
+
+  def read(path, header, memoryLimit):
+    """
+    Reads and verifies the manifest file.
+
+    Args:
+      path (str): path to the manifest file
+      header (dict): expected header of the manifest
+      memoryLimit (int): maximal memory taken by the manifest in bytes
+
+    Returns:
+      dict: state of the files in form {relPath: (size, st_mtime_ns, st_ino, st_ctime_ns)}
+
+    Throws:
+      ValueError: when the manifest is corrupt, stale or too large
+    """
+
+    with open(path, 'rb') as f:
+      data = f.read()
+    if not data.startswith(MAGIC):
+      raise ValueError('Unknown format of the manifest.')
+    headerLength = struct.unpack_from('<I', data, len(MAGIC))[0]
+    offset = len(MAGIC) + 4
+    if json.loads(data[offset:offset + headerLength].decode()) != header:
+      raise ValueError('Manifest belongs to other backup or source folder.')
+    offset += headerLength
+    if len(data) < offset + TRAILER.size:
+      raise ValueError('Manifest is truncated.')
+    count, crc = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+    records = zlib.decompress(data[offset:len(data) - TRAILER.size])
+    if zlib.crc32(records) != crc:
+      raise ValueError('Checksum of the manifest does not match.')
+
+    entries = {}
+    memory = 0
+    position = 0
+    while position < len(records):
+      size, mtime, ino, ctime, length = RECORD.unpack_from(records, position)
+      position += RECORD.size
+      relPath = os.fsdecode(records[position:position + length])
+      position += length
+      memory += sys.getsizeof(relPath) + Manifest.ENTRY_OVERHEAD
+      if memory > memoryLimit:
+        raise ValueError('Manifest does not fit into memory.')
+      entries[relPath] = (size, mtime, ino, ctime)
+    if len(entries) != count:
+      raise ValueError('Number of the files in the manifest does not match.')
+    return entries
+
+
+  def loaded(self):
+    """
+    Checks whether the manifest is loaded.
+
+    Args:
+
+    Returns:
+      bool: True if the manifest is loaded
+    """
+
+    return self.entries is not None
+
+
+  def unchanged(self, relPath, stat):
+    """
+    Checks whether the source file is in the same state as at the time of the previous backup.
+
+    Args:
+      relPath (str): path to the file relative to the folder
+      stat (os.stat_result): current stat of the source file
+
+    Returns:
+      bool: True if the file has not changed
+    """
+
+    if self.entries is None:
+      return False
+    return self.entries.get(relPath) == (stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_ctime_ns)
+
+
+class ManifestWriter:
+  """
+  Writer of the manifest of the state of the source files in the new backup of the folder. The manifest is written into a temporary file and moved in place only when the folder is finished.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self, path, backup, folder, source):
+    """
+    Creates the temporary manifest file.
+
+    Args:
+      path (str): path to the manifest file
+      backup (str): name of the backup the manifest belongs to
+      folder (str): name of the folder the manifest belongs to
+      source (str): source folder of the backup
+
+    Returns:
+      None
+    """
+
+    self.path = path
+    self.count = 0
+    self.crc = 0
+    self.compressor = zlib.compressobj()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.file = open(path + '.tmp', 'wb')
+    header = json.dumps({'backup': backup, 'folder': folder, 'source': source}).encode()
+    self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+
+  def add(self, relPath, stat):
+    """
+    Adds the state of the source file.
+
+    Args:
+      relPath (str): path to the file relative to the folder
+      stat (os.stat_result): stat of the source file
+
+    Returns:
+      None
+    """
+
+    path = os.fsencode(relPath)
+    record = RECORD.pack(stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_ctime_ns, len(path)) + path
+    self.crc = zlib.crc32(record, self.crc)
+    self.count += 1
+    self.file.write(self.compressor.compress(record))
+
+
+  def close(self):
+    """
+    Finishes the manifest and moves it in place.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.file.write(self.compressor.flush())
+    self.file.write(TRAILER.pack(self.count, self.crc))
+    self.file.close()
+    os.replace(self.path + '.tmp', self.path)
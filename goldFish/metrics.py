@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+
+import os
+import json
+import time
+import threading
+import functools
+import contextlib
+
+class Metrics:
+  """
+  Class collecting timers of the phases of the backup, counters and latency histograms. The timers measured in the worker threads are summed over all threads. The metrics can be written as JSON report or as file for the textfile collector of Prometheus.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # upper bounds of the buckets of the histograms in seconds
+  BUCKETS = [0.0001, 0.001, 0.01, 0.1, 1, 10]
+
+
+  def __init__(self):
+    """
+    Initialization of the object.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.lock = threading.Lock()
+    self.start = time.monotonic()
+    self.timers = {}
+    self.counters = {}
+    self.histograms = {}
+
+
+  @contextlib.contextmanager
+  def timer(self, name):
+    """
+    Measures the time spent in the block.
+
+    Args:
+      name (str): name of the phase
+
+    Returns:
+      context manager: measuring the block
+    """
+
+    start = time.monotonic()
+    try:
+      yield
+    finally:
+      self.time(name, time.monotonic() - start)
+
+
+  def time(self, name, seconds):
+    """
+    Adds the time spent in the phase.
+
+    Args:
+      name (str): name of the phase
+      seconds (float): time spent in the phase
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      timer = self.timers.setdefault(name, [0, 0.0])
+      timer[0] += 1
+      timer[1] += seconds
+
+
+  def add(self, name, value=1):
+    """
+    Increases the counter.
+
+    Args:
+      name (str): name of the counter
+      value (int): increment
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + value
+
+
+  def observe(self, name, seconds):
+    """
+    Adds the latency into the histogram.
+
+    Args:
+      name (str): name of the histogram
+      seconds (float): latency
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      histogram = self.histograms.get(name)
+      if histogram is None:
+        histogram = self.histograms[name] = {'buckets': [0]*(len(Metrics.BUCKETS) + 1), 'count': 0, 'sum': 0.0}
+      i = 0
+      while i < len(Metrics.BUCKETS) and seconds > Metrics.BUCKETS[i]:
+        i += 1
+      histogram['buckets'][i] += 1
+      histogram['count'] += 1
+      histogram['sum'] += seconds
+
+
+  def report(self):
+    """
+    Collects all metrics.
+
+    Args:
+
+    Returns:
+      dict: metrics
+    """
+
+    with self.lock:
+      return {
+        'elapsed': time.monotonic() - self.start,
+        'timers': {name: {'count': count, 'seconds': seconds} for name, (count, seconds) in self.timers.items()},
+        'counters': dict(self.counters),
+        'histograms': {name: {'buckets': dict(zip([str(bound) for bound in Metrics.BUCKETS] + ['+Inf'], histogram['buckets'])), 'count': histogram['count'], 'sum': histogram['sum']} for name, histogram in self.histograms.items()},
+      }
+
+
+  def writeJson(self, path):
+    """
+    Writes the metrics as JSON report.
+
+    Args:
+      path (str): path to the report
+
+    Returns:
+      None
+    """
+
+    with open(path, 'w') as f:
+      json.dump(self.report(), f, indent=2)
+      f.write('\n')
+
+
+  def writePrometheus(self, path):
+    """
+    Atomically writes the metrics in the text format of Prometheus, so that the textfile collector never reads a partial file.
+
+    Args:
+      path (str): path to the file
+
+    Returns:
+      None
+    """
+
+    report = self.report()
+    lines = []
+    lines.append('# HELP goldfish_elapsed_seconds Duration of the last run.')
+    lines.append('# TYPE goldfish_elapsed_seconds gauge')
+    lines.append('goldfish_elapsed_seconds {:.6f}'.format(report['elapsed']))
+    lines.append('# HELP goldfish_last_run_timestamp_seconds Time of the end of the last run.')
+    lines.append('# TYPE goldfish_last_run_timestamp_seconds gauge')
+    lines.append('goldfish_last_run_timestamp_seconds {:.0f}'.format(time.time()))
+    lines.append('# HELP goldfish_phase_seconds Time spent in the phase, summed over the threads.')
+    lines.append('# TYPE goldfish_phase_seconds gauge')
+    for name, timer in sorted(report['timers'].items()):
+      lines.append('goldfish_phase_seconds{{phase="{}"}} {:.6f}'.format(name, timer['seconds']))
+    lines.append('# HELP goldfish_phase_calls Number of times the phase was entered.')
+    lines.append('# TYPE goldfish_phase_calls gauge')
+    for name, timer in sorted(report['timers'].items()):
+      lines.append('goldfish_phase_calls{{phase="{}"}} {}'.format(name, timer['count']))
+    lines.append('# HELP goldfish_count Counters of the last run.')
+    lines.append('# TYPE goldfish_count gauge')
+    for name, value in sorted(report['counters'].items()):
+      lines.append('goldfish_count{{name="{}"}} {}'.format(name, value))
+    lines.append('# HELP goldfish_latency_seconds Latency of the operations.')
+    lines.append('# TYPE goldfish_latency_seconds histogram')
+    for name, histogram in sorted(report['histograms'].items()):
+      cumulative = 0
+      for bound, count in histogram['buckets'].items():
+        cumulative += count
+        lines.append('goldfish_latency_seconds_bucket{{operation="{}",le="{}"}} {}'.format(name, bound, cumulative))
+      lines.append('goldfish_latency_seconds_sum{{operation="{}"}} {:.6f}'.format(name, histogram['sum']))
+      lines.append('goldfish_latency_seconds_count{{operation="{}"}} {}'.format(name, histogram['count']))
+
+    with open(path + '.tmp', 'w') as f:
+      f.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp', path)
+
+
+  def summary(self):
+    """
+    Describes the time spent in the phases, the longest first.
+
+    Args:
+
+    Returns:
+      list of str: lines of the summary
+    """
+
+    report = self.report()
+    lines = []
+    for name, timer in sorted(report['timers'].items(), key=lambda item: -item[1]['seconds']):
+      lines.append('{:<14} {:>10.3f} s {:>10d}x'.format(name + ':', timer['seconds'], timer['count']))
+    database = [histogram for name, histogram in report['histograms'].items() if name.startswith('db.')]
+    if len(database) > 0:
+      lines.append('{:<14} {:>10.3f} s {:>10d}x'.format('database:', sum(h['sum'] for h in database), sum(h['count'] for h in database)))
+    return lines
+
+
+def measured(method):
+  """
+  Decorator measuring the latency of the method of the database into the histogram of the metrics of the object, if it has some.
+
+  Args:
+    method (function): method to measure
+
+  Returns:
+    function: measured method
+  """
+
+  name = 'db.' + method.__name__
+
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    if self.metrics is None:
+      return method(self, *args, **kwargs)
+    start = time.monotonic()
+    try:
+      return method(self, *args, **kwargs)
+    finally:
+      self.metrics.observe(name, time.monotonic() - start)
+
+  return wrapper
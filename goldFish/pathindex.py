@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+import sys
+
+class PathIndex:
+  """
+  Index of the files in the folder of the previous backup, mapping the path of the file to its hash. The index is loaded into memory when it fits into the given limit, otherwise the database is queried for each file.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # approximate memory taken by one entry beside the path, in bytes
+  ENTRY_OVERHEAD = 300
+
+
+  def __init__(self, db, folderId, memoryLimit):
+    """
+    Loads the index from the database.
+
+    Args:
+      db (Database): database of the previous backup
+      folderId (int): id of the folder in the database
+      memoryLimit (int): maximal memory taken by the index in bytes, 0 disables the index
+
+    Returns:
+      None
+    """
+
+    self.db = db
+    self.folderId = folderId
+    self.index = None
+
+    if folderId is None or memoryLimit <= 0:
+      return
+
+    index = {}
+    memory = 0
+    for path, mtime, hash, size, symlink, sample in db.iterFiles(folderId):
+      memory += sys.getsizeof(path) + PathIndex.ENTRY_OVERHEAD
+      if memory > memoryLimit:
+        return
+      index[path] = (mtime, PathIndex.pack(hash), size, symlink, PathIndex.pack(sample))
+    self.index = index
+
+
+  def pack(hash):
+    """
+    Converts the hexadecimal hash into bytes to save memory.
+
+    Args:
+      hash (str): hexadecimal hash or None
+
+    Returns:
+      bytes: hash as bytes, or the given hash if it is not hexadecimal
+    """
+
+    try:
+      return bytes.fromhex(hash)
+    except (TypeError, ValueError):
+      return hash
+
+
+  def unpack(hash):
+    """
+    Converts the hash packed by pack() back.
+
+    Args:
+      hash (bytes): packed hash
+
+    Returns:
+      str: hexadecimal hash or None
+    """
+
+    if isinstance(hash, bytes):
+      return hash.hex()
+    return hash
+
+
+  def loaded(self):
+    """
+    Whether the index is loaded in memory.
+
+    Args:
+
+    Returns:
+      bool: True if the index is in memory
+    """
+
+    return self.index is not None
+
+
+  def get(self, path):
+    """
+    Finds the file in the previous backup.
+
+    Args:
+      path (str): path to the file relative to the folder
+
+    Returns:
+      tuple: (mtime, hash, size, symlink, sample) of the file or None if the file is not in the database
+    """
+
+    if self.index is not None:
+      row = self.index.get(path)
+      if row is None:
+        return None
+      mtime, hash, size, symlink, sample = row
+      return mtime, PathIndex.unpack(hash), size, symlink, PathIndex.unpack(sample)
+
+    return self.db.getFileRow(path, self.folderId)
@@ -0,0 +1,589 @@
+#!/usr/bin/python3
+
+import time
+import queue
+import threading
+import collections
+import concurrent.futures
+
+class Stage:
+  """
+  Stage of the pipeline of the backup running the generator in its own thread. The generated items are passed to the next stage in batches through a bounded queue, so that the stage runs ahead of the next one by at most the size of the queue and the threads do not switch for every item. Exception raised in the stage is raised again in the next stage.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # marker of the end of the items
+  END = object()
+
+  # maximal number of the items passed at once
+  BATCH = 64
+
+
+  def __init__(self, items, size):
+    """
+    Starts the thread of the stage.
+
+    Args:
+      items (iterable): items generated by the stage
+      size (int): maximal number of the items waiting for the next stage
+
+    Returns:
+      None
+    """
+
+    self.items = items
+    self.batch = min(size, Stage.BATCH)
+    self.queue = queue.Queue(maxsize=max(size // self.batch, 1))
+    self.stopped = threading.Event()
+    self.error = None
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+
+  def run(self):
+    """
+    Generates the items into the queue, runs in the thread of the stage.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    batch = []
+    try:
+      for item in self.items:
+        batch.append(item)
+        if len(batch) >= self.batch:
+          if not self.put(batch):
+            return
+          batch = []
+    except Exception as e:
+      self.error = e
+    if len(batch) > 0 and not self.put(batch):
+      return
+    self.put(Stage.END)
+
+
+  def put(self, item):
+    """
+    Waits for a free place in the queue and puts the batch of the items or the end marker into it.
+
+    Args:
+      item (object): item to put
+
+    Returns:
+      bool: False if the next stage stopped reading the items
+    """
+
+    while not self.stopped.is_set():
+      try:
+        self.queue.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+
+  def __iter__(self):
+    """
+    Iterates over the items generated by the stage.
+
+    Args:
+
+    Returns:
+      generator: the items in the order they were generated
+
+    Throws:
+      Exception: exception raised in the stage
+    """
+
+    try:
+      while True:
+        batch = self.queue.get()
+        if batch is Stage.END:
+          break
+        yield from batch
+    finally:
+      self.stopped.set()
+      self.thread.join()
+    if self.error is not None:
+      raise self.error
+
+
+class PendingSizes:
+  """
+  Sizes of the files queued but not finished yet by the folders backuped concurrently. A folder deciding about a file reserves its size once the files of the same size queued by other folders are finished, and keeps it until the file is finished, so that identical files in two folders are hash-linked as when the folders are backuped one after another.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self):
+    """
+    Initialization of the object.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.sizes = collections.Counter()
+    self.condition = threading.Condition()
+    self.aborted = False
+
+
+  def add(self, size):
+    """
+    Records the queued file.
+
+    Args:
+      size (int): size of the file
+
+    Returns:
+      None
+    """
+
+    with self.condition:
+      self.sizes[size] += 1
+
+
+  def release(self, size):
+    """
+    Records the finished file and wakes up the folders waiting for its size.
+
+    Args:
+      size (int): size of the file
+
+    Returns:
+      None
+    """
+
+    with self.condition:
+      self.sizes[size] -= 1
+      if self.sizes[size] == 0:
+        del self.sizes[size]
+        self.condition.notify_all()
+
+
+  def reserve(self, size):
+    """
+    Records the file which is decided about, when no file of the given size is queued.
+
+    Args:
+      size (int): size of the file
+
+    Returns:
+      bool: True if the size was reserved, False if some file of the size is not finished
+    """
+
+    with self.condition:
+      if self.sizes[size] > 0 and not self.aborted:
+        return False
+      self.sizes[size] += 1
+      return True
+
+
+  def wait(self, size):
+    """
+    Waits until no file of the given size is queued or until the backup is aborted.
+
+    Args:
+      size (int): size of the file
+
+    Returns:
+      None
+    """
+
+    with self.condition:
+      while self.sizes[size] > 0 and not self.aborted:
+        self.condition.wait()
+
+
+  def abort(self):
+    """
+    Stops waiting for the files of the folder which failed.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    with self.condition:
+      self.aborted = True
+      self.condition.notify_all()
+
+
+class CopyPool:
+  """
+  Stage of the pipeline copying the files into the backup in a pool of worker threads. The copies run concurrently, but the files are finished in the order they were queued, so that the database and the messages are the same as without the pool. The decision about a file depends on the files of this backup with the same size, so the queued files of that size can be waited for, including the files queued by other folders backuped concurrently.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self, workers, size, finish, metrics=None, pending=None):
+    """
+    Starts the pool of the workers.
+
+    Args:
+      workers (int): number of worker threads, 0 copies the files inline
+      size (int): maximal number of the files waiting to be finished
+      finish (function): function finishing the file, called with the queued item and the result of its copy in the order of the items
+      metrics (Metrics): metrics measuring the time spent waiting for the copies or None
+      pending (PendingSizes): sizes of the files queued by all folders backuped concurrently or None
+
+    Returns:
+      None
+    """
+
+    self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+    self.size = size
+    self.finish = finish
+    self.metrics = metrics
+    self.pending = pending
+    self.reserved = None
+    self.queue = collections.deque()
+    self.sizes = collections.Counter()
+
+
+  def put(self, item, size, copy=None, *args):
+    """
+    Queues the file and finishes the files at the head of the queue which are already copied.
+
+    Args:
+      item (object): file passed to the finishing function
+      size (int): size of the file
+      copy (function): function copying the file or None when there is nothing to copy
+      args (tuple): arguments of the copying function
+
+    Returns:
+      None
+    """
+
+    if copy is not None and self.pool is not None:
+      future = self.pool.submit(copy, *args)
+    else:
+      future = concurrent.futures.Future()
+      future.set_result(copy(*args) if copy is not None else None)
+    self.queue.append((item, size, future))
+    self.sizes[size] += 1
+    if self.pending is not None:
+      if self.reserved == size:
+        # the size was reserved by wait()
+        self.reserved = None
+      else:
+        self.pending.add(size)
+    while len(self.queue) > 0 and (self.queue[0][2].done() or len(self.queue) > self.size):
+      self.__finishHead()
+
+
+  def wait(self, size):
+    """
+    Finishes the queued files until no file of the given size is queued. With other folders backuped concurrently, waits for the files of the size queued by them too and reserves the size for the file put next.
+
+    Args:
+      size (int): size of the file
+
+    Returns:
+      None
+    """
+
+    while self.sizes[size] > 0:
+      self.__finishHead()
+    if self.pending is None:
+      return
+    while not self.pending.reserve(size):
+      # no folder waits for this one while it waits for the others
+      while len(self.queue) > 0:
+        self.__finishHead()
+      if self.metrics is None:
+        self.pending.wait(size)
+      else:
+        with self.metrics.timer('folderWait'):
+          self.pending.wait(size)
+    self.reserved = size
+
+
+  def __finishHead(self):
+    """
+    Waits for the copy of the file at the head of the queue and finishes it.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    item, size, future = self.queue.popleft()
+    self.sizes[size] -= 1
+    if self.sizes[size] == 0:
+      del self.sizes[size]
+    try:
+      if self.metrics is not None and not future.done():
+        start = time.monotonic()
+        concurrent.futures.wait([future])
+        self.metrics.time('copyWait', time.monotonic() - start)
+      self.finish(item, future.result())
+    finally:
+      if self.pending is not None:
+        self.pending.release(size)
+
+
+  def close(self):
+    """
+    Finishes all queued files and stops the workers.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    try:
+      while len(self.queue) > 0:
+        self.__finishHead()
+    finally:
+      if self.pool is not None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class DatabaseWriter:
+  """
+  Stage of the pipeline writing the new files and hashes into the database in its own thread. The rows are passed to the writer in batches and written in the order they were inserted, and the ids of the inserted hashes are returned as deferred values resolved by the writer. All other methods of the database wait until the queued rows are written, so that they see the same database as without the writer. The writer can be shared by the folders backuped concurrently, so that each folder sees the rows queued by the others.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self, db, size, metrics=None):
+    """
+    Starts the thread of the writer.
+
+    Args:
+      db (Database): database to write into
+      size (int): maximal number of the rows waiting to be written
+      metrics (Metrics): metrics measuring the time spent waiting for the writer or None
+
+    Returns:
+      None
+    """
+
+    self.db = db
+    self.metrics = metrics
+    self.batchSize = min(size, Stage.BATCH)
+    self.batch = []
+    self.lock = threading.Lock()
+    self.queue = queue.Queue(maxsize=max(size // self.batchSize, 1))
+    self.error = None
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+
+  def run(self):
+    """
+    Writes the queued rows into the database, runs in the thread of the writer. After the first error, the remaining rows are dropped.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    while True:
+      batch = self.queue.get()
+      try:
+        if batch is None:
+          return
+        for method, args, result in batch:
+          if self.error is not None:
+            break
+          value = method(*[arg.value if isinstance(arg, Deferred) else arg for arg in args])
+          if result is not None:
+            result.value = value
+      except Exception as e:
+        self.error = e
+      finally:
+        self.queue.task_done()
+
+
+  def write(self, method, args, result=None):
+    """
+    Queues the write into the database.
+
+    Args:
+      method (function): method of the database writing the row
+      args (tuple): arguments of the method, deferred values are resolved before the call
+      result (Deferred): deferred value receiving the return value of the method or None
+
+    Returns:
+      None
+    """
+
+    self.check()
+    with self.lock:
+      self.batch.append((method, args, result))
+      if len(self.batch) >= self.batchSize:
+        self.__send()
+
+
+  def __send(self):
+    """
+    Passes the batch of the queued writes to the writer.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    if len(self.batch) == 0:
+      return
+    batch = self.batch
+    self.batch = []
+    if self.metrics is None:
+      self.queue.put(batch)
+    else:
+      with self.metrics.timer('dbWait'):
+        self.queue.put(batch)
+
+
+  def check(self):
+    """
+    Raises the error of the writer again.
+
+    Args:
+
+    Returns:
+      None
+
+    Throws:
+      Exception: error raised by the database in the writer
+    """
+
+    if self.error is not None:
+      raise self.error
+
+
+  def sync(self):
+    """
+    Waits until all queued rows are written.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.__send()
+    if self.metrics is None:
+      self.queue.join()
+    else:
+      with self.metrics.timer('dbWait'):
+        self.queue.join()
+    self.check()
+
+
+  def insertHash(self, hash, size, symlink, sample=None):
+    """
+    Queues insertion of the hash.
+
+    Args:
+      hash (str): hash of the file
+      size (int): size of the file
+      symlink (bool): hash of symlink
+      sample (str): hash of the sample of the file or None
+
+    Returns:
+      Deferred: id of the hash, known once it is written
+    """
+
+    result = Deferred()
+    self.write(self.db.insertHash, (hash, size, symlink, sample), result)
+    return result
+
+
+  def insertFile(self, path, mtime, folderId, hashId):
+    """
+    Queues insertion of the file.
+
+    Args:
+      path (str): path to the file relative to the folder
+      mtime (int): mtime of the file
+      folderId (int): id of the folder
+      hashId (int or Deferred): id of the hash of the file
+
+    Returns:
+      None
+    """
+
+    self.write(self.db.insertFile, (path, mtime, folderId, hashId))
+
+
+  def __getattr__(self, name):
+    """
+    Returns the method of the database waiting for the queued rows first.
+
+    Args:
+      name (str): name of the method
+
+    Returns:
+      function: method of the database
+    """
+
+    attribute = getattr(self.db, name)
+    if not callable(attribute):
+      return attribute
+
+    def method(*args, **kwargs):
+      self.sync()
+      return attribute(*args, **kwargs)
+
+    return method
+
+
+  def close(self):
+    """
+    Writes the remaining rows and stops the thread of the writer.
+
+    Args:
+
+    Returns:
+      Database: the database written into
+
+    Throws:
+      Exception: error raised by the database in the writer
+    """
+
+    with self.lock:
+      self.__send()
+    self.queue.put(None)
+    self.thread.join()
+    self.check()
+    return self.db
+
+
+class Deferred:
+  """
+  Value computed later by the writer of the database.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self):
+    """
+    Initialization of the object.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.value = None
@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+
+import sys
+import json
+import time
+import shutil
+import threading
+from .io import readableSize, shortenText
+
+class Progress:
+  """
+  Class rendering the progress line on the terminal. The line is redrawn at most once per given interval and it is not rendered at all when the output is not a terminal. Optionally writes the events about the processed files as JSON lines.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # seconds between updates of the terminal width
+  WIDTH_INTERVAL = 1.0
+
+
+  def __init__(self, interval=0.1, enabled=None, events=None):
+    """
+    Initialization of the object.
+
+    Args:
+      interval (float): minimal time between two redraws in seconds
+      enabled (bool): whether to render the progress line, None renders it when the output is a terminal
+      events (file): file for the JSON events or None
+
+    Returns:
+      None
+    """
+
+    self.interval = interval
+    if enabled is None:
+      enabled = sys.stdout.isatty()
+    self.enabled = enabled
+    self.events = events
+    self.lock = threading.Lock()
+
+    self.text = ''
+    self.flagText = ' '
+    self.drawn = False
+    self.lastDraw = 0
+    self.width = 80
+    self.lastWidth = 0
+
+    self.start = time.monotonic()
+    self.bytesTotal = None
+    self.bytesDone = 0
+
+
+  def setTotal(self, bytesTotal):
+    """
+    Sets the number of bytes to process, so that the remaining time can be estimated.
+
+    Args:
+      bytesTotal (int): number of bytes to process
+
+    Returns:
+      None
+    """
+
+    self.bytesTotal = bytesTotal
+    self.start = time.monotonic()
+    self.bytesDone = 0
+
+
+  def file(self, text):
+    """
+    Shows the file being processed.
+
+    Args:
+      text (str): text describing the file
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.text = text
+      self.flagText = ' '
+      self.__draw()
+
+
+  def flag(self, flag):
+    """
+    Shows the flag of the current operation with the file.
+
+    Args:
+      flag (str): one character describing the operation
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.flagText = flag
+      self.__draw()
+
+
+  def done(self, bytes):
+    """
+    Adds the processed bytes.
+
+    Args:
+      bytes (int): number of processed bytes
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.bytesDone += bytes
+
+
+  def message(self, text=''):
+    """
+    Prints the line of the text above the progress line.
+
+    Args:
+      text (str): text to print
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.__clear()
+      sys.stdout.write(text + '\n')
+      sys.stdout.flush()
+
+
+  def messages(self, lines):
+    """
+    Prints the lines of the text above the progress line at once, so that they are not interleaved with the messages of other threads.
+
+    Args:
+      lines (list of str): lines to print
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.__clear()
+      for text in lines:
+        sys.stdout.write(text + '\n')
+      sys.stdout.flush()
+
+
+  def clear(self):
+    """
+    Removes the progress line from the terminal.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.__clear()
+
+
+  def event(self, event, **fields):
+    """
+    Writes the event as one JSON line.
+
+    Args:
+      event (str): type of the event
+      fields (dict): data of the event
+
+    Returns:
+      None
+    """
+
+    if self.events is None:
+      return
+    with self.lock:
+      self.events.write(json.dumps(dict(event=event, **fields)) + '\n')
+
+
+  def close(self):
+    """
+    Removes the progress line and closes the file of the events.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    self.clear()
+    if self.events is not None:
+      self.events.close()
+      self.events = None
+
+
+  def status(self):
+    """
+    Describes the processed bytes and the remaining time.
+
+    Args:
+
+    Returns:
+      str: status of the progress
+    """
+
+    elapsed = time.monotonic() - self.start
+    if self.bytesTotal:
+      percent = min(100*self.bytesDone/self.bytesTotal, 100)
+      if self.bytesDone > 0:
+        eta = int(elapsed*(self.bytesTotal - self.bytesDone)/self.bytesDone)
+        return '{:3.0f}% ETA {:d}:{:02d}:{:02d}'.format(percent, eta // 3600, eta // 60 % 60, eta % 60)
+      return '{:3.0f}% ETA --:--:--'.format(percent)
+    return readableSize(self.bytesDone).strip()
+
+
+  def __draw(self):
+    """
+    Redraws the progress line if the interval elapsed.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    if not self.enabled:
+      return
+    now = time.monotonic()
+    if now - self.lastDraw < self.interval:
+      return
+    self.lastDraw = now
+    if now - self.lastWidth >= Progress.WIDTH_INTERVAL:
+      self.width = shutil.get_terminal_size().columns
+      self.lastWidth = now
+    line = shortenText(self.flagText + ' [' + self.status() + '] ' + self.text, self.width - 1)
+    sys.stdout.write('\r' + line.ljust(self.width - 1) + '\r')
+    sys.stdout.flush()
+    self.drawn = True
+
+
+  def __clear(self):
+    """
+    Removes the progress line from the terminal without locking.
+
+    Args:
+
+    Returns:
+      None
+    """
+
+    if self.drawn:
+      sys.stdout.write('\r' + ' '*(self.width - 1) + '\r')
+      sys.stdout.flush()
+      self.drawn = False
+      self.lastDraw = 0
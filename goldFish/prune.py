@@ -1,20 +1,29 @@
 #!/usr/bin/python3
 
+import os
+import time
+import shutil
 import pathlib
 import terminaltables
 from .io import *
 from .config import Config
 from .backups import *
 from .database import Database
+from .progress import Progress
+from .retention import Retention
+from .sizescanner import SizeScanner
+from .remover import TreeRemover
 
 class Prune:
 
-  def main(configFile):
+  def main(configFile, apply=False, workers=8):
     """
     Prune backups that are needless.
 
     Args:
       configFile (str): path to the configuration file
+      apply (bool): whether to delete the backups expired by the retention policy
+      workers (int): number of threads scanning and deleting the backups
     """
 
     config = Config(configFile)
@@ -34,8 +43,57 @@ class Prune:
         for item in items:
           if not backupsDict[backup][item]['HDD'] and backupsDict[backup][item]['DB']:
             if queryYesNo('Backup {backup} {item} is stored in the database, but not stored physicaly on the drive. Do you want to remove it from the database?'.format(backup=backup, item=item), default='no'):
-              db = Database(pathlib.Path(config.dbPath) / (backup + '.sqlite'))
+              db = openCatalog(config, backup, readonly=False)
               folderId = db.getFolder(item)
               print('Removing ...', end='', flush=True)
               db.removeFolder(folderId)
+              db.close()
+              updateSummary(config, backup)
               print(' Done')
+
+    retention = Retention(config)
+    if not retention.enabled():
+      if apply:
+        print('No retention policy is set in the configuration file, no backup is deleted.')
+      return
+    expired = retention.expired(listBackups(config))
+    if len(expired) == 0:
+      print('No backup is expired by the retention policy.')
+      return
+    print('Backups expired by the retention policy:')
+    for backup in expired:
+      print('  ' + backup)
+    if not apply:
+      print('Run \'goldFish prune --apply\' to delete them.')
+      return
+
+    # inodes with all links inside the expired backups are freed
+    paths = [os.path.join(config.backupDirTo, backup) for backup in expired]
+    progress = Progress()
+    scanner = SizeScanner(workers, progress)
+    sizeTotal, sizeDelete = scanner.scan(paths)
+    progress.close()
+    print('  Files:                        ' + str(scanner.numFiles))
+    print('  Will be freed after deletion: ' + readableSize(sizeDelete))
+    if not queryYesNo('Do you want to delete {:d} expired backups?'.format(len(expired)), default='no'):
+      return
+
+    free = shutil.disk_usage(config.backupDirTo).free
+    start = time.monotonic()
+    progress = Progress()
+    remover = TreeRemover(workers, progress)
+    removed = remover.remove(paths)
+    progress.close()
+    for backup, path in zip(expired, paths):
+      if path not in removed:
+        continue
+      if config.dbEnable:
+        removeCatalog(config, backup)
+        shutil.rmtree(os.path.join(config.manifestPath, backup), ignore_errors=True)
+        updateSummary(config, backup)
+      print('  ' + backup + ' deleted')
+
+    for path, error in remover.errors:
+      print('  Can not remove ' + path + ': ' + error)
+    print('Deleted {:d} of {:d} backups, {:d} files in {:.1f} s.'.format(len(removed), len(expired), remover.numFiles, time.monotonic() - start))
+    print('  Freed: ' + readableSize(max(shutil.disk_usage(config.backupDirTo).free - free, 0)))
@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+import os
+import concurrent.futures
+
+class TreeRemover:
+  """
+  Class removing the folders with all their content. The directories are listed and their files are unlinked in a pool of worker threads, and every directory is removed as soon as all its subdirectories are removed. A directory with some entry which can not be removed is kept together with all its parents.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self, workers=8, progress=None):
+    """
+    Initialization of the object.
+
+    Args:
+      workers (int): number of worker threads, 1 removes the folders inline
+      progress (Progress): progress line or None
+
+    Returns:
+      None
+    """
+
+    self.workers = workers
+    self.progress = progress
+    self.numFiles = 0
+    self.numDirs = 0
+    self.errors = []
+
+    # directory -> its parent directory, None for the removed folders
+    self.parents = {}
+    # directory -> number of its subdirectories not removed yet
+    self.remaining = {}
+    # directories which can not be removed
+    self.failed = set()
+
+
+  def remove(self, paths):
+    """
+    Removes the folders with all their content.
+
+    Args:
+      paths (list of str): paths to the folders
+
+    Returns:
+      list of str: paths to the folders removed completely
+    """
+
+    for path in paths:
+      self.parents[path] = None
+
+    if self.workers > 1:
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+        pending = set(pool.submit(TreeRemover.removeFiles, path) for path in paths)
+        while pending:
+          done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+          for future in done:
+            path, subdirs, files, errors = future.result()
+            pending.update(pool.submit(TreeRemover.removeFiles, subdir) for subdir in subdirs)
+            self.__listed(path, subdirs, files, errors)
+    else:
+      dirs = list(paths)
+      while dirs:
+        path, subdirs, files, errors = TreeRemover.removeFiles(dirs.pop())
+        dirs.extend(subdirs)
+        self.__listed(path, subdirs, files, errors)
+
+    return [path for path in paths if path not in self.failed]
+
+
+  def removeFiles(path):
+    """
+    Lists the directory and unlinks all its entries which are not directories, symlinks are not followed.
+
+    Args:
+      path (str): path to the directory
+
+    Returns:
+      str: path to the directory
+      list of str: paths to the subdirectories
+      int: number of the unlinked files
+      list of tuples: entries which can not be removed in form (path, error)
+    """
+
+    dirs = []
+    files = 0
+    errors = []
+    try:
+      with os.scandir(path) as entries:
+        for entry in entries:
+          try:
+            if entry.is_dir(follow_symlinks=False):
+              dirs.append(entry.path)
+            else:
+              os.unlink(entry.path)
+              files += 1
+          except OSError as e:
+            errors.append((entry.path, e.strerror))
+    except OSError as e:
+      errors.append((path, e.strerror))
+    return path, dirs, files, errors
+
+
+  def __listed(self, path, subdirs, files, errors):
+    """
+    Records the emptied directory and removes it when it has no subdirectories.
+
+    Args:
+      path (str): path to the directory
+      subdirs (list of str): paths to the subdirectories
+      files (int): number of the unlinked files
+      errors (list of tuples): entries which can not be removed in form (path, error)
+
+    Returns:
+      None
+    """
+
+    if self.progress is not None:
+      self.progress.file(path)
+    self.numFiles += files
+    self.errors.extend(errors)
+    if len(errors) > 0:
+      self.failed.add(path)
+    self.remaining[path] = len(subdirs)
+    for subdir in subdirs:
+      self.parents[subdir] = path
+    if len(subdirs) == 0:
+      self.__removeDir(path)
+
+
+  def __removeDir(self, path):
+    """
+    Removes the directory whose content is removed, and its parents whose all subdirectories are removed.
+
+    Args:
+      path (str): path to the directory
+
+    Returns:
+      None
+    """
+
+    while path is not None:
+      if path not in self.failed:
+        try:
+          os.rmdir(path)
+          self.numDirs += 1
+        except OSError as e:
+          self.errors.append((path, e.strerror))
+          self.failed.add(path)
+      parent = self.parents.pop(path)
+      del self.remaining[path]
+      if parent is None:
+        return
+      if path in self.failed:
+        self.failed.add(parent)
+      self.remaining[parent] -= 1
+      if self.remaining[parent] > 0:
+        return
+      path = parent
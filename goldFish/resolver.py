@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+import os
+import threading
+import collections
+
+class LinkResolver:
+  """
+  Resolver of the targets of the hash-links. The files with the same hash are read from the databases page by page, the newest first, until a file which exists in the backup and whose inode has not reached the limit of the hardlinks is found. The recently chosen targets and the files which can not be linked are remembered in caches of limited size, so that the databases and the disk are not searched again for common files.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # number of the files read from the database at once
+  PAGE_SIZE = 16
+
+  # maximal number of the remembered targets
+  TARGETS_SIZE = 100000
+
+  # maximal number of the remembered files which can not be linked
+  UNUSABLE_SIZE = 100000
+
+
+  def __init__(self, config, today):
+    """
+    Initialization of the object.
+
+    Args:
+      config (Config): configuration object
+      today (str): name of the new backup
+
+    Returns:
+      None
+    """
+
+    self.config = config
+    self.today = today
+    self.lock = threading.Lock()
+    # (hash, size, symlink, mtime) -> target, the least recently used first
+    self.targets = collections.OrderedDict()
+    # target -> keys of the target in targets
+    self.keys = {}
+    # paths to the files which can not be linked, the least recently used first
+    self.unusable = collections.OrderedDict()
+    try:
+      self.linkMax = os.pathconf(config.backupDirTo, 'PC_LINK_MAX')
+    except (OSError, ValueError):
+      self.linkMax = None
+
+
+  def resolve(self, key, hashIds, mtime):
+    """
+    Finds the target of the hash-link, preferring the files with the same mtime.
+
+    Args:
+      key (tuple): hash, size and symlink of the file
+      hashIds (list): backups containing the hash in form (backup, database, hash id), the preferred first
+      mtime (int): mtime of the file
+
+    Returns:
+      tuple: target in form (backup, folder, file id, path, mtime) or None if there is none
+    """
+
+    for sameMtime in [mtime, None]:
+      with self.lock:
+        target = self.targets.get(key + (sameMtime, ))
+        if target is not None:
+          self.targets.move_to_end(key + (sameMtime, ))
+      if target is None:
+        target = self.search(hashIds, sameMtime)
+        if target is not None:
+          with self.lock:
+            self.__addTarget(key + (sameMtime, ), target)
+      if target is not None:
+        return target
+    return None
+
+
+  def search(self, hashIds, mtime):
+    """
+    Searches the databases for the target of the hash-link.
+
+    Args:
+      hashIds (list): backups containing the hash in form (backup, database, hash id), the preferred first
+      mtime (int): mtime of the target or None for any mtime
+
+    Returns:
+      tuple: target in form (backup, folder, file id, path, mtime) or None if there is none
+    """
+
+    for backup, db, hashId in hashIds:
+      offset = 0
+      while True:
+        rows = db.getFilesByHash(hashId, mtime, LinkResolver.PAGE_SIZE, offset)
+        for row in rows:
+          if self.usable((backup, ) + row):
+            return (backup, ) + row
+        if len(rows) < LinkResolver.PAGE_SIZE:
+          break
+        offset += LinkResolver.PAGE_SIZE
+    return None
+
+
+  def usable(self, target):
+    """
+    Checks whether the file exists in the backup and can be linked.
+
+    Args:
+      target (tuple): target in form (backup, folder, file id, path, mtime)
+
+    Returns:
+      bool: True if the file can be linked
+    """
+
+    if self.config.dryRun and target[0] == self.today:
+      return True
+    path = self.path(target)
+    with self.lock:
+      if path in self.unusable:
+        self.unusable.move_to_end(path)
+        return False
+    usable = os.path.isfile(path)
+    if usable and self.linkMax is not None:
+      usable = os.stat(path, follow_symlinks=self.config.followSymlinks).st_nlink < self.linkMax
+    if not usable:
+      with self.lock:
+        self.__addUnusable(path)
+    return usable
+
+
+  def full(self, target):
+    """
+    Marks the target whose inode reached the limit of the hardlinks, so that other target is resolved.
+
+    Args:
+      target (tuple): target in form (backup, folder, file id, path, mtime)
+
+    Returns:
+      None
+    """
+
+    with self.lock:
+      self.__addUnusable(self.path(target))
+      for key in self.keys.pop(target, set()):
+        del self.targets[key]
+
+
+  def __addTarget(self, key, target):
+    """
+    Remembers the target, the least recently used target is forgotten when the cache is full. Must be called with the lock held.
+
+    Args:
+      key (tuple): hash, size, symlink and mtime of the file
+      target (tuple): target in form (backup, folder, file id, path, mtime)
+
+    Returns:
+      None
+    """
+
+    if key in self.targets:
+      self.__removeTarget(key)
+    self.targets[key] = target
+    self.keys.setdefault(target, set()).add(key)
+    while len(self.targets) > LinkResolver.TARGETS_SIZE:
+      self.__removeTarget(next(iter(self.targets)))
+
+
+  def __removeTarget(self, key):
+    """
+    Forgets the target of the key. Must be called with the lock held.
+
+    Args:
+      key (tuple): hash, size, symlink and mtime of the file
+
+    Returns:
+      None
+    """
+
+    target = self.targets.pop(key)
+    keys = self.keys[target]
+    keys.discard(key)
+    if len(keys) == 0:
+      del self.keys[target]
+
+
+  def __addUnusable(self, path):
+    """
+    Remembers the file which can not be linked, the least recently used file is forgotten when the cache is full. Must be called with the lock held.
+
+    Args:
+      path (str): path to the file
+
+    Returns:
+      None
+    """
+
+    self.unusable[path] = None
+    self.unusable.move_to_end(path)
+    while len(self.unusable) > LinkResolver.UNUSABLE_SIZE:
+      self.unusable.popitem(last=False)
+
+
+  def path(self, target):
+    """
+    Returns path to the target in the backup.
+
+    Args:
+      target (tuple): target in form (backup, folder, file id, path, mtime)
+
+    Returns:
+      str: path to the file
+    """
+
+    return os.path.join(self.config.backupDirTo, target[0], target[1], target[3])
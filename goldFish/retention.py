@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+import datetime
+
+class Retention:
+  """
+  Retention policy of the backups. A backup is kept when it is one of the last backups, when it is younger than the given number of days or when it is the newest backup of one of the last days, weeks or months with some backup. The newest backup and the backups whose names are not dates are always kept. Without any rule no backup expires.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  # format of the names of the backups
+  NAME_FORMAT = '%Y%m%d_%H%M'
+
+
+  def __init__(self, config):
+    """
+    Initialization of the object.
+
+    Args:
+      config (Config): configuration object
+
+    Returns:
+      None
+    """
+
+    self.last = config.retainLast
+    self.days = config.retainDays
+    self.periods = [
+      (config.retainDaily, lambda date: date.date()),
+      (config.retainWeekly, lambda date: date.isocalendar()[:2]),
+      (config.retainMonthly, lambda date: (date.year, date.month)),
+    ]
+
+
+  def enabled(self):
+    """
+    Checks whether some rule of the policy is set.
+
+    Args:
+
+    Returns:
+      bool: True if some backup can expire
+    """
+
+    return self.last > 0 or self.days > 0 or any(count > 0 for count, period in self.periods)
+
+
+  def expired(self, backups, now=None):
+    """
+    Selects the backups expired by the policy.
+
+    Args:
+      backups (list of str): names of the backups
+      now (datetime.datetime): current time, None for the time of the call
+
+    Returns:
+      list of str: names of the expired backups, the newest first
+    """
+
+    if not self.enabled():
+      return []
+    if now is None:
+      now = datetime.datetime.now()
+
+    dates = []
+    for backup in backups:
+      try:
+        dates.append((backup, datetime.datetime.strptime(backup, Retention.NAME_FORMAT)))
+      except ValueError:
+        pass
+    dates.sort(key=lambda item: item[1], reverse=True)
+
+    kept = set(backup for backup, date in dates[:max(self.last, 1)])
+    if self.days > 0:
+      kept.update(backup for backup, date in dates if date >= now - datetime.timedelta(days=self.days))
+    for count, period in self.periods:
+      seen = set()
+      for backup, date in dates:
+        if len(seen) >= count:
+          break
+        if period(date) not in seen:
+          seen.add(period(date))
+          kept.add(backup)
+
+    return [backup for backup, date in dates if backup not in kept]
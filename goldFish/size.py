@@ -4,48 +4,39 @@ import os
 import sys
 import pathlib
 from .io import *
+from .progress import Progress
+from .sizescanner import SizeScanner
 
 class Size:
 
-  def main(path):
+  def main(paths, workers=8):
     """
-    Get size of the backuped folder.
+    Get size of the backuped folders.
 
     Args:
-      path (str): path to backuped folder
+      paths (list of str): paths to backuped folders
+      workers (int): number of threads listing the folders
 
     Returns:
       None
 
     Throws:
-      FileNotFoundError: when the folder does not exists
+      FileNotFoundError: when some folder does not exists
     """
 
-    dirFrom = pathlib.Path(path)
-    if not dirFrom.exists():
-      raise FileNotFoundError(dirFrom)
+    for path in paths:
+      dirFrom = pathlib.Path(path)
+      if not dirFrom.exists():
+        raise FileNotFoundError(dirFrom)
 
     printHeadline()
-    sizeTotal = 0
-    sizeDelete = 0
-   
-    for root, dirs, files in os.walk(dirFrom):
-      relPath = os.path.relpath(root, dirFrom)
-      for file in files:
-        fileFrom = os.path.join(root, file)
-        printToTerminalSize(os.path.join(relPath, file))
-        sys.stdout.flush()
-
-        statFrom = os.stat(fileFrom, follow_symlinks=False)
-        if statFrom.st_nlink == 1:
-          sizeDelete += statFrom.st_size
-        sizeTotal += statFrom.st_size
-
-        sys.stdout.write('\r')
-        sys.stdout.flush()
-        printToTerminalSize(' ')
-        sys.stdout.write('\r')
-        sys.stdout.flush()
-
+    progress = Progress()
+    scanner = SizeScanner(workers, progress)
+    sizeTotal, sizeDelete = scanner.scan(paths)
+    progress.close()
+
+    for path in paths:
+      print('  ' + path)
+    print('  Files:                        ' + str(scanner.numFiles))
     print('  Size of the backup:           ' + readableSize(sizeTotal))
     print('  Will be freed after deletion: ' + readableSize(sizeDelete))
@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+import os
+import concurrent.futures
+
+class SizeScanner:
+  """
+  Class counting the size of the files in the folders. The folders are listed in a pool of worker threads and every inode is counted once, so the hardlinked files are not counted several times. An inode is freed after the deletion of the folders when all its links are inside them.
+
+  by Pavel Trutman, pavel.trutman@fel.cvut.cz
+  """
+
+
+  def __init__(self, workers=8, progress=None):
+    """
+    Initialization of the object.
+
+    Args:
+      workers (int): number of worker threads, 1 lists the folders inline
+      progress (Progress): progress line or None
+
+    Returns:
+      None
+    """
+
+    self.workers = workers
+    self.progress = progress
+    self.sizeTotal = 0
+    self.sizeDelete = 0
+    self.numFiles = 0
+    self.numInodes = 0
+
+    # (st_dev, st_ino) -> number of links not seen yet
+    self.links = {}
+
+
+  def scan(self, paths):
+    """
+    Counts the size of the files in the folders, the folders nested in other given folders are scanned only once. The sizes are accumulated over all calls.
+
+    Args:
+      paths (list of str): paths to the folders
+
+    Returns:
+      int: size of the files with every inode counted once
+      int: size of the inodes with all links inside the scanned folders
+    """
+
+    roots = []
+    for path in sorted(set(os.path.realpath(path) for path in paths)):
+      if not any(path.startswith(os.path.join(root, '')) for root in roots):
+        roots.append(path)
+
+    dirs = []
+    for root in roots:
+      if os.path.isdir(root):
+        dirs.append(root)
+      else:
+        stat = os.lstat(root)
+        self.add((stat.st_dev, stat.st_ino), stat.st_nlink, stat.st_size)
+
+    if self.workers > 1:
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+        pending = set(pool.submit(SizeScanner.listDir, dir) for dir in dirs)
+        while pending:
+          done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+          for future in done:
+            path, subdirs, files = future.result()
+            pending.update(pool.submit(SizeScanner.listDir, subdir) for subdir in subdirs)
+            self.__addFiles(path, files)
+    else:
+      while dirs:
+        path, subdirs, files = SizeScanner.listDir(dirs.pop())
+        dirs.extend(subdirs)
+        self.__addFiles(path, files)
+
+    return self.sizeTotal, self.sizeDelete
+
+
+  def listDir(path):
+    """
+    Lists the directory and stats its files without following symlinks. Unreadable entries are skipped.
+
+    Args:
+      path (str): path to the directory
+
+    Returns:
+      str: path to the directory
+      list of str: paths to the subdirectories
+      list of tuples: files in form ((st_dev, st_ino), st_nlink, st_size)
+    """
+
+    dirs = []
+    files = []
+    try:
+      with os.scandir(path) as entries:
+        for entry in entries:
+          try:
+            if entry.is_dir(follow_symlinks=False):
+              dirs.append(entry.path)
+            else:
+              stat = entry.stat(follow_symlinks=False)
+              files.append(((stat.st_dev, stat.st_ino), stat.st_nlink, stat.st_size))
+          except OSError:
+            pass
+    except OSError:
+      pass
+    return path, dirs, files
+
+
+  def add(self, key, nlink, size):
+    """
+    Counts one link of the inode.
+
+    Args:
+      key (tuple): (st_dev, st_ino) of the inode
+      nlink (int): number of links of the inode
+      size (int): size of the inode
+
+    Returns:
+      None
+    """
+
+    self.numFiles += 1
+    if nlink <= 1:
+      self.sizeTotal += size
+      self.sizeDelete += size
+      self.numInodes += 1
+      return
+
+    remaining = self.links.get(key)
+    if remaining is None:
+      self.sizeTotal += size
+      self.numInodes += 1
+      remaining = nlink
+    remaining -= 1
+    if remaining > 0:
+      self.links[key] = remaining
+    else:
+      self.links.pop(key, None)
+      self.sizeDelete += size
+
+
+  def __addFiles(self, path, files):
+    """
+    Counts the files of the listed directory.
+
+    Args:
+      path (str): path to the directory
+      files (list of tuples): files in form ((st_dev, st_ino), st_nlink, st_size)
+
+    Returns:
+      None
+    """
+
+    if self.progress is not None:
+      self.progress.file(path)
+    for key, nlink, size in files:
+      self.add(key, nlink, size)
+      if self.progress is not None:
+        self.progress.done(size)
@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+
+import pathlib
+from .io import *
+from .config import Config
+from .database import Database
+
+class Upgrade:
+
+  def main(configFile):
+    """
+    Upgrades databases of all backups to the current version of the schema.
+
+    Args:
+      configFile (str): path to the configuration file
+
+    Returns:
+      None
+    """
+
+    config = Config(configFile)
+
+    printHeadline()
+
+    if not config.dbEnable:
+      print('Database is not enabled.')
+      return
+
+    dbFiles = list(pathlib.Path(config.dbPath).glob('*.sqlite'))
+    dbFiles.sort()
+    upgraded = 0
+    for dbFile in dbFiles:
+      print('  ' + dbFile.name + ' ...', end='', flush=True)
+      db = Database(dbFile)
+      if db.versionOpened == db.version:
+        print(' version {} is up to date'.format(db.version))
+      else:
+        print(' upgraded from version {} to {}'.format(db.versionOpened, db.version))
+        upgraded += 1
+      del db
+
+    print('Upgraded {} of {} databases.'.format(upgraded, len(dbFiles)))
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+import threading
+from benchmarks import pipeline
+from goldFish.pipeline import Stage, CopyPool, PendingSizes
+
+
+def test_pipeline_same_as_loop(tmp_path):
+  """
+  The pipeline produces the same backups and databases as the sequential loop.
+  """
+
+  assert pipeline.main(['--profile', 'tiny', '--generations', '3', '--workdir', str(tmp_path)]) == 0
+
+
+def test_stage_keeps_order():
+  """
+  The stage passes all items in their order, also when they do not fill the last batch.
+  """
+
+  items = list(range(Stage.BATCH*3 + 5))
+  assert list(Stage(iter(items), 10)) == items
+
+
+def test_copy_pool_finishes_in_order():
+  """
+  The copies finish in the order they were queued and waiting for a size finishes the queued files of that size.
+  """
+
+  finished = []
+  release = threading.Event()
+  copies = CopyPool(2, 100, lambda item, result: finished.append((item, result)))
+  copies.put('slow', 10, lambda: release.wait(5) and 'slow copied')
+  copies.put('fast', 20, lambda: 'fast copied')
+  copies.put('linked', 30)
+  assert finished == []
+  release.set()
+  copies.wait(20)
+  assert finished == [('slow', 'slow copied'), ('fast', 'fast copied')]
+  copies.close()
+  assert finished[-1] == ('linked', None)
+
+
+def test_copy_pool_waits_for_other_folders():
+  """
+  Waiting for a size queued by other folder finishes the own queued files first and waits until the other folder finishes the file, then the size is reserved until the file is queued.
+  """
+
+  finished = []
+  release = threading.Event()
+  pending = PendingSizes()
+  first = CopyPool(1, 100, lambda item, result: finished.append(item), pending=pending)
+  second = CopyPool(1, 100, lambda item, result: finished.append(item), pending=pending)
+  first.put('first', 10, lambda: release.wait(5))
+  second.put('second', 20, release.is_set)
+  waiting = threading.Thread(target=second.wait, args=(10, ))
+  waiting.start()
+  waiting.join(0.2)
+  assert waiting.is_alive()
+  assert finished == ['second']
+  release.set()
+  first.close()
+  waiting.join(5)
+  assert not waiting.is_alive()
+  assert finished == ['second', 'first']
+  assert not pending.reserve(10)
+  second.put('reserved', 10)
+  second.close()
+  assert pending.reserve(10)